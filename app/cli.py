@@ -0,0 +1,529 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Línea de comandos para convertir PDFs sin abrir la ventana.
+# No importa nada de Qt, y los módulos pesados (fitz, edge_tts) solo se cargan
+# cuando de verdad hay algo que convertir, para que arrancar sea rápido.
+#
+#   python main.py convert libros/*.pdf --out audios --jobs 4 --voice es-ES-AlvaroNeural --rate +10%
+#   python main.py convert libro.pdf --split-chapters --jobs 4          (un MP3 por capítulo + playlist)
+#   python main.py convert libro.pdf --split-chapters --chapters 3,7-8  (rehace solo esos capítulos)
+#   python main.py preview libro.pdf --pages 12-13 --out - | ffplay -nodisp -   (escuchar una voz)
+#   python main.py estimate libros/*.pdf --voice es-ES-ElviraNeural   (cuánto tardará, sin convertir)
+#
+# Modo servidor: un coordinador reparte los trozos entre trabajadores en esta u otras máquinas
+# (las rutas de los PDF y de la salida son las que ve el coordinador):
+#   python main.py serve --host 0.0.0.0 --port 8770 --token clave --out /datos/audios
+#   python main.py worker --server http://coordinador:8770 --token clave --concurrency 8   (tantos como se quiera)
+#   python main.py submit libros/*.pdf --server http://coordinador:8770 --token clave --out /datos/audios --wait
+#
+#   python main.py update        (descarga la última versión; se instala al abrir Narralib)
+
+DEFAULT_VOICE: str = "es-ES-AlvaroNeural"
+DEFAULT_RATE: str = "+0%"
+# argparse da formato con % a las ayudas: el de la velocidad por defecto va doblado
+RATE_HELP: str = f"Velocidad, ej. -10%% o +20%% (por defecto {DEFAULT_RATE.replace('%', '%%')})"
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="narralib", description="Convierte documentos PDF en audiolibros MP3.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert", help="Convierte uno o varios PDF a MP3")
+    convert.add_argument("inputs", nargs="+", help="Archivos PDF o patrones (ej. libros/*.pdf)")
+    convert.add_argument("--out", default=None, help="Carpeta de salida (por defecto, junto a cada PDF)")
+    convert.add_argument("--jobs", type=int, default=None,
+                         help="Documentos que se convierten a la vez (por defecto, según las conversiones anteriores)")
+    convert.add_argument("--voice", default=None, help=f"Voz a usar (por defecto la configurada o {DEFAULT_VOICE})")
+    convert.add_argument("--rate", default=None, help=RATE_HELP)
+    convert.add_argument("--tts-url", default=None, help="Usar un servidor TTS HTTP propio en lugar de Edge")
+    convert.add_argument("--split-chapters", action="store_true",
+                         help="Un MP3 por capítulo según el índice del PDF, más una lista .m3u8")
+    convert.add_argument("--chapters", default=None, type=parse_chapter_list,
+                         help="Con --split-chapters, convertir solo estos capítulos (ej. 3,7-9)")
+    convert.add_argument("--refresh-text", action="store_true",
+                         help="Volver a leer el texto de los PDF aunque esté en la caché")
+    convert.add_argument("--postprocess", action=argparse.BooleanOptionalAction, default=None,
+                         help="Recortar los silencios entre trozos e igualar el volumen (necesita numpy y ffmpeg; "
+                              "por defecto, lo configurado)")
+    convert.add_argument("--verbose", action="store_true", help="Mostrar también los tiempos de cada etapa")
+    convert.add_argument("--log-json", action="store_true", help="Escribir los logs en JSON (una línea por evento)")
+    convert.add_argument("--quiet", action="store_true", help="No mostrar el progreso por stderr")
+
+    preview = subparsers.add_parser("preview", help="Escucha una voz con el principio de un PDF o unas páginas")
+    preview.add_argument("input", nargs="?", default=None, help="PDF (sin él se lee una frase de ejemplo)")
+    preview.add_argument("--pages", default=None, help="Páginas a leer, ej. 12 o 12-14 (por defecto, el principio)")
+    preview.add_argument("--voice", default=None, help=f"Voz a usar (por defecto la configurada o {DEFAULT_VOICE})")
+    preview.add_argument("--rate", default=None, help=RATE_HELP)
+    preview.add_argument("--tts-url", default=None, help="Usar un servidor TTS HTTP propio en lugar de Edge")
+    preview.add_argument("--out", default="preview.mp3",
+                         help="Dónde escribir el audio según llega; - para la salida estándar (a un reproductor)")
+
+    estimate = subparsers.add_parser("estimate", help="Estima cuánto tardará y ocupará la conversión, sin hacerla")
+    estimate.add_argument("inputs", nargs="+", help="Archivos PDF o patrones (ej. libros/*.pdf)")
+    estimate.add_argument("--pages", default=None, help="Solo estas páginas, ej. 12-40")
+    estimate.add_argument("--voice", default=None, help=f"Voz a usar (por defecto la configurada o {DEFAULT_VOICE})")
+    estimate.add_argument("--rate", default=None, help=RATE_HELP)
+    estimate.add_argument("--tts-url", default=None, help="Estimar para un servidor TTS HTTP propio en lugar de Edge")
+
+    serve = subparsers.add_parser("serve", help="Coordinador: reparte la síntesis entre trabajadores")
+    serve.add_argument("inputs", nargs="*", help="PDF que se ponen en cola al arrancar")
+    serve.add_argument("--out", default=None, help="Carpeta de salida de esos PDF y de los enviados con submit "
+                                                   "(por defecto, junto a cada uno)")
+    serve.add_argument("--voice", default=None, help=f"Voz a usar (por defecto la configurada o {DEFAULT_VOICE})")
+    serve.add_argument("--rate", default=None, help=RATE_HELP)
+    serve.add_argument("--host", default="127.0.0.1", help="Dirección de escucha (0.0.0.0 para otras máquinas)")
+    serve.add_argument("--port", type=int, default=None, help="Puerto de escucha")
+    serve.add_argument("--token", default=None, help="Clave que deben enviar los trabajadores")
+    serve.add_argument("--lease-seconds", type=float, default=None,
+                       help="Segundos sin señales tras los que un trozo se da a otro trabajador")
+    serve.add_argument("--exit-when-done", action="store_true", help="Terminar cuando no queden documentos")
+    serve.add_argument("--log-json", action="store_true", help="Escribir los logs en JSON (una línea por evento)")
+
+    worker = subparsers.add_parser("worker", help="Trabajador: sintetiza los trozos que le da un coordinador")
+    worker.add_argument("--server", required=True, help="URL del coordinador, ej. http://127.0.0.1:8770")
+    worker.add_argument("--concurrency", type=int, default=None, help="Trozos a la vez")
+    worker.add_argument("--tts-url", default=None, help="Usar un servidor TTS HTTP propio en lugar de Edge")
+    worker.add_argument("--token", default=None, help="Clave del coordinador")
+    worker.add_argument("--name", default=None, help="Nombre con el que aparece en el coordinador")
+    worker.add_argument("--log-json", action="store_true", help="Escribir los logs en JSON (una línea por evento)")
+
+    submit = subparsers.add_parser("submit", help="Pone PDF en la cola de un coordinador")
+    submit.add_argument("inputs", nargs="+", help="Archivos PDF o patrones (ej. libros/*.pdf)")
+    submit.add_argument("--server", required=True, help="URL del coordinador, ej. http://127.0.0.1:8770")
+    submit.add_argument("--out", default=None, help="Carpeta de salida (por defecto, junto a cada PDF)")
+    submit.add_argument("--voice", default=None, help=f"Voz a usar (por defecto la configurada o {DEFAULT_VOICE})")
+    submit.add_argument("--rate", default=None, help=RATE_HELP)
+    submit.add_argument("--token", default=None, help="Clave del coordinador")
+    submit.add_argument("--wait", action="store_true", help="Esperar a que terminen y mostrar el resumen")
+
+    update = subparsers.add_parser("update", help="Descargar la última versión para instalarla al reiniciar")
+    update.add_argument("--check", action="store_true", help="Solo mirar si hay una versión nueva")
+    update.add_argument("--api-url", default=None, help="API de releases a consultar (por defecto, GitHub)")
+    update.add_argument("--parts", type=int, default=None, help="Peticiones de rango a la vez")
+    update.add_argument("--quiet", action="store_true", help="No mostrar el progreso por stderr")
+    return parser
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    # Expande los patrones aquí porque en Windows la consola no lo hace
+    archivos: List[str] = []
+    for patron in patterns:
+        coincidencias = sorted(glob.glob(patron)) if glob.has_magic(patron) else [patron]
+        archivos.extend(c for c in coincidencias if c.lower().endswith(".pdf"))
+    # Sin duplicados, manteniendo el orden
+    return list(dict.fromkeys(archivos))
+
+def output_path_for(pdf_path: str, out_dir: Optional[str]) -> str:
+    nombre: str = os.path.splitext(os.path.basename(pdf_path))[0] + ".mp3"
+    return os.path.join(out_dir or os.path.dirname(os.path.abspath(pdf_path)), nombre)
+
+def parse_chapter_list(texto: Optional[str]) -> Optional[Set[int]]:
+    # "3,7-9" -> {3, 7, 8, 9} (numerados desde 1, como en los nombres de archivo).
+    # Es el type= de --chapters: si no vale, argparse muestra el error y sale con 2
+    if not texto:
+        return None
+    numeros: Set[int] = set()
+    for parte in texto.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        m = re.fullmatch(r'(\d+)(?:\s*-\s*(\d+))?', parte)
+        if not m:
+            raise argparse.ArgumentTypeError(f"capítulos no válidos: {parte!r} (ej. 3,7-9)")
+        desde: int = int(m.group(1))
+        hasta: int = int(m.group(2) or desde)
+        if desde < 1 or hasta < desde:
+            raise argparse.ArgumentTypeError(f"rango de capítulos no válido: {parte!r}")
+        numeros.update(range(desde, hasta + 1))
+    if not numeros:
+        raise argparse.ArgumentTypeError(f"no se indicó ningún capítulo: {texto!r}")
+    return numeros
+
+def make_job(pdf_path: str, output_path: str, voice: str, rate: str, quiet: bool,
+             tts_url: Optional[str] = None, pages: Optional[Tuple[int, int]] = None,
+             postprocess: Optional[bool] = None):
+    from app.core.converter import ConversionJob
+    from app.core.tts_engine import HttpTTSBackend
+
+    etiqueta: str = os.path.basename(output_path if pages else pdf_path)
+
+    def estado(texto: str) -> None:
+        if not quiet:
+            print(f"[{etiqueta}] {texto}", file=sys.stderr, flush=True)
+
+    backend = HttpTTSBackend(tts_url) if tts_url else None
+    return ConversionJob(pdf_path, voice, rate, output_path, on_status=estado, backend=backend, pages=pages,
+                         postprocess=postprocess)
+
+def convert_one(job) -> Dict[str, Any]:
+    success, message = job.run()
+    resultado: Dict[str, Any] = job.summary()
+    resultado.update({"ok": success, "message": message, "cancelled": job.cancelled})
+    return resultado
+
+def run_convert(args: argparse.Namespace) -> int:
+    import logging
+    from app.core.metrics import configure_logging
+    configure_logging(logging.DEBUG if args.verbose else logging.WARNING, json_format=args.log_json)
+
+    archivos: List[str] = expand_inputs(args.inputs)
+    if not archivos:
+        print("No se encontró ningún PDF.", file=sys.stderr)
+        return 2
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    from app.core.config_manager import ConfigManager
+    config = ConfigManager()
+    voice: str = args.voice or config.get("voice", DEFAULT_VOICE)
+    rate: str = args.rate or config.get("rate", DEFAULT_RATE)
+
+    if args.refresh_text:
+        from app.core.pdf_reader import text_cache
+        cache = text_cache()
+        if cache is not None:
+            for pdf in archivos:
+                cache.invalidate(pdf)
+
+    # Unidades de trabajo: (pdf, salida, páginas). Con --split-chapters cada capítulo
+    # es una unidad independiente, así los capítulos de un libro se convierten en paralelo.
+    unidades: List[Tuple[str, str, Optional[Tuple[int, int]]]] = []
+    libros: Dict[str, Tuple[str, list]] = {}
+    if args.split_chapters:
+        from app.core.chapters import plan_chapters, chapters_dir
+        seleccion: Optional[Set[int]] = args.chapters
+        for pdf in archivos:
+            capitulos = plan_chapters(pdf, int(config.get("chapter_level", 1)))
+            if not capitulos:
+                print(f"[{os.path.basename(pdf)}] Sin índice: se convierte entero", file=sys.stderr)
+                unidades.append((pdf, output_path_for(pdf, args.out), None))
+                continue
+            carpeta: str = chapters_dir(pdf, args.out)
+            os.makedirs(carpeta, exist_ok=True)
+            libros[pdf] = (carpeta, capitulos)
+            for capitulo in capitulos:
+                if seleccion is None or capitulo.index + 1 in seleccion:
+                    unidades.append((pdf, os.path.join(carpeta, capitulo.filename), capitulo.pages))
+    else:
+        unidades = [(pdf, output_path_for(pdf, args.out), None) for pdf in archivos]
+
+    trabajos: Optional[int] = args.jobs
+    if trabajos is None:
+        # Tantos documentos a la vez como quepan en las conexiones TTS según lo aprendido
+        from app.core.estimator import plan_concurrency
+        trabajos = plan_concurrency()[0]
+
+    if not args.quiet:
+        from app.core.estimator import estimate_job
+        backend_name: Optional[str] = "HttpTTSBackend" if args.tts_url else None
+        for pdf, salida, paginas in unidades:
+            estimacion = estimate_job(pdf, voice, rate, paginas, backend=backend_name)
+            etiqueta: str = os.path.basename(salida if paginas else pdf)
+            print(f"[{etiqueta}] Estimado: {estimacion.describe()}", file=sys.stderr, flush=True)
+
+    inicio: float = time.monotonic()
+    resultados: List[Dict[str, Any]] = []
+    conversiones = [make_job(pdf, salida, voice, rate, args.quiet, args.tts_url, paginas, args.postprocess)
+                    for pdf, salida, paginas in unidades]
+    interrumpido: bool = False
+    # Cada unidad corre en su propio hilo con su propio bucle asyncio;
+    # la lectura de PDFs grandes ya reparte el trabajo entre procesos.
+    # Lo que los trabajos guardan en la configuración se escribe una sola vez al final.
+    pool = ThreadPoolExecutor(max_workers=max(1, trabajos))
+    with config.batch():
+        futuros = {pool.submit(convert_one, job): job for job in conversiones}
+        pendientes = set(futuros)
+
+        def recoger(futuro) -> None:
+            pendientes.discard(futuro)
+            job = futuros[futuro]
+            if futuro.cancelled():
+                resultados.append({"pdf": job.pdf_path, "output": job.output_path, "ok": False,
+                                   "cancelled": True, "message": "Conversión cancelada"})
+                return
+            try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                resultados.append({"pdf": job.pdf_path, "output": job.output_path, "ok": False,
+                                   "message": str(e)})
+
+        try:
+            for futuro in as_completed(futuros):
+                recoger(futuro)
+        except KeyboardInterrupt:
+            # Ctrl+C: se cancelan los que están en marcha (su .part y su manifiesto se
+            # quedan para retomar) y los que esperaban en cola ya no empiezan
+            interrumpido = True
+            print("Cancelando...", file=sys.stderr, flush=True)
+            for job in conversiones:
+                job.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+            for futuro in list(pendientes):
+                recoger(futuro)
+        finally:
+            pool.shutdown(wait=True)
+
+    orden = {(pdf, salida): i for i, (pdf, salida, _) in enumerate(unidades)}
+    resultados.sort(key=lambda r: orden.get((r["pdf"], r.get("output")), len(orden)))
+
+    # La lista de reproducción incluye todos los capítulos que existan, no solo los de esta vez
+    listas: Dict[str, str] = {}
+    if libros:
+        from app.core.chapters import write_playlist
+        for pdf, (carpeta, capitulos) in libros.items():
+            listas[pdf] = write_playlist(carpeta, os.path.basename(carpeta), capitulos)
+    fallidos: int = sum(1 for r in resultados if not r["ok"])
+    resumen: Dict[str, Any] = {
+        "total": len(resultados),
+        "ok": len(resultados) - fallidos,
+        "failed": fallidos,
+        "seconds": round(time.monotonic() - inicio, 3),
+        "jobs": resultados,
+    }
+    if listas:
+        resumen["playlists"] = listas
+    if interrumpido:
+        resumen["interrupted"] = True
+    # El resumen va a stdout en JSON para poder procesarlo desde scripts
+    json.dump(resumen, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    if interrumpido:
+        # Lo mismo que devuelve la consola tras Ctrl+C
+        return 130
+    return 1 if fallidos else 0
+
+def run_preview(args: argparse.Namespace) -> int:
+    from app.core.config_manager import ConfigManager
+    from app.core.preview import VoicePreview, parse_page_range
+    from app.core.tts_engine import HttpTTSBackend
+
+    paginas: Optional[Tuple[int, int]] = None
+    if args.pages:
+        paginas = parse_page_range(args.pages)
+        if paginas is None:
+            print(f"Rango de páginas no válido: {args.pages}", file=sys.stderr)
+            return 2
+
+    config = ConfigManager()
+    voice: str = args.voice or config.get("voice", DEFAULT_VOICE)
+    rate: str = args.rate or config.get("rate", DEFAULT_RATE)
+    backend = HttpTTSBackend(args.tts_url) if args.tts_url else None
+
+    # El audio se escribe según llega, así un reproductor puede ir leyéndolo
+    salida = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        def escribir(data: bytes) -> None:
+            salida.write(data)
+            salida.flush()
+
+        vista = VoicePreview(args.input, voice, rate, escribir, pages=paginas, backend=backend)
+        success, message = vista.run()
+    finally:
+        if salida is not sys.stdout.buffer:
+            salida.close()
+
+    resultado: Dict[str, Any] = vista.summary()
+    resultado.update({"ok": success, "message": message, "output": args.out})
+    # Con el audio en stdout, el resumen va a stderr
+    json.dump(resultado, sys.stderr if args.out == "-" else sys.stdout, ensure_ascii=False, indent=2)
+    print(file=sys.stderr if args.out == "-" else sys.stdout)
+    return 0 if success else 1
+
+def run_estimate(args: argparse.Namespace) -> int:
+    archivos: List[str] = expand_inputs(args.inputs)
+    if not archivos:
+        print("No se encontró ningún PDF.", file=sys.stderr)
+        return 2
+
+    from app.core.config_manager import ConfigManager
+    from app.core.preview import parse_page_range
+    from app.core.estimator import estimate_job, plan_concurrency
+
+    paginas: Optional[Tuple[int, int]] = None
+    if args.pages:
+        paginas = parse_page_range(args.pages)
+        if paginas is None:
+            print(f"Rango de páginas no válido: {args.pages}", file=sys.stderr)
+            return 2
+
+    config = ConfigManager()
+    voice: str = args.voice or config.get("voice", DEFAULT_VOICE)
+    rate: str = args.rate or config.get("rate", DEFAULT_RATE)
+    backend_name: Optional[str] = "HttpTTSBackend" if args.tts_url else None
+
+    resultados: List[Dict[str, Any]] = []
+    for pdf in archivos:
+        estimacion = estimate_job(pdf, voice, rate, paginas, backend=backend_name)
+        datos: Dict[str, Any] = {"pdf": pdf, "voice": voice, "rate": rate}
+        datos.update(estimacion._asdict())
+        datos.update({
+            "audio_seconds": round(estimacion.audio_seconds, 1),
+            "synthesis_seconds": round(estimacion.synthesis_seconds, 1),
+            "summary": estimacion.describe(),
+        })
+        resultados.append(datos)
+
+    trabajos, concurrencia = plan_concurrency()
+    json.dump({"parallel_jobs": trabajos, "concurrency": concurrencia, "jobs": resultados},
+              sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+def run_serve(args: argparse.Namespace) -> int:
+    import asyncio
+    import logging
+    from app.core.metrics import configure_logging
+    from app.core.config_manager import ConfigManager
+    from app.core.job_server import JobCoordinator, DEFAULT_SERVER_PORT
+    configure_logging(logging.INFO, json_format=args.log_json)
+
+    archivos: List[str] = expand_inputs(args.inputs)
+    if args.inputs and not archivos:
+        print("No se encontró ningún PDF.", file=sys.stderr)
+        return 2
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    config = ConfigManager()
+    coordinador = JobCoordinator(lease_seconds=args.lease_seconds, token=args.token, output_dir=args.out)
+    for pdf in archivos:
+        coordinador.submit(pdf, output_path_for(pdf, args.out), args.voice or config.get("voice", DEFAULT_VOICE),
+                           args.rate or config.get("rate", DEFAULT_RATE))
+    try:
+        asyncio.run(coordinador.serve(args.host, args.port or int(config.get("server_port", DEFAULT_SERVER_PORT)),
+                                      until_done=args.exit_when_done))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        pass
+
+    resumen: Dict[str, Any] = coordinador.status()
+    json.dump(resumen["jobs"], sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 1 if any(job["state"] == "failed" for job in resumen["jobs"]) else 0
+
+def run_worker(args: argparse.Namespace) -> int:
+    import logging
+    from app.core.metrics import configure_logging
+    from app.core.config_manager import ConfigManager
+    from app.core.job_server import JobWorker
+    from app.core.tts_engine import HttpTTSBackend, DEFAULT_CONCURRENCY
+    configure_logging(logging.INFO, json_format=args.log_json)
+
+    backend = HttpTTSBackend(args.tts_url) if args.tts_url else None
+    concurrencia: int = args.concurrency or int(ConfigManager().get("tts_concurrency", DEFAULT_CONCURRENCY))
+    trabajador = JobWorker(args.server, backend=backend, concurrency=concurrencia, name=args.name, token=args.token)
+    try:
+        trabajador.run()
+    except KeyboardInterrupt:
+        # Lo que tenía prestado se reparte a otros cuando caduque
+        pass
+    return 0
+
+def _api(server: str, method: str, path: str, token: Optional[str], body: Optional[Dict[str, Any]] = None) -> Any:
+    import urllib.request
+    from app.core.job_server import TOKEN_HEADER
+    peticion = urllib.request.Request(server.rstrip("/") + path, method=method,
+                                      data=json.dumps(body).encode("utf-8") if body is not None else None,
+                                      headers={"Content-Type": "application/json"})
+    if token:
+        peticion.add_header(TOKEN_HEADER, token)
+    with urllib.request.urlopen(peticion, timeout=30) as respuesta:
+        return json.load(respuesta)
+
+def run_submit(args: argparse.Namespace) -> int:
+    import urllib.error
+    archivos: List[str] = expand_inputs(args.inputs)
+    if not archivos:
+        print("No se encontró ningún PDF.", file=sys.stderr)
+        return 2
+
+    trabajos: List[Dict[str, Any]] = []
+    try:
+        for pdf in archivos:
+            datos: Dict[str, Any] = {"pdf": os.path.abspath(pdf), "voice": args.voice, "rate": args.rate,
+                                     "output": os.path.abspath(output_path_for(pdf, args.out))}
+            trabajos.append(_api(args.server, "POST", "/api/jobs", args.token, datos))
+            print(f"[{os.path.basename(pdf)}] En cola como {trabajos[-1]['job']}", file=sys.stderr, flush=True)
+
+        # Se pregunta cada poco por los que siguen en marcha
+        while args.wait and any(t["state"] in ("queued", "running", "finishing") for t in trabajos):
+            time.sleep(1.0)
+            trabajos = [_api(args.server, "GET", f"/api/jobs/{t['job']}", args.token)
+                        if t["state"] in ("queued", "running", "finishing") else t for t in trabajos]
+    except (urllib.error.URLError, OSError) as e:
+        print(f"No se pudo hablar con el coordinador: {e}", file=sys.stderr)
+        return 1
+
+    json.dump(trabajos, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 1 if any(t["state"] == "failed" for t in trabajos) else 0
+
+def run_update(args: argparse.Namespace) -> int:
+    import asyncio
+    import zipfile
+    import aiohttp
+    from app import __version__
+    from app.core.update_download import download_latest, fetch_release, is_newer, install_dir, USER_AGENT
+
+    resumen: Dict[str, Any] = {"current": __version__}
+    try:
+        if args.check:
+            async def consultar():
+                async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+                    return await fetch_release(session, args.api_url)
+
+            info = asyncio.run(consultar())
+            resumen.update({"latest": info.version, "newer": is_newer(info.version, __version__),
+                            "asset": info.asset.name if info.asset else None,
+                            "sha256": info.asset.sha256 if info.asset else None})
+        else:
+            ultimo: List[int] = [-1]
+
+            def progreso(hecho: int, total: int) -> None:
+                porcentaje: int = hecho * 100 // total if total else 0
+                if not args.quiet and porcentaje // 10 != ultimo[0]:
+                    ultimo[0] = porcentaje // 10
+                    print(f"[update] {porcentaje}% ({hecho / (1024 * 1024):.1f} MB)", file=sys.stderr, flush=True)
+
+            inicio: float = time.monotonic()
+            info, preparada = asyncio.run(download_latest(__version__, args.api_url, args.parts, progreso))
+            resumen.update({"latest": info.version, "staged": str(preparada) if preparada else None,
+                            "seconds": round(time.monotonic() - inicio, 3)})
+            if preparada is not None and install_dir() is None:
+                resumen["message"] = "Preparada; solo se instala sola en la versión compilada"
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, zipfile.BadZipFile) as e:
+        # Sin conexión, error HTTP, release sin ZIP o sin sha256, suma que no coincide...
+        resumen["error"] = str(e) or type(e).__name__
+    json.dump(resumen, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 1 if "error" in resumen else 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "convert":
+        return run_convert(args)
+    if args.command == "preview":
+        return run_preview(args)
+    if args.command == "estimate":
+        return run_estimate(args)
+    if args.command == "serve":
+        return run_serve(args)
+    if args.command == "worker":
+        return run_worker(args)
+    if args.command == "submit":
+        return run_submit(args)
+    if args.command == "update":
+        return run_update(args)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,497 @@
-from pydub import AudioSegment
+import io
 import os
+import threading
+from typing import BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.core import metrics
+
+# Tablas de la cabecera de un frame MPEG de audio (kbps y Hz)
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+_VERSIONS = {0: 25, 2: 2, 3: 1}
+_LAYERS = {1: 3, 2: 2, 3: 1}
+
+# Tamaño de lectura de los archivos de entrada
+READ_BLOCK: int = 256 * 1024
+# Puntos de la tabla de búsqueda que guardamos mientras copiamos frames (memoria fija)
+_MAX_SEEK_POINTS: int = 1024
+# Trozos que el escritor en streaming puede guardar en memoria esperando al que falta
+DEFAULT_REORDER_CHUNKS: int = 32
+
+class FrameHeader(NamedTuple):
+    version: int        # 1, 2 o 25 (MPEG 2.5)
+    layer: int          # 1, 2 o 3
+    bitrate: int        # kbps
+    sample_rate: int    # Hz
+    padding: int
+    mono: bool
+    length: int         # bytes del frame completo
+
+    @property
+    def stream_format(self) -> Tuple[int, int, int, bool]:
+        # Lo que tiene que coincidir para poder pegar dos archivos sin recodificar
+        return (self.version, self.layer, self.sample_rate, self.mono)
+
+    @property
+    def samples(self) -> int:
+        # Muestras de audio por frame
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and self.version != 1:
+            return 576
+        return 1152
+
+    @property
+    def side_info_size(self) -> int:
+        # Bytes entre la cabecera y donde va la etiqueta Xing/Info (solo layer III)
+        if self.version == 1:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+# Interpreta 4 bytes como cabecera de frame MPEG; devuelve None si no lo son
+def parse_frame_header(data: bytes) -> Optional[FrameHeader]:
+    if len(data) < 4 or data[0] != 0xFF or (data[1] & 0xE0) != 0xE0:
+        return None
+
+    version = _VERSIONS.get((data[1] >> 3) & 0x03)
+    layer = _LAYERS.get((data[1] >> 1) & 0x03)
+    bitrate_index = (data[2] >> 4) & 0x0F
+    sr_index = (data[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sr_index == 3:
+        return None
+
+    bitrate = _BITRATES[(min(version, 2), layer)][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][sr_index]
+    padding = (data[2] >> 1) & 0x01
+    mono = ((data[3] >> 6) & 0x03) == 3
+
+    if layer == 1:
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        length = 72 * bitrate * 1000 // sample_rate + padding
+    else:
+        length = 144 * bitrate * 1000 // sample_rate + padding
+
+    return FrameHeader(version, layer, bitrate, sample_rate, padding, mono, length)
+
+def _id3v2_size(data: bytes) -> int:
+    # Tamaño de una etiqueta ID3v2 al principio del archivo (0 si no hay)
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _is_vbr_info_frame(frame: bytes, header: FrameHeader) -> bool:
+    # Frames Xing/Info/VBRI: no llevan audio, solo datos de duración del archivo original
+    if header.layer != 3:
+        return False
+    offset = 4 + header.side_info_size
+    return frame[offset:offset + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+# Recorre los frames de audio de un MP3 leyendo por bloques, sin decodificar nada.
+# Se salta etiquetas ID3v2/ID3v1, frames Xing/Info y basura entre frames.
+def iter_mp3_frames(path: str) -> Iterator[Tuple[FrameHeader, bytes]]:
+    with open(path, "rb") as f:
+        yield from _iter_frames(f)
+
+# Lo mismo sobre un MP3 que ya está en memoria (el audio de un trozo recién sintetizado)
+def iter_mp3_frames_bytes(data: bytes) -> Iterator[Tuple[FrameHeader, bytes]]:
+    yield from _iter_frames(io.BytesIO(data))
+
+def _iter_frames(f: BinaryIO) -> Iterator[Tuple[FrameHeader, bytes]]:
+    buffer = bytearray(f.read(READ_BLOCK))
+    pos = _id3v2_size(buffer)
+    # La etiqueta puede ser más grande que el primer bloque
+    while pos > len(buffer):
+        pos -= len(buffer)
+        buffer = bytearray(f.read(READ_BLOCK))
+        if not buffer:
+            return
+
+    formato = None
+    primero = True
+    fin_archivo = False
+
+    while True:
+        # Rellenamos el buffer cuando queda poco para un frame completo
+        if not fin_archivo and len(buffer) - pos < 8192:
+            del buffer[:pos]
+            pos = 0
+            bloque = f.read(READ_BLOCK)
+            if bloque:
+                buffer += bloque
+            else:
+                fin_archivo = True
+
+        if len(buffer) - pos < 4:
+            return
+
+        header = parse_frame_header(bytes(buffer[pos:pos + 4]))
+        if header is None or (formato is not None and header.stream_format != formato):
+            # ID3v1 al final del archivo
+            if buffer[pos:pos + 3] == b"TAG" and fin_archivo and len(buffer) - pos == 128:
+                return
+            # Buscamos la siguiente sincronización
+            siguiente = buffer.find(b"\xFF", pos + 1)
+            if siguiente < 0:
+                pos = len(buffer)
+            else:
+                pos = siguiente
+            continue
+
+        if len(buffer) - pos < header.length:
+            if fin_archivo:
+                # Frame cortado al final: no se puede reproducir bien, lo descartamos
+                return
+            continue
+
+        frame = bytes(buffer[pos:pos + header.length])
+        pos += header.length
+        formato = header.stream_format
+
+        if primero:
+            primero = False
+            if _is_vbr_info_frame(frame, header):
+                continue
+        yield header, frame
+
+# Duración en segundos de un MP3, contando sus frames (sin decodificar)
+def mp3_duration(path: str) -> float:
+    return sum(header.samples / header.sample_rate for header, _ in iter_mp3_frames(path))
+
+def _first_frame(path: str) -> Optional[Tuple[FrameHeader, bytes]]:
+    for header, frame in iter_mp3_frames(path):
+        return header, frame
+    return None
+
+# Construye un frame Xing/Info vacío con el número de frames, bytes y tabla de búsqueda,
+# para que los reproductores calculen bien la duración y puedan saltar a cualquier punto.
+def build_xing_frame(template: FrameHeader, raw_header: bytes, frames: int, total_bytes: int,
+                     toc: List[int], vbr: bool) -> bytes:
+    offset = 4 + template.side_info_size
+    necesario = offset + 4 + 4 + 4 + 4 + 100
+
+    # Buscamos el bitrate más bajo con el que quepa la etiqueta (sin padding ni CRC)
+    for indice in range(1, 15):
+        cabecera = bytes([
+            raw_header[0],
+            raw_header[1] | 0x01,
+            (indice << 4) | (raw_header[2] & 0x0C),
+            raw_header[3],
+        ])
+        info = parse_frame_header(cabecera)
+        if info is not None and info.length >= necesario:
+            break
+    else:
+        raise ValueError("No cabe la cabecera Xing en ningún bitrate")
+
+    frame = bytearray(info.length)
+    frame[0:4] = cabecera
+    frame[offset:offset + 4] = b"Xing" if vbr else b"Info"
+    # Flags: número de frames (1), número de bytes (2) y tabla de búsqueda (4)
+    frame[offset + 4:offset + 8] = (0x07).to_bytes(4, "big")
+    # Los frames son solo los de audio; los bytes incluyen el propio frame Xing
+    frame[offset + 8:offset + 12] = frames.to_bytes(4, "big")
+    frame[offset + 12:offset + 16] = (total_bytes + info.length).to_bytes(4, "big")
+    frame[offset + 16:offset + 116] = bytes(toc)
+    return bytes(frame)
+
+# Cuenta los frames que se van copiando y guarda algunos (frame, byte) para la tabla
+# de búsqueda de la cabecera Xing. Cuando se llena nos quedamos con uno de cada dos y
+# espaciamos más los siguientes, así la memoria es fija sea cual sea el largo del libro.
+class _FrameStats:
+    def __init__(self) -> None:
+        self.frames: int = 0
+        self.total_bytes: int = 0
+        self.seconds: float = 0.0
+        self.bitrates: set = set()
+        self.puntos: List[Tuple[int, int]] = []
+        self._paso: int = 1
+
+    def add(self, header: FrameHeader, size: int) -> None:
+        if self.frames % self._paso == 0:
+            self.puntos.append((self.frames, self.total_bytes))
+            if len(self.puntos) >= _MAX_SEEK_POINTS:
+                self.puntos = self.puntos[::2]
+                self._paso *= 2
+        self.frames += 1
+        self.total_bytes += size
+        self.seconds += header.samples / header.sample_rate
+        self.bitrates.add(header.bitrate)
+
+    def toc(self, reservado: int) -> List[int]:
+        # Tabla de 100 entradas: posición (0-255) del archivo donde empieza cada 1% del audio
+        toc = []
+        j = 0
+        total = self.total_bytes + reservado
+        for i in range(100):
+            objetivo = i * self.frames // 100
+            while j + 1 < len(self.puntos) and self.puntos[j + 1][0] <= objetivo:
+                j += 1
+            byte = self.puntos[j][1] + reservado if self.puntos else 0
+            toc.append(min(255, byte * 256 // max(1, total)))
+        return toc
+
+    def xing_frame(self, plantilla: FrameHeader, raw_header: bytes, reservado: int) -> bytes:
+        return build_xing_frame(plantilla, raw_header, self.frames, self.total_bytes,
+                                self.toc(reservado), vbr=len(self.bitrates) > 1)
+
+def _xing_size(plantilla: FrameHeader, raw_header: bytes) -> int:
+    return len(build_xing_frame(plantilla, raw_header, 0, 0, [0] * 100, False))
+
+# Escribe el MP3 final a medida que llegan los trozos sintetizados, sin archivos por
+# trozo ni una segunda pasada para unirlos. Los trozos pueden llegar en cualquier
+# orden: se guardan en memoria hasta que llega el que toca y entonces se copian sus
+# frames al final de <salida>.part. Al terminar se rellena la cabecera Xing, se hace
+# fsync y se renombra a la salida de forma atómica: nunca queda un MP3 a medias con
+# el nombre final. El .part sirve para retomar: resume() lo recorta a lo confirmado.
+class StreamingMp3Writer:
+    def __init__(self, output_path: str, max_pending: int = DEFAULT_REORDER_CHUNKS,
+                 on_commit: Optional[Callable[[int, int], None]] = None) -> None:
+        self.output_path: str = output_path
+        self.part_path: str = output_path + ".part"
+        self.max_pending: int = max(1, max_pending)
+        # on_commit(trozos, bytes) se llama cada vez que se escribe el siguiente trozo
+        self.on_commit = on_commit
+        self.next_index: int = 0
+        self._pending: Dict[int, bytes] = {}
+        self._stats: _FrameStats = _FrameStats()
+        self._plantilla: Optional[FrameHeader] = None
+        self._raw_header: bytes = b""
+        self._reservado: int = 0
+        self._file: Optional[BinaryIO] = None
+        self._cond: threading.Condition = threading.Condition()
+        self._closed: bool = False
+
+    def _open(self, mode: str) -> BinaryIO:
+        if self._file is None:
+            directorio = os.path.dirname(os.path.abspath(self.part_path))
+            os.makedirs(directorio, exist_ok=True)
+            self._file = open(self.part_path, mode)
+        return self._file
+
+    def resume(self, chunks: int, nbytes: int) -> int:
+        # Retoma un .part anterior con los primeros `chunks` trozos ya escritos (nbytes).
+        # Si el archivo no está o es más corto de lo apuntado, se empieza de cero.
+        # Devuelve cuántos trozos se conservan.
+        with self._cond:
+            self._pending.clear()
+            self._stats = _FrameStats()
+            self._plantilla = None
+            self.next_index = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+            try:
+                tamano = os.path.getsize(self.part_path)
+            except OSError:
+                tamano = -1
+            if chunks <= 0 or nbytes <= 0 or tamano < nbytes:
+                self._open("wb")
+                return 0
+
+            f = self._open("r+b")
+            f.truncate(nbytes)
+            f.seek(0)
+            # El hueco de la cabecera Xing son ceros, así que el recorrido lo salta solo
+            for header, frame in _iter_frames(f):
+                if self._plantilla is None:
+                    self._plantilla, self._raw_header = header, frame[:4]
+                    self._reservado = _xing_size(header, frame[:4]) if header.layer == 3 else 0
+                self._stats.add(header, len(frame))
+            f.seek(nbytes)
+            self.next_index = chunks
+            return chunks
+
+    def wait_for_room(self, index: int, timeout: Optional[float] = None) -> bool:
+        # Para el productor de trozos: espera a que el trozo `index` quepa en la ventana
+        # de reordenación, así la memoria queda acotada aunque un trozo se retrase
+        with self._cond:
+            return self._cond.wait_for(lambda: self._closed or index < self.next_index + self.max_pending,
+                                       timeout)
+
+    def add(self, index: int, audio: bytes) -> None:
+        with self._cond:
+            if index < self.next_index:
+                return
+            self._pending[index] = audio
+            escrito: bool = False
+            while self.next_index in self._pending:
+                self._write_chunk(self._pending.pop(self.next_index))
+                self.next_index += 1
+                escrito = True
+                # Lo apuntado como hecho tiene que estar ya en el archivo. Se avisa trozo
+                # a trozo para que se sepa dónde acaba cada uno (ver revisions)
+                self._file.flush()
+                if self.on_commit:
+                    self.on_commit(self.next_index, self._file.tell())
+            if escrito:
+                self._cond.notify_all()
+
+    def _write_chunk(self, audio: bytes) -> None:
+        f = self._open("wb")
+        antes: int = self._stats.total_bytes
+        for header, frame in iter_mp3_frames_bytes(audio):
+            if self._plantilla is None:
+                self._plantilla, self._raw_header = header, frame[:4]
+                if header.layer == 3:
+                    # Dejamos hueco para la cabecera Xing, que se rellena al final
+                    self._reservado = _xing_size(header, frame[:4])
+                    f.write(b"\x00" * self._reservado)
+            elif header.stream_format != self._plantilla.stream_format:
+                raise ValueError("El servicio devolvió audio en otro formato MP3")
+            f.write(frame)
+            self._stats.add(header, len(frame))
+        metrics.incr("mux_bytes", self._stats.total_bytes - antes)
+
+    @property
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def audio_seconds(self) -> float:
+        # Duración de lo escrito hasta ahora (también lo conservado al retomar)
+        with self._cond:
+            return self._stats.seconds
+
+    @property
+    def audio_bytes(self) -> int:
+        # Tamaño del MP3, cabecera Xing incluida
+        with self._cond:
+            return self._stats.total_bytes + self._reservado
+
+    def finish(self) -> None:
+        # Rellena la cabecera, asegura los datos en disco y pone el archivo en su sitio
+        with self._cond:
+            if self._pending:
+                raise ValueError(f"Faltan trozos de audio (se esperaba el {self.next_index})")
+            if self._plantilla is None:
+                raise ValueError("No hay frames MP3 que escribir")
+            f = self._file
+            if self._reservado:
+                f.seek(0)
+                f.write(self._stats.xing_frame(self._plantilla, self._raw_header, self._reservado))
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            self._file = None
+            self._closed = True
+            self._cond.notify_all()
+            os.replace(self.part_path, self.output_path)
+            _fsync_dir(os.path.dirname(os.path.abspath(self.output_path)))
+            metrics.incr("mux_frames", self._stats.frames)
+
+    def close(self, remove: bool = False) -> None:
+        # Cierra sin terminar; el .part se queda para retomar salvo que se pida borrarlo
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._pending.clear()
+            self._closed = True
+            self._cond.notify_all()
+        if remove:
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+
+def _fsync_dir(path: str) -> None:
+    # Para que el renombrado también sobreviva a un corte de luz (en Windows no se puede)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 # Este módulo se encarga de trabajar con los archivos de audio, como unirlos si es necesario.
 class AudioBuilder:
     def combine_mp3(self, file_list, output_file):
         if not file_list:
             return False
-            
+
+        try:
+            with metrics.span("mux"):
+                return self._concat_frames(file_list, output_file)
+        except ValueError:
+            # Los archivos no comparten formato: hay que decodificar y recodificar
+            metrics.incr("mux_reencodes")
+            with metrics.span("mux_reencode"):
+                return self._combine_reencode(file_list, output_file)
+        except Exception as e:
+            metrics.record_error("mux", e, "Error al unir audios")
+            return False
+
+    def _concat_frames(self, file_list, output_file):
+        # Une los MP3 copiando sus frames tal cual, sin pasar por PCM: la memoria es
+        # constante y el tiempo depende solo de la lectura y escritura en disco.
+        primeros = [_first_frame(path) for path in file_list]
+        primeros = [p for p in primeros if p is not None]
+        if not primeros:
+            raise ValueError("No hay frames MP3 en los archivos de entrada")
+        if len({h.stream_format for h, _ in primeros}) > 1:
+            raise ValueError("Los archivos tienen formatos MP3 distintos")
+
+        # La cabecera Xing se construye a partir del primer frame de audio
+        plantilla, primer_frame = primeros[0]
+        raw_header = primer_frame[:4]
+        escribir_xing = plantilla.layer == 3
+
+        stats = _FrameStats()
+
+        with open(output_file, "wb") as salida:
+            reservado = 0
+            if escribir_xing:
+                # Dejamos hueco para la cabecera Xing, que se rellena al final
+                reservado = _xing_size(plantilla, raw_header)
+                salida.write(b"\x00" * reservado)
+
+            for path in file_list:
+                for header, frame in iter_mp3_frames(path):
+                    salida.write(frame)
+                    stats.add(header, len(frame))
+
+            if escribir_xing:
+                salida.seek(0)
+                salida.write(stats.xing_frame(plantilla, raw_header, reservado))
+
+        metrics.incr("mux_frames", stats.frames)
+        metrics.incr("mux_bytes", stats.total_bytes)
+
+        return True
+
+    def _combine_reencode(self, file_list, output_file):
+        # Camino lento: decodifica todo con pydub y vuelve a codificar
+        from pydub import AudioSegment
+
         combined = AudioSegment.empty()
-        
+
         try:
             for file in file_list:
                 # Cargamos cada audio
                 audio = AudioSegment.from_mp3(file)
                 combined += audio
-                
+
             # Guardamos el resultado final
             combined.export(output_file, format="mp3")
             return True
         except Exception as e:
-            print(f"Error al unir audios: {e}")
+            metrics.record_error("mux", e, "Error al unir audios")
             return False
 
     def check_audio_exists(self, path):
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.core import metrics
+from app.core.config_manager import ConfigManager
+
+# Tamaño máximo por defecto de la caché de audio (en MB)
+DEFAULT_CACHE_MB: int = 1024
+# Se sube si cambia la forma de generar las claves o el audio guardado
+CACHE_VERSION: str = "1"
+# Al pasarse del límite se borra hasta esta fracción de él, así el recorrido de la
+# carpeta se hace de vez en cuando y no con cada trozo nuevo
+EVICT_LOW_WATER: float = 0.9
+
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+# Normaliza el texto para que diferencias de espacios no cambien la clave
+def normalize_chunk_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+# Caché en disco de trozos de audio ya sintetizados.
+# Cada entrada es un MP3 cuyo nombre es el hash de (texto normalizado, voz, velocidad).
+# El orden LRU se guarda en la fecha de modificación de los archivos, así varios
+# procesos pueden compartir la misma carpeta sin un índice aparte.
+class AudioCache:
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: Optional[int] = None) -> None:
+        config: ConfigManager = ConfigManager()
+        self.cache_dir: Path = Path(cache_dir) if cache_dir else config.config_dir / "cache" / "audio"
+        if max_bytes is None:
+            max_bytes = int(config.get("cache_max_mb", DEFAULT_CACHE_MB)) * 1024 * 1024
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Lo que ocupa la carpeta; se cuenta la primera vez que hace falta (al guardar),
+        # no al crearla, para que leer de la caché empiece sin recorrerla
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def make_key(text: str, voice: str, rate: str) -> str:
+        contenido: str = "\x00".join([CACHE_VERSION, normalize_chunk_text(text), voice, rate])
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        # Repartimos en subcarpetas para no tener miles de archivos en una sola
+        return self.cache_dir / key[:2] / f"{key}.mp3"
+
+    def _tally(self) -> int:
+        # Con _lock tomado
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._scan())
+        return self._total_bytes
+
+    def _scan(self) -> List[Tuple[Path, int, float]]:
+        # Devuelve (ruta, tamaño, último acceso) de cada entrada
+        entradas: List[Tuple[Path, int, float]] = []
+        for path in self.cache_dir.glob("*/*.mp3"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entradas.append((path, st.st_size, st.st_mtime))
+        return entradas
+
+    def get(self, text: str, voice: str, rate: str) -> Optional[bytes]:
+        path: Path = self._path_for(self.make_key(text, voice, rate))
+        try:
+            with open(path, "rb") as f:
+                data: bytes = f.read()
+            # Marca la entrada como usada recientemente
+            os.utime(path, None)
+        except OSError:
+            data = b""
+
+        with self._lock:
+            if data:
+                self.hits += 1
+                metrics.incr("cache_hits")
+                return data
+            self.misses += 1
+            metrics.incr("cache_misses")
+            return None
+
+    def put(self, text: str, voice: str, rate: str, data: bytes) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+
+        path: Path = self._path_for(self.make_key(text, voice, rate))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Escribimos a un temporal y renombramos para no dejar entradas a medias
+            tmp: Path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            existia: bool = path.exists()
+            os.replace(tmp, path)
+        except OSError as e:
+            metrics.record_error("cache", e, "Error al guardar en la caché de audio")
+            return
+
+        with self._lock:
+            total: int = self._tally()
+            if not existia:
+                total = self._total_bytes = total + len(data)
+            if total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Borra las entradas menos usadas hasta bajar de EVICT_LOW_WATER del límite
+        entradas = sorted(self._scan(), key=lambda e: e[2])
+        total: int = sum(size for _, size, _ in entradas)
+        objetivo: float = self.max_bytes * EVICT_LOW_WATER
+        for path, size, _ in entradas:
+            if total <= objetivo:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def clear(self) -> None:
+        with self._lock:
+            for path, _, _ in self._scan():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes": self._tally(),
+                "max_bytes": self.max_bytes,
+            }
+
+# Caché de audio compartida por todo el proceso (conversiones, vista previa, trabajador)
+def audio_cache() -> AudioCache:
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            _audio_cache = AudioCache()
+        return _audio_cache
@@ -0,0 +1,277 @@
+import os
+import shutil
+import subprocess
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.audio_builder import iter_mp3_frames, iter_mp3_frames_bytes, READ_BLOCK, _fsync_dir
+from app.core import metrics
+
+try:
+    import numpy as np
+except ImportError:  # Sin numpy no hay posproceso; el MP3 se queda como sale del TTS
+    np = None
+
+# Silencio que se deja como mucho entre dos trozos (y al principio y al final)
+DEFAULT_SEAM_GAP_MS: int = 400
+# Por debajo de este nivel (dBFS, RMS de cada ventana) se considera silencio
+DEFAULT_SILENCE_DB: float = -45.0
+# Nivel medio al que se lleva la voz (dBFS, RMS de las ventanas con voz)
+DEFAULT_TARGET_DB: float = -20.0
+# Lo que se sube o baja un trozo como mucho
+MAX_GAIN_DB: float = 12.0
+# Los picos no pasan de aquí después de aplicar la ganancia
+PEAK_CEILING_DB: float = -1.0
+# Ventanas en las que se mide el nivel
+WINDOW_MS: int = 10
+# Fundido en los bordes de lo recortado, para que el corte no haga clic
+FADE_MS: int = 5
+# Cambio de ganancia gradual cuando un trozo largo se parte a mitad de voz
+GAIN_RAMP_MS: int = 50
+# Audio de un trozo que se tiene en memoria como mucho; los más largos se procesan por partes
+MAX_SEGMENT_SECONDS: float = 120.0
+
+def available() -> bool:
+    # Hace falta numpy para los cálculos y ffmpeg para decodificar y volver a codificar
+    return np is not None and shutil.which("ffmpeg") is not None
+
+# Muestra (contando desde el principio del audio) donde acaba cada trozo menos el último,
+# a partir de los rangos en bytes que apunta el manifiesto (JobManifest.audio_ranges).
+# Solo se leen las cabeceras de los frames, sin decodificar. Vacía si falta algún rango.
+def chunk_seams(path: str, ranges: Sequence[Optional[Tuple[int, int]]]) -> List[int]:
+    if not ranges or any(r is None for r in ranges):
+        return []
+    costuras: List[int] = []
+    muestras: int = 0
+    with open(path, "rb") as f:
+        for inicio, fin in ranges[:-1]:
+            f.seek(inicio)
+            muestras += sum(header.samples for header, _ in iter_mp3_frames_bytes(f.read(fin - inicio)))
+            costuras.append(muestras)
+    return costuras
+
+# Nivel en dBFS de cada ventana de `ventana` muestras (la última, incompleta, se rellena con ceros)
+def window_levels(x: "np.ndarray", ventana: int) -> "np.ndarray":
+    mono = x.mean(axis=1) if x.ndim > 1 else x
+    n: int = -(-len(mono) // ventana)
+    relleno = np.zeros(n * ventana, dtype=np.float32)
+    relleno[:len(mono)] = mono
+    rms = np.sqrt(np.mean(np.square(relleno.reshape(n, ventana)), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-9))
+
+def _leading(mask: "np.ndarray") -> int:
+    # Cuántos valores seguidos son True desde el principio
+    falsos = np.flatnonzero(~mask)
+    return int(falsos[0]) if len(falsos) else len(mask)
+
+# Recorte de silencios y normalización de volumen de un audio que llega por trozos
+# (los mismos que se mandaron al TTS). Cada trozo se mide y se escribe una sola vez:
+# se quita el silencio del principio y del final, se deja entre trozos un hueco de
+# como mucho gap_ms y se aplica una ganancia para llevar la voz a target_db.
+# Como los cambios de ganancia caen en los huecos de silencio, no se oyen saltos.
+class SeamProcessor:
+    def __init__(self, sample_rate: int, channels: int = 1, gap_ms: int = DEFAULT_SEAM_GAP_MS,
+                 silence_db: float = DEFAULT_SILENCE_DB, target_db: float = DEFAULT_TARGET_DB) -> None:
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+        self.gap: int = sample_rate * gap_ms // 1000
+        self.silence_db: float = silence_db
+        self.target_db: float = target_db
+        self.window: int = max(1, sample_rate * WINDOW_MS // 1000)
+        self.fade: int = max(1, sample_rate * FADE_MS // 1000)
+        self.ramp: int = max(1, sample_rate * GAIN_RAMP_MS // 1000)
+        # Silencio visto desde la última voz, que aún no se ha escrito
+        self._silence: int = 0
+        # Si el trozo anterior acabó en una costura (o es el principio): se recorta el silencio
+        self._at_seam: bool = True
+        self._gain_db: Optional[float] = None
+        self.samples_in: int = 0
+        self.samples_out: int = 0
+        self.segments: int = 0
+        self.gains: List[float] = []
+
+    def _gain_for(self, core: "np.ndarray", niveles: "np.ndarray") -> float:
+        voz = niveles[niveles >= self.silence_db]
+        if not len(voz):
+            return self._gain_db or 0.0
+        # Media de energía, no de decibelios, para que las pausas cortas no bajen el nivel
+        nivel: float = float(10 * np.log10(np.mean(np.power(10.0, voz / 10))))
+        ganancia: float = float(np.clip(self.target_db - nivel, -MAX_GAIN_DB, MAX_GAIN_DB))
+        pico: float = float(np.max(np.abs(core))) if core.size else 0.0
+        if pico > 0:
+            ganancia = min(ganancia, PEAK_CEILING_DB - 20 * np.log10(pico))
+        return ganancia
+
+    def process(self, segment: "np.ndarray", ends_at_seam: bool) -> Iterator["np.ndarray"]:
+        # segment: muestras int16 con forma (n, canales). Devuelve los bloques int16 que hay que escribir.
+        self.samples_in += len(segment)
+        self.segments += 1
+        x = segment.astype(np.float32) / 32768
+        niveles = window_levels(x, self.window)
+        silencio = niveles < self.silence_db
+
+        delante: int = min(_leading(silencio) * self.window, len(x)) if self._at_seam else 0
+        if delante >= len(x):
+            # Todo silencio: se suma al hueco y se decide al llegar la voz
+            self._silence += len(x)
+            self._at_seam = True
+            return
+        detras: int = min(_leading(silencio[::-1]) * self.window, len(x) - delante) if ends_at_seam else 0
+        core = x[delante:len(x) - detras]
+
+        if self._at_seam:
+            hueco: int = min(self._silence + delante, self.gap)
+            if hueco:
+                yield np.zeros((hueco, self.channels), dtype=np.int16)
+                self.samples_out += hueco
+            self._silence = 0
+
+        anterior: Optional[float] = self._gain_db
+        self._gain_db = self._gain_for(core, niveles[delante // self.window:len(niveles) - detras // self.window])
+        self.gains.append(self._gain_db)
+        if anterior is not None and not self._at_seam:
+            # Corte a mitad de voz: la ganancia pasa de una a otra poco a poco
+            g = np.full(len(core), 10 ** (self._gain_db / 20), dtype=np.float32)
+            n: int = min(self.ramp, len(core))
+            g[:n] = np.linspace(10 ** (anterior / 20), 10 ** (self._gain_db / 20), n, dtype=np.float32)
+            core = core * g[:, None]
+        else:
+            core = core * np.float32(10 ** (self._gain_db / 20))
+
+        n = min(self.fade, len(core) // 2)
+        if n:
+            rampa = np.linspace(0, 1, n, dtype=np.float32)[:, None]
+            if self._at_seam:
+                core[:n] *= rampa
+            if ends_at_seam:
+                core[len(core) - n:] *= rampa[::-1]
+
+        self._silence = detras
+        self._at_seam = ends_at_seam
+        self.samples_out += len(core)
+        yield np.clip(np.round(core * 32768), -32768, 32767).astype(np.int16)
+
+    def finish(self) -> Iterator["np.ndarray"]:
+        # Silencio del final, también recortado
+        hueco: int = min(self._silence, self.gap)
+        self._silence = 0
+        if hueco:
+            self.samples_out += hueco
+            yield np.zeros((hueco, self.channels), dtype=np.int16)
+
+# Agrupa los bloques decodificados en trozos: se corta en cada costura y, si un trozo
+# pasa de max_samples, también ahí. Devuelve (muestras, acaba_en_costura).
+def split_segments(blocks: Iterable["np.ndarray"], seams: Sequence[int],
+                   max_samples: int) -> Iterator[Tuple["np.ndarray", bool]]:
+    costuras: List[int] = sorted(seams)
+    siguiente: int = 0
+    pendientes: List["np.ndarray"] = []
+    inicio: int = 0
+    fin: int = 0
+    for bloque in blocks:
+        pendientes.append(bloque)
+        fin += len(bloque)
+        while True:
+            while siguiente < len(costuras) and costuras[siguiente] <= inicio:
+                siguiente += 1
+            corte: int = inicio + max_samples
+            en_costura: bool = siguiente < len(costuras) and costuras[siguiente] <= corte
+            if en_costura:
+                corte = costuras[siguiente]
+            if corte > fin:
+                break
+            todo = np.concatenate(pendientes)
+            yield todo[:corte - inicio], en_costura
+            pendientes = [todo[corte - inicio:]]
+            inicio = corte
+    if fin > inicio:
+        yield np.concatenate(pendientes), True
+
+def _decode(ffmpeg: str, path: str, sample_rate: int, channels: int) -> Iterator["np.ndarray"]:
+    # PCM de 16 bits por una tubería, a bloques: nunca está el audio entero en memoria
+    proceso = subprocess.Popen([ffmpeg, "-v", "error", "-nostdin", "-i", path, "-f", "s16le",
+                                "-ar", str(sample_rate), "-ac", str(channels), "-"],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    marco: int = 2 * channels
+    resto: bytes = b""
+    try:
+        while True:
+            datos: bytes = proceso.stdout.read(READ_BLOCK)
+            if not datos:
+                break
+            datos = resto + datos
+            util: int = len(datos) - len(datos) % marco
+            resto = datos[util:]
+            yield np.frombuffer(datos[:util], dtype=np.int16).reshape(-1, channels)
+        if proceso.wait() != 0:
+            raise RuntimeError(f"ffmpeg no pudo decodificar el audio: {proceso.stderr.read().decode(errors='replace')}")
+    finally:
+        if proceso.poll() is None:
+            proceso.kill()
+            proceso.wait()
+        proceso.stdout.close()
+        proceso.stderr.close()
+
+# Recorta los silencios entre trozos y normaliza el volumen de un MP3 ya terminado,
+# en una sola pasada: ffmpeg decodifica a PCM, cada trozo se procesa con numpy y otro
+# ffmpeg lo vuelve a codificar con el mismo formato. Se escribe a <salida>.post y se
+# renombra al final, así un fallo deja el MP3 original intacto.
+# seams: muestras donde acaba cada trozo (ver chunk_seams); sin ellas solo se recortan
+# el principio y el final y se normaliza por bloques de MAX_SEGMENT_SECONDS.
+def postprocess_mp3(path: str, seams: Sequence[int] = (), gap_ms: int = DEFAULT_SEAM_GAP_MS,
+                    silence_db: float = DEFAULT_SILENCE_DB, target_db: float = DEFAULT_TARGET_DB) -> Dict[str, Any]:
+    if np is None:
+        raise RuntimeError("Hace falta numpy para ajustar silencios y volumen")
+    ffmpeg: Optional[str] = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("Hace falta ffmpeg para ajustar silencios y volumen")
+    cabecera = next((header for header, _ in iter_mp3_frames(path)), None)
+    if cabecera is None:
+        raise ValueError("No hay frames MP3 que procesar")
+    canales: int = 1 if cabecera.mono else 2
+
+    procesador = SeamProcessor(cabecera.sample_rate, canales, gap_ms, silence_db, target_db)
+    temporal: str = path + ".post"
+    codificador = subprocess.Popen([ffmpeg, "-v", "error", "-y", "-f", "s16le", "-ar", str(cabecera.sample_rate),
+                                    "-ac", str(canales), "-i", "-", "-codec:a", "libmp3lame",
+                                    "-b:a", f"{cabecera.bitrate}k", "-f", "mp3", temporal],
+                                   stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        bloques = _decode(ffmpeg, path, cabecera.sample_rate, canales)
+        try:
+            for trozo, en_costura in split_segments(bloques, seams, int(MAX_SEGMENT_SECONDS * cabecera.sample_rate)):
+                for salida in procesador.process(trozo, en_costura):
+                    codificador.stdin.write(salida.tobytes())
+            for salida in procesador.finish():
+                codificador.stdin.write(salida.tobytes())
+        finally:
+            bloques.close()
+            codificador.stdin.close()
+        if codificador.wait() != 0:
+            raise RuntimeError(f"ffmpeg no pudo codificar el audio: {codificador.stderr.read().decode(errors='replace')}")
+        with open(temporal, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporal, path)
+        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+    except BaseException:
+        if codificador.poll() is None:
+            codificador.kill()
+            codificador.wait()
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+    finally:
+        codificador.stderr.close()
+
+    recortado: float = (procesador.samples_in - procesador.samples_out) / cabecera.sample_rate
+    metrics.incr("postprocess_segments", procesador.segments)
+    metrics.incr("postprocess_trimmed_ms", int(recortado * 1000))
+    return {
+        "segments": procesador.segments,
+        "seconds_in": round(procesador.samples_in / cabecera.sample_rate, 3),
+        "seconds_out": round(procesador.samples_out / cabecera.sample_rate, 3),
+        "trimmed_seconds": round(recortado, 3),
+        "gain_db_min": round(min(procesador.gains), 2) if procesador.gains else 0.0,
+        "gain_db_max": round(max(procesador.gains), 2) if procesador.gains else 0.0,
+    }
@@ -0,0 +1,77 @@
+import os
+import re
+from typing import List, NamedTuple, Optional, Sequence
+
+from app.core.audio_builder import mp3_duration
+from app.core.pdf_reader import get_outline, get_page_count
+
+# Nivel del índice que se considera capítulo (1 = las entradas de primer nivel)
+DEFAULT_CHAPTER_LEVEL: int = 1
+# Título de las páginas que hay antes del primer capítulo (portada, prólogo sin marcador...)
+FRONT_MATTER_TITLE: str = "Inicio"
+
+# Un capítulo del libro: rango de páginas [start_page, end_page) contando desde 0
+class Chapter(NamedTuple):
+    index: int
+    title: str
+    start_page: int
+    end_page: int
+
+    @property
+    def pages(self):
+        return self.start_page, self.end_page
+
+    @property
+    def filename(self) -> str:
+        # "03 - El título.mp3": el número delante mantiene el orden en cualquier reproductor
+        titulo: str = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "", self.title).strip(" .") or "Capítulo"
+        return f"{self.index + 1:02d} - {titulo[:80]}.mp3"
+
+# Divide el libro en capítulos según el índice del PDF. Los marcadores apuntan a páginas,
+# así que un capítulo que empieza a mitad de página se lleva la página entera.
+# Devuelve [] si el PDF no tiene índice.
+def plan_chapters(pdf_path: str, level: int = DEFAULT_CHAPTER_LEVEL) -> List[Chapter]:
+    total: int = get_page_count(pdf_path)
+    inicios: List[tuple] = []
+    for nivel, titulo, pagina in get_outline(pdf_path):
+        # Los marcadores sin destino vienen con página -1
+        if nivel > level or not 1 <= pagina <= total:
+            continue
+        # Dos marcadores en la misma página (p. ej. "Parte I" y "Capítulo 1"): vale el primero
+        if inicios and pagina - 1 <= inicios[-1][1]:
+            continue
+        inicios.append((titulo.strip(), pagina - 1))
+
+    if not inicios:
+        return []
+    if inicios[0][1] > 0:
+        inicios.insert(0, (FRONT_MATTER_TITLE, 0))
+
+    capitulos: List[Chapter] = []
+    for i, (titulo, inicio) in enumerate(inicios):
+        fin: int = inicios[i + 1][1] if i + 1 < len(inicios) else total
+        capitulos.append(Chapter(i, titulo, inicio, fin))
+    return capitulos
+
+# Carpeta donde van los capítulos de un libro: <carpeta>/<nombre del PDF>/
+def chapters_dir(pdf_path: str, out_dir: Optional[str] = None) -> str:
+    nombre: str = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(out_dir or os.path.dirname(os.path.abspath(pdf_path)), nombre)
+
+# Lista de reproducción M3U con los capítulos que ya existen, en orden y con su duración.
+# Se reescribe entera cada vez, así vale también tras regenerar un solo capítulo.
+def write_playlist(directory: str, book_title: str, chapters: Sequence[Chapter]) -> str:
+    ruta: str = os.path.join(directory, f"{book_title}.m3u8")
+    lineas: List[str] = ["#EXTM3U", f"#PLAYLIST:{book_title}"]
+    for capitulo in chapters:
+        archivo: str = os.path.join(directory, capitulo.filename)
+        if not os.path.exists(archivo):
+            continue
+        lineas.append(f"#EXTINF:{int(round(mp3_duration(archivo)))},{capitulo.title}")
+        lineas.append(capitulo.filename)
+
+    tmp: str = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lineas) + "\n")
+    os.replace(tmp, ruta)
+    return ruta
@@ -0,0 +1,138 @@
+import bisect
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.core.config_manager import ConfigManager
+from app.core.tts_engine import DEFAULT_CHUNK_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Límites duros del tamaño de trozo. El máximo lo puede bajar cada backend con
+# su atributo max_chars (lo que acepta el servicio en una sola petición).
+MIN_CHUNK_CHARS: int = 300
+MAX_CHUNK_CHARS: int = 5000
+# Parte del tiempo de cada petición que aceptamos perder en la espera inicial
+TARGET_OVERHEAD: float = 0.1
+# Duración máxima de una petición: si falla, esto es lo que se repite
+MAX_REQUEST_SECONDS: float = 20.0
+# Medidas antes de empezar a mover el tamaño
+MIN_SAMPLES: int = 3
+# Peso de la última medida en las medias
+_SMOOTHING: float = 0.2
+# Los cambios se redondean para no mover el troceo por unos pocos caracteres
+_STEP: int = 100
+
+# Ajusta el tamaño de los trozos de texto a lo que se mide de cada petición.
+# Cada petición cuesta una espera fija (tiempo hasta el primer byte) más un tiempo
+# proporcional al texto: los trozos pequeños pierden mucho en esperas y los grandes
+# aprovechan peor la concurrencia y cuestan más si hay que repetirlos. Buscamos el
+# trozo más pequeño cuya espera no pase de TARGET_OVERHEAD del total.
+# Lo aprendido se guarda por voz en la configuración ("tts_tuning").
+class ChunkTuner:
+    def __init__(self, voice: str, max_chars: Optional[int] = None) -> None:
+        self.voice: str = voice
+        self.max_chars: int = max(MIN_CHUNK_CHARS, min(max_chars or MAX_CHUNK_CHARS, MAX_CHUNK_CHARS))
+        self.ttfb: Optional[float] = None  # segundos hasta el primer byte
+        self.chars_per_second: Optional[float] = None
+        self.samples: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+        guardado: Dict[str, Any] = ConfigManager().get("tts_tuning", {}).get(voice, {})
+        inicial = guardado.get("chunk_chars", ConfigManager().get("tts_chunk_chars", DEFAULT_CHUNK_CHARS))
+        self.chunk_chars: int = self._clamp(int(inicial))
+        if guardado.get("ttfb") and guardado.get("chars_per_second"):
+            self.ttfb = float(guardado["ttfb"])
+            self.chars_per_second = float(guardado["chars_per_second"])
+
+    @classmethod
+    def for_backend(cls, voice: str, backend: Any) -> "ChunkTuner":
+        return cls(voice, getattr(backend, "max_chars", None))
+
+    def _clamp(self, chars: int) -> int:
+        return max(MIN_CHUNK_CHARS, min(chars, self.max_chars))
+
+    def limit_for(self, index: int) -> int:
+        # Se pasa a iter_text_chunks como límite variable
+        with self._lock:
+            return self.chunk_chars
+
+    def observe(self, chars: int, ttfb: float, seconds: float) -> None:
+        # Lo llama TTSEngine al terminar cada petición que fue al servicio
+        if chars <= 0 or seconds <= 0:
+            return
+        ttfb = min(max(ttfb, 0.0), seconds)
+        velocidad: float = chars / max(seconds - ttfb, 1e-3)
+
+        with self._lock:
+            if self.ttfb is None or self.chars_per_second is None:
+                self.ttfb, self.chars_per_second = ttfb, velocidad
+            else:
+                self.ttfb = _SMOOTHING * ttfb + (1 - _SMOOTHING) * self.ttfb
+                self.chars_per_second = _SMOOTHING * velocidad + (1 - _SMOOTHING) * self.chars_per_second
+            self.samples += 1
+            if self.samples < MIN_SAMPLES:
+                return
+
+            anterior: int = self.chunk_chars
+            self.chunk_chars = self._target()
+            if self.chunk_chars != anterior:
+                logger.debug("Trozos de %s: %d -> %d caracteres", self.voice, anterior, self.chunk_chars,
+                             extra={"event": "chunk_tuned", "voice": self.voice, "chunk_chars": self.chunk_chars,
+                                    "ttfb": self.ttfb, "chars_per_second": self.chars_per_second})
+
+    def _target(self) -> int:
+        # Con espera a y velocidad b, un trozo de n caracteres tarda a + n / b.
+        # La espera es como mucho TARGET_OVERHEAD del total si n >= a * b * (1 - f) / f.
+        f: float = TARGET_OVERHEAD
+        objetivo: float = self.ttfb * self.chars_per_second * (1 - f) / f
+        objetivo = min(objetivo, MAX_REQUEST_SECONDS * self.chars_per_second)
+        return self._clamp(int(round(objetivo / _STEP)) * _STEP)
+
+    def save(self) -> None:
+        # Se llama al final del trabajo: la siguiente conversión con esta voz empieza aquí
+        with self._lock:
+            if self.samples < MIN_SAMPLES:
+                return
+            datos: Dict[str, Any] = {
+                "chunk_chars": self.chunk_chars,
+                "ttfb": round(self.ttfb, 4),
+                "chars_per_second": round(self.chars_per_second, 1),
+            }
+        config: ConfigManager = ConfigManager()
+        tuning: Dict[str, Any] = dict(config.get("tts_tuning", {}))
+        tuning[self.voice] = datos
+        config.set("tts_tuning", tuning)
+
+# Límites de trozo con los que se partió un documento, para volver a partirlo igual al
+# convertirlo otra vez: si el tamaño cambiara, los trozos serían otros y la caché de
+# audio (que va por el texto de cada trozo) no acertaría ninguno. Se guarda solo
+# dónde cambia el límite: [[primer índice, límite], ...] (ver JobHistory.chunk_plan).
+class ChunkPlan:
+    def __init__(self, steps: Optional[List[List[int]]] = None) -> None:
+        self.steps: List[List[int]] = [list(paso) for paso in steps or []]
+        self._starts: List[int] = [inicio for inicio, _ in self.steps]
+        self._used: Dict[int, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.steps)
+
+    def limit_for(self, index: int) -> Optional[int]:
+        # Límite guardado para ese trozo (el último tramo sigue hasta el final); None si no hay plan
+        if not self.steps:
+            return None
+        return self.steps[max(0, bisect.bisect_right(self._starts, index) - 1)][1]
+
+    def record(self, index: int, limit: int) -> None:
+        # Se apunta cada límite que se usa; si un trozo lo pide varias veces, vale el último
+        with self._lock:
+            self._used[index] = limit
+
+    def used_steps(self) -> List[List[int]]:
+        with self._lock:
+            pasos: List[List[int]] = []
+            for indice in sorted(self._used):
+                if not pasos or pasos[-1][1] != self._used[indice]:
+                    pasos.append([indice, self._used[indice]])
+            return pasos
@@ -1,46 +1,183 @@
+import atexit
 import json
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, Optional, Tuple
 
+from app.utils.paths import get_config_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Los cambios que llegan seguidos se juntan durante este tiempo y se escriben de una vez
+SAVE_DEBOUNCE_SECONDS: float = 0.5
+# Como mucho cada cuánto se mira si otro proceso cambió el archivo
+RELOAD_INTERVAL_SECONDS: float = 1.0
+
+# Configuración del usuario en <config>/config.json, compartida por la ventana, la línea
+# de comandos y los trabajos que corren en otros hilos o procesos.
+# set() no escribe en el momento: apunta el cambio y lo guarda poco después junto con
+# los que lleguen mientras tanto. Al guardar se bloquea el archivo, se vuelve a leer y
+# se aplican encima solo las claves cambiadas, así dos procesos no se pisan, y se
+# escribe a un temporal que se renombra para no dejar nunca el JSON a medias.
 class ConfigManager:
     _instance = None
-    
+    _instance_lock = threading.Lock()
+
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(ConfigManager, cls).__new__(cls)
-            cls._instance._initialize()
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(ConfigManager, cls).__new__(cls)
+                cls._instance._initialize()
         return cls._instance
-    
+
     def _initialize(self):
-        self.config_dir = Path.home() / ".narralib"
+        self.config_dir = Path(get_config_path())
         self.config_file = self.config_dir / "config.json"
-        self.config = {}
+        self.lock_file = self.config_dir / "config.json.lock"
+        self.config: Dict[str, Any] = {}
+        # Cambios hechos en este proceso que aún no están en disco
+        self._pending: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        self._batch_depth: int = 0
+        # (mtime, tamaño) del archivo tal como se leyó la última vez
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked: float = time.monotonic()
         self._load_config()
+        # Lo que quede pendiente se guarda al salir
+        atexit.register(self.flush)
 
     def _load_config(self):
         if not self.config_dir.exists():
             self.config_dir.mkdir(parents=True, exist_ok=True)
-            
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    self.config = json.load(f)
-            except Exception:
-                self.config = {}
-        else:
-            self.config = {}
-
-    def _save_config(self):
+        self.config = self._read_disk()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=4)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read_disk(self) -> Dict[str, Any]:
+        self._stamp = self._file_stamp()
+        if self._stamp is None:
+            return {}
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Error reading config: %s", e)
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write_disk(self, data: Dict[str, Any]) -> None:
+        tmp: Path = self.config_file.with_name(f"{self.config_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.config_file)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self._stamp = self._file_stamp()
+
+    @contextmanager
+    def _file_lock(self):
+        # Bloqueo entre procesos sobre un archivo aparte (el JSON se reemplaza al escribir)
+        with open(self.lock_file, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _maybe_reload(self) -> None:
+        # Si otro proceso guardó cambios, se recargan sin perder los pendientes de este
+        ahora: float = time.monotonic()
+        if ahora - self._checked < RELOAD_INTERVAL_SECONDS:
+            return
+        self._checked = ahora
+        if self._file_stamp() != self._stamp:
+            datos: Dict[str, Any] = self._read_disk()
+            datos.update(self._pending)
+            self.config = datos
 
     def get(self, key: str, default: Any = None) -> Any:
-        return self.config.get(key, default)
+        with self._lock:
+            self._maybe_reload()
+            return self.config.get(key, default)
 
     def set(self, key: str, value: Any):
-        self.config[key] = value
-        self._save_config()
+        self.update({key: value})
+
+    def update(self, values: Dict[str, Any]) -> None:
+        # Varios cambios de golpe: se guardan en una sola escritura
+        with self._lock:
+            self.config.update(values)
+            self._pending.update(values)
+            self._schedule_save()
+
+    @contextmanager
+    def batch(self):
+        # Dentro del bloque no se escribe nada; al salir se guarda todo de una vez
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                fuera: bool = self._batch_depth == 0
+            if fuera:
+                self.flush()
+
+    def _schedule_save(self) -> None:
+        # El primer cambio pone en marcha la espera; los que llegan durante ella van en
+        # la misma escritura. No se reinicia, así una racha larga no retrasa el guardado
+        if self._batch_depth or self._timer is not None:
+            return
+        self._timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self) -> None:
+        # Escribe ya lo pendiente (también se llama al salir del programa)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            try:
+                with self._file_lock():
+                    # Se parte de lo que hay en disco para no pisar lo que guardó otro proceso
+                    datos: Dict[str, Any] = self._read_disk()
+                    datos.update(self._pending)
+                    self._write_disk(datos)
+            except OSError as e:
+                # Los cambios siguen pendientes y se reintentan en el próximo guardado
+                logger.error("Error saving config: %s", e)
+                return
+            self.config = datos
+            self._pending.clear()
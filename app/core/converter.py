@@ -0,0 +1,395 @@
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.pdf_reader import iter_pages, get_page_count, ExtractionError
+from app.core.text_cleaner import clean_text_stream
+from app.core.tts_engine import TTSEngine, EdgeTTSBackend, iter_text_chunks, DEFAULT_CONCURRENCY, DEFAULT_CHUNK_CHARS
+from app.core.tts_engine import DEFAULT_MAX_CONCURRENCY, DEFAULT_RETRIES
+from app.core.chunk_tuner import ChunkTuner, ChunkPlan
+from app.core.config_manager import ConfigManager
+from app.core.audio_cache import AudioCache, audio_cache
+from app.core.audio_builder import StreamingMp3Writer, DEFAULT_REORDER_CHUNKS
+from app.core.job_manifest import JobManifest
+from app.core.revisions import DocumentFingerprint, describe_chunk
+from app.core.job_history import JobHistory
+from app.core.estimator import learned_concurrency
+from app.core.audio_post import postprocess_mp3, chunk_seams, DEFAULT_SEAM_GAP_MS, DEFAULT_SILENCE_DB, DEFAULT_TARGET_DB
+from app.core.progress import ProgressTracker
+from app.core.limits import tts_limiter, cpu_limiter
+from app.core import metrics
+
+# Como mucho cuántas veces por segundo se avisa del progreso
+PROGRESS_INTERVAL: float = 0.25
+
+# Conversión completa de un PDF a MP3, sin nada de Qt, para que la puedan usar
+# tanto la ventana (a través de ConversionWorker) como la línea de comandos.
+class ConversionJob:
+    def __init__(self, pdf_path: str, voice: str, rate: str, output_path: str,
+                 on_progress: Optional[Callable[[int], None]] = None,
+                 on_status: Optional[Callable[[str], None]] = None,
+                 backend=None, pages: Optional[Tuple[int, int]] = None,
+                 concurrency: Optional[int] = None, postprocess: Optional[bool] = None) -> None:
+        self.pdf_path: str = pdf_path
+        self.voice: str = voice
+        self.rate: str = rate
+        self.output_path: str = output_path
+        self.on_progress: Callable[[int], None] = on_progress or (lambda value: None)
+        self.on_status: Callable[[str], None] = on_status or (lambda text: None)
+        # Backend de síntesis (por defecto Edge); ver tts_engine.HttpTTSBackend
+        self.backend = backend
+        # Rango de páginas [inicio, fin) a convertir, p. ej. un capítulo (None = todo el PDF)
+        self.pages: Optional[Tuple[int, int]] = tuple(pages) if pages else None
+        # Peticiones a la vez con las que se empieza (None = tts_concurrency o lo aprendido)
+        self.concurrency: Optional[int] = concurrency
+        # Recortar silencios entre trozos y normalizar el volumen al final (None = audio_postprocess)
+        self.postprocess: Optional[bool] = postprocess
+
+        # Tiempos por etapa y contadores; se guardan en ~/.narralib/metrics al terminar
+        self.metrics: metrics.JobMetrics = metrics.JobMetrics(os.path.basename(pdf_path))
+        self.progress: Optional[ProgressTracker] = None
+        self.cache: Optional[AudioCache] = None
+        self.tuner: Optional[ChunkTuner] = None
+        self.total_chunks: int = 0
+        self.elapsed: float = 0.0
+        self.audio_seconds: float = 0.0
+        self.audio_bytes: int = 0
+        self.postprocess_stats: Optional[Dict[str, Any]] = None
+        self._is_running: bool = True
+        self._tts: Optional[TTSEngine] = None
+        self._last_emit: float = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return not self._is_running
+
+    def run(self) -> Tuple[bool, str]:
+        # Devuelve (éxito, mensaje). Si se canceló, cancelled pasa a True.
+        inicio: float = time.monotonic()
+        success: bool = False
+        try:
+            with metrics.job_context(self.metrics), metrics.span("job"):
+                success, message = self._run()
+            return success, message
+        finally:
+            self.elapsed = time.monotonic() - inicio
+            estado: str = "cancelled" if self.cancelled else ("succeeded" if success else "failed")
+            self.metrics.incr(f"jobs_{estado}")
+            try:
+                self.metrics.write()
+            except OSError as e:
+                metrics.logger.warning("No se pudieron guardar las métricas: %s", e)
+            self._record_history(estado)
+
+    def _run(self) -> Tuple[bool, str]:
+        manifest: Optional[JobManifest] = None
+        writer: Optional[StreamingMp3Writer] = None
+        try:
+            self.on_progress(0)
+            self.on_status("Leyendo PDF...")
+
+            config = ConfigManager()
+            backend = self.backend or EdgeTTSBackend()
+            # Con tts_chunk_auto el tamaño de trozo se ajusta a lo que tarda cada petición
+            # y lo aprendido se guarda por voz; si no, se usa tts_chunk_chars tal cual
+            if config.get("tts_chunk_auto", True):
+                self.tuner = ChunkTuner.for_backend(self.voice, backend)
+                chunk_chars = "auto"
+            else:
+                chunk_chars = int(config.get("tts_chunk_chars", DEFAULT_CHUNK_CHARS))
+            settings = {"voice": self.voice, "rate": self.rate, "chunk_chars": chunk_chars,
+                        "output": os.path.abspath(self.output_path)}
+            if self.pages:
+                # Cada capítulo es un trabajo aparte, que se puede retomar o rehacer solo
+                settings["pages"] = list(self.pages)
+            # El manifiesto del trabajo guarda los trozos ya hechos para poder retomar.
+            # La salida forma parte del trabajo para que dos conversiones del mismo PDF a la vez no choquen.
+            manifest = JobManifest.open(self.pdf_path, settings)
+            self.metrics.job_id = manifest.job_id
+
+            # El audio se escribe en orden directamente en <salida>.part según llegan los
+            # trozos; lo ya escrito en una ejecución anterior se conserva
+            writer = StreamingMp3Writer(
+                self.output_path,
+                max_pending=int(config.get("reorder_buffer_chunks", DEFAULT_REORDER_CHUNKS)),
+                on_commit=manifest.mark_committed,
+            )
+            if writer.resume(manifest.committed_chunks, manifest.committed_bytes) < manifest.committed_chunks:
+                # El .part no está o no coincide con lo apuntado: se empieza de cero
+                manifest.mark_committed(0, 0)
+            # Huella de la conversión anterior a esta misma salida: si el PDF es una revisión,
+            # solo se sintetiza lo que cambió y el resto del audio se copia del MP3 anterior
+            incremental: bool = bool(config.get("incremental_reconvert", True))
+            previo: Optional[DocumentFingerprint] = DocumentFingerprint.load(self.output_path) if incremental else None
+            huellas: List[Dict[str, Any]] = []
+            total_paginas: int = self.pages[1] - self.pages[0] if self.pages else get_page_count(self.pdf_path)
+            progress = ProgressTracker(total_paginas)
+            self.progress = progress
+
+            # Pasos 1 y 2: leer y limpiar el PDF página a página, quitando encabezados,
+            # pies y números de página. Es un generador, así que
+            # la síntesis arranca con la primera página en vez de esperar al libro entero.
+            # Los PDF grandes se leen repartiendo rangos de páginas entre varios procesos.
+            # Cada página se lee con un hueco del límite global de CPU, compartido con otros trabajos.
+            cpu = cpu_limiter()
+
+            def paginas_contadas():
+                paginas = clean_text_stream(iter_pages(self.pdf_path, config.get("extract_workers"), self.pages),
+                                            strip_headers=bool(config.get("strip_headers", True)))
+                while True:
+                    with cpu.hold():
+                        pagina = next(paginas, None)
+                    if pagina is None:
+                        return
+                    progress.page_read(len(pagina))
+                    yield pagina
+
+            longitudes: Dict[int, int] = {}
+            # Un documento que ya se convirtió se vuelve a partir con los mismos límites, así
+            # los trozos son idénticos y salen de la caché de audio aunque el ajuste haya
+            # movido el tamaño desde entonces. Solo se ajusta con los que no se han visto nunca.
+            plan: Optional[ChunkPlan] = None
+            if self.tuner is not None:
+                plan = ChunkPlan(JobHistory().chunk_plan(manifest.pdf_hash, self.pages))
+
+            def limite(indice: int) -> int:
+                # Al retomar, los trozos ya cortados se repiten igual para aprovechar lo hecho
+                valor: Optional[int] = manifest.chunk_length(indice) or plan.limit_for(indice)
+                if not valor:
+                    valor = self.tuner.limit_for(indice)
+                plan.record(indice, valor)
+                return valor
+
+            def trozos_pendientes():
+                troceo = limite if self.tuner is not None else chunk_chars
+                if previo is not None:
+                    trozos = previo.iter_chunks(paginas_contadas(), troceo)
+                else:
+                    trozos = iter_text_chunks(paginas_contadas(), troceo)
+                for indice, chunk in enumerate(trozos):
+                    self.total_chunks = indice + 1
+                    if not self._is_running:
+                        return
+                    recortar: bool = manifest.record_chunk(indice, chunk)
+                    if incremental:
+                        huellas.append(describe_chunk(chunk))
+                    if manifest.is_done(indice):
+                        progress.chunk_skipped(len(chunk))
+                        continue
+                    if recortar:
+                        # El texto cambió antes de lo ya escrito: se recorta el .part hasta ahí.
+                        # No vale mirar writer.next_index: la síntesis lo adelanta desde otros
+                        # hilos antes de apuntarlo en el manifiesto
+                        writer.resume(manifest.committed_chunks, manifest.committed_bytes)
+                    # No adelantamos más trozos de los que caben esperando en el escritor
+                    while not writer.wait_for_room(indice, timeout=0.5):
+                        if not self._is_running:
+                            return
+                    audio: Optional[bytes] = previo.audio_for(chunk, self.voice, self.rate) if previo else None
+                    if audio:
+                        # Trozo sin cambios respecto a la versión anterior: no se vuelve a sintetizar
+                        metrics.incr("chunks_reused")
+                        writer.add(indice, audio)
+                        progress.chunk_skipped(len(chunk))
+                        continue
+                    longitudes[indice] = len(chunk)
+                    yield indice, chunk
+
+            def trozo_terminado(indice: int, audio: bytes) -> None:
+                writer.add(indice, audio)
+                progress.chunk_done(longitudes.pop(indice, 0))
+                self._emit_progress()
+
+            def audio_recibido(nbytes: int) -> None:
+                progress.audio_received(nbytes)
+                self._emit_progress()
+
+            self.on_status("Generando audio (esto puede tardar)...")
+
+            # Paso 3: Convertir a audio, por trozos y varios a la vez. Las conexiones
+            # cuentan contra el límite global, así varios trabajos no saturan el servicio.
+            # Cada trozo se reintenta si falla, y las peticiones a la vez se ajustan solas
+            # entre tts_concurrency y tts_max_concurrency según responda el servicio.
+            self.cache = audio_cache()
+            # Sin tts_concurrency se arranca donde acabaron las conversiones anteriores
+            concurrencia: int = (self.concurrency or int(config.get("tts_concurrency", 0))
+                                 or learned_concurrency(backend=type(backend).__name__) or DEFAULT_CONCURRENCY)
+            self._tts = TTSEngine(backend=backend, cache=self.cache, limiter=tts_limiter(), tuner=self.tuner,
+                                  retries=int(config.get("tts_retries", DEFAULT_RETRIES)))
+            if not self._is_running:
+                self._tts.cancel()
+            success = self._tts.synthesize_stream(
+                trozos_pendientes(), trozo_terminado, self.voice, self.rate,
+                max_concurrency=concurrencia,
+                on_audio=audio_recibido,
+                max_concurrency_cap=int(config.get("tts_max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+            )
+            if self.tuner is not None:
+                # Lo medido sirve igual para los documentos nuevos aunque este no se haya ajustado
+                self.tuner.save()
+
+            if not self._is_running:
+                return self._cleanup_cancelled(manifest)
+
+            if success and self.total_chunks == 0:
+                writer.close(remove=True)
+                return False, "No se pudo leer el texto del PDF."
+
+            if success:
+                # Paso 4: cerrar el archivo: cabecera Xing, fsync y renombrado atómico
+                manifest.finish_chunks(self.total_chunks)
+                if plan is not None and not plan:
+                    JobHistory().save_chunk_plan(manifest.pdf_hash, self.pages, plan.used_steps())
+                self.on_status("Guardando audio...")
+                with metrics.span("mux"):
+                    writer.finish()
+                self.audio_seconds, self.audio_bytes = writer.audio_seconds, writer.audio_bytes
+                posprocesar: bool = (self.postprocess if self.postprocess is not None
+                                     else bool(config.get("audio_postprocess", False)))
+                # Tras el posproceso el audio de cada trozo ya no está donde apunta el
+                # manifiesto, así que la huella no serviría para reconvertir por partes
+                if posprocesar and self._postprocess(config, manifest.audio_ranges()):
+                    incremental = False
+                if incremental:
+                    try:
+                        DocumentFingerprint.save(self.output_path, self.voice, self.rate,
+                                                 huellas, manifest.audio_ranges())
+                    except OSError as e:
+                        metrics.logger.warning("No se pudo guardar la huella del documento: %s", e)
+                manifest.remove()
+
+            if success:
+                self.on_progress(100)
+                self.on_status("¡Completado!")
+                return True, f"Audio guardado en: {self.output_path}"
+            if isinstance(self._tts.last_error, ExtractionError):
+                # El PDF dejó de leerse a mitad: falla entero y el manifiesto queda para reintentar
+                return False, str(self._tts.last_error)
+            if self._tts.last_error is not None:
+                return False, f"Error al generar el audio tras varios intentos: {self._tts.last_error}"
+            return False, "Error al generar el audio, revisa tu conexión a internet."
+
+        except Exception as e:
+            if not self._is_running:
+                return self._cleanup_cancelled(manifest)
+            metrics.record_error("job", e, "Ocurrió un error inesperado")
+            return False, f"Ocurrió un error inesperado: {str(e)}"
+        finally:
+            # Si no se terminó, el .part se queda para retomar
+            if writer is not None:
+                writer.close()
+            if manifest is not None:
+                try:
+                    manifest.flush()
+                except OSError as e:
+                    metrics.logger.warning("No se pudo guardar el manifiesto: %s", e)
+
+    def _postprocess(self, config: ConfigManager, ranges: List[Optional[Tuple[int, int]]]) -> bool:
+        # Paso 5 (opcional): silencios entre trozos recortados a seam_gap_ms y volumen
+        # igualado. Si falta numpy o ffmpeg, o algo falla, el MP3 se queda como salió.
+        self.on_status("Ajustando silencios y volumen...")
+        try:
+            with metrics.span("postprocess"):
+                self.postprocess_stats = postprocess_mp3(
+                    self.output_path, chunk_seams(self.output_path, ranges),
+                    gap_ms=int(config.get("seam_gap_ms", DEFAULT_SEAM_GAP_MS)),
+                    silence_db=float(config.get("silence_threshold_db", DEFAULT_SILENCE_DB)),
+                    target_db=float(config.get("loudness_target_db", DEFAULT_TARGET_DB)),
+                )
+        except (RuntimeError, ValueError, OSError) as e:
+            metrics.record_error("postprocess", e, "No se pudo ajustar el audio; se deja como salió")
+            return False
+        self.audio_seconds = self.postprocess_stats["seconds_out"]
+        self.audio_bytes = os.path.getsize(self.output_path)
+        return True
+
+    def _record_history(self, estado: str) -> None:
+        # Deja la ejecución en el historial para estimar las siguientes (ver estimator)
+        if self.progress is None:
+            return
+        spans: Dict[str, Dict[str, float]] = self.metrics.to_dict()["spans"]
+
+        def segundos(etapa: str) -> float:
+            return round(spans.get(etapa, {}).get("seconds", 0.0), 3)
+
+        try:
+            JobHistory().record({
+                "job": self.metrics.job_id,
+                "pdf": os.path.abspath(self.pdf_path),
+                "voice": self.voice,
+                "rate": self.rate,
+                "backend": type(self.backend).__name__ if self.backend is not None else "EdgeTTSBackend",
+                "status": estado,
+                "pages": self.progress.pages_read,
+                "chars": self.progress.chars_read,
+                "chars_synthesized": self.progress.chars_done - self.progress.chars_skipped,
+                "chunks": self.total_chunks,
+                "chunk_chars": self.tuner.chunk_chars if self.tuner is not None else None,
+                "audio_seconds": round(self.audio_seconds, 3),
+                "audio_bytes": self.audio_bytes,
+                "seconds": round(self.elapsed, 3),
+                "extract_seconds": segundos("extract"),
+                "clean_seconds": segundos("clean"),
+                "tts_seconds": segundos("tts"),
+                "mux_seconds": segundos("mux"),
+                "concurrency": self._tts.concurrency.limit if self._tts and self._tts.concurrency else None,
+                "cache_hits": self._cache_counts()[0] if self.cache is not None else None,
+            })
+        except (OSError, sqlite3.Error) as e:
+            metrics.logger.warning("No se pudo guardar el historial de conversiones: %s", e)
+
+    def _emit_progress(self) -> None:
+        # Se llama por cada bloque de audio, así que limitamos cuántas veces avisamos
+        ahora: float = time.monotonic()
+        if ahora - self._last_emit < PROGRESS_INTERVAL or self.progress is None:
+            return
+        self._last_emit = ahora
+        # La síntesis ocupa hasta el 99%; el resto es cerrar el archivo
+        self.on_progress(int(self.progress.fraction * 99))
+        self.on_status(f"Generando audio: {self.progress.describe()}")
+
+    def _cleanup_cancelled(self, manifest: Optional[JobManifest]) -> Tuple[bool, str]:
+        # Quita lo que quedó a medias; los trozos terminados se guardan para retomar
+        if manifest is not None:
+            manifest.cleanup_partial()
+        self.on_status("Conversión cancelada")
+        return False, "Conversión cancelada"
+
+    def cancel(self) -> None:
+        self._is_running = False
+        # Corta también las peticiones de síntesis que estén en vuelo
+        if self._tts is not None:
+            self._tts.cancel()
+
+    def summary(self) -> Dict[str, Any]:
+        # Resumen de la conversión para informes (línea de comandos, métricas...)
+        datos: Dict[str, Any] = {
+            "pdf": self.pdf_path,
+            "output": self.output_path,
+            "voice": self.voice,
+            "rate": self.rate,
+            "page_range": list(self.pages) if self.pages else None,
+            "chunks": self.total_chunks,
+            "chunk_chars": self.tuner.chunk_chars if self.tuner is not None else None,
+            "seconds": round(self.elapsed, 3),
+            "audio_seconds": round(self.audio_seconds, 3),
+        }
+        if self.progress is not None:
+            datos.update({
+                "pages": self.progress.pages_read,
+                "chars": self.progress.chars_read,
+                "audio_bytes": self.progress.audio_bytes,
+            })
+        if self.postprocess_stats is not None:
+            datos["postprocess"] = self.postprocess_stats
+        datos["metrics"] = self.metrics.to_dict()
+        if self.cache is not None:
+            aciertos, fallos = self._cache_counts()
+            datos.update({"cache_hits": aciertos, "cache_misses": fallos})
+        return datos
+
+    def _cache_counts(self) -> Tuple[int, int]:
+        # La caché es de todo el proceso: los aciertos de este trabajo salen de sus métricas
+        contadores: Dict[str, float] = self.metrics.to_dict()["counters"]
+        return int(contadores.get("cache_hits", 0)), int(contadores.get("cache_misses", 0))
@@ -0,0 +1,140 @@
+import re
+import statistics
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.pdf_reader import iter_pages, get_page_count, ExtractionError
+from app.core.text_cleaner import clean_text_stream
+from app.core.config_manager import ConfigManager
+from app.core.job_history import JobHistory
+from app.core.limits import DEFAULT_MAX_TTS_CONNECTIONS
+from app.core.progress import format_duration
+from app.core.tts_engine import DEFAULT_CONCURRENCY, DEFAULT_MAX_CONCURRENCY
+
+# Páginas repartidas por el documento que se leen para estimar el texto total
+SAMPLE_PAGES: int = 8
+# Ejecuciones del historial que se tienen en cuenta (las más recientes)
+HISTORY_RUNS: int = 20
+# Las ejecuciones con menos texto que esto miden sobre todo esperas: no cuentan
+MIN_HISTORY_CHARS: int = 2000
+# Sin historial: lo que lee una voz neural a velocidad normal, lo que ocupa su audio
+# (MP3 de 48 kbps, lo que devuelve Edge) y lo que se sintetiza por segundo
+DEFAULT_CHARS_PER_AUDIO_SECOND: float = 14.0
+DEFAULT_AUDIO_BYTES_PER_SECOND: float = 6000.0
+DEFAULT_SYNTHESIS_CHARS_PER_SECOND: float = 500.0
+# Documentos a la vez que se deciden solos como mucho (ver plan_concurrency)
+MAX_AUTO_PARALLEL_JOBS: int = 4
+
+# Estimación de lo que costará convertir un PDF, antes de empezar
+class JobEstimate(NamedTuple):
+    pages: int
+    chars: int
+    audio_seconds: float
+    synthesis_seconds: float
+    output_bytes: int
+    concurrency: int
+    sampled_pages: int
+    history_runs: int
+
+    def describe(self) -> str:
+        # Texto corto para la ventana y la consola
+        caracteres: str = f"{self.chars / 1_000_000:.1f} M" if self.chars >= 1_000_000 else f"{self.chars / 1000:.0f} k"
+        return (f"~{caracteres} caracteres · {format_duration(self.audio_seconds)} de audio · "
+                f"tardará ~{format_duration(self.synthesis_seconds)} · {self.output_bytes / (1024 * 1024):.0f} MB")
+
+# Factor de velocidad de la voz: "+10%" -> 1.1, "-20%" -> 0.8
+def rate_factor(rate: Optional[str]) -> float:
+    m = re.fullmatch(r'\s*([+-]?\d+(?:\.\d+)?)\s*%\s*', rate or "")
+    if not m:
+        return 1.0
+    return max(0.1, 1 + float(m.group(1)) / 100)
+
+# Caracteres que tendrá el texto limpio de las páginas [inicio, fin), leyendo solo unas
+# pocas repartidas por el documento (las que ya estén en la caché de texto no abren el PDF).
+# Devuelve (caracteres estimados, páginas leídas).
+def sample_chars(pdf_path: str, pages: Tuple[int, int], samples: int = SAMPLE_PAGES) -> Tuple[int, int]:
+    inicio, fin = pages
+    total: int = fin - inicio
+    if total <= 0:
+        return 0, 0
+    muestras: int = min(samples, total)
+    # Centro de cada tramo, para no caer siempre en la portada o en el índice del final
+    numeros: List[int] = sorted({inicio + (2 * i + 1) * total // (2 * muestras) for i in range(muestras)})
+    textos: List[str] = []
+    for n in numeros:
+        try:
+            textos.append("".join(iter_pages(pdf_path, 1, (n, n + 1))))
+        except ExtractionError:
+            # Una página que no se lee cuenta como vacía; ya fallará la conversión
+            textos.append("")
+    limpio = clean_text_stream(textos, strip_headers=bool(ConfigManager().get("strip_headers", True)))
+    caracteres: int = sum(len(pagina) for pagina in limpio)
+    return int(caracteres / len(numeros) * total), len(numeros)
+
+def _median(valores: List[float], default: float) -> float:
+    return statistics.median(valores) if valores else default
+
+def _history_runs(history: JobHistory, voice: Optional[str], backend: Optional[str]) -> List[Dict[str, Any]]:
+    # Primero las de la misma voz; si no hay, las de cualquiera
+    filas: List[Dict[str, Any]] = []
+    for v in ((voice, None) if voice else (None,)):
+        filas = [r for r in history.recent(voice=v, backend=backend, limit=HISTORY_RUNS)
+                 if (r["chars"] or 0) >= MIN_HISTORY_CHARS]
+        if filas:
+            break
+    return filas
+
+# Peticiones a la vez con las que conviene empezar: donde acabó el control de
+# concurrencia en las últimas conversiones (arrancar ahí evita la subida desde abajo).
+# None si todavía no hay historial.
+def learned_concurrency(history: Optional[JobHistory] = None, backend: Optional[str] = None) -> Optional[int]:
+    history = history or JobHistory()
+    valores: List[float] = [r["concurrency"] for r in history.recent(backend=backend, limit=HISTORY_RUNS)
+                            if r["concurrency"]]
+    if not valores:
+        return None
+    maximo: int = int(ConfigManager().get("tts_max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    return max(1, min(int(round(statistics.median(valores))), maximo))
+
+# Reparto de las conexiones TTS del proceso entre documentos a la vez: (documentos, peticiones
+# por documento). Con lo aprendido, si cada trabajo aguanta 8 peticiones y el límite global
+# es 8, no sirve de nada arrancar dos documentos a la vez; si solo aguanta 2, caben cuatro.
+def plan_concurrency(history: Optional[JobHistory] = None) -> Tuple[int, int]:
+    conexiones: int = int(ConfigManager().get("max_tts_connections", DEFAULT_MAX_TTS_CONNECTIONS))
+    por_trabajo: int = learned_concurrency(history) or DEFAULT_CONCURRENCY
+    trabajos: int = max(1, min(conexiones // max(1, por_trabajo), MAX_AUTO_PARALLEL_JOBS))
+    return trabajos, max(1, min(por_trabajo, conexiones // trabajos))
+
+# Estima caracteres, duración del audio, tiempo de síntesis y tamaño del MP3 de un PDF
+# (o de las páginas [inicio, fin)). Del PDF solo se miran el número de páginas y unas
+# pocas páginas de muestra; el resto sale de las conversiones anteriores (JobHistory).
+def estimate_job(pdf_path: str, voice: Optional[str] = None, rate: Optional[str] = None,
+                 pages: Optional[Tuple[int, int]] = None, backend: Optional[str] = None,
+                 history: Optional[JobHistory] = None) -> JobEstimate:
+    history = history or JobHistory()
+    rango: Tuple[int, int] = tuple(pages) if pages else (0, get_page_count(pdf_path))
+    caracteres, muestras = sample_chars(pdf_path, rango)
+
+    filas: List[Dict[str, Any]] = _history_runs(history, voice, backend)
+    con_audio = [r for r in filas if r["audio_seconds"]]
+    # Velocidad de lectura a +0%: cada ejecución se corrige por la velocidad que llevaba
+    lectura: float = _median([r["chars"] / r["audio_seconds"] / rate_factor(r["rate"]) for r in con_audio],
+                             DEFAULT_CHARS_PER_AUDIO_SECOND) * rate_factor(rate)
+    bytes_por_segundo: float = _median([r["audio_bytes"] / r["audio_seconds"] for r in con_audio if r["audio_bytes"]],
+                                       DEFAULT_AUDIO_BYTES_PER_SECOND)
+    # Lo que tarda de verdad un trabajo, sin contar los que salieron casi todo de la caché
+    sintesis: float = _median([r["chars_synthesized"] / r["seconds"] for r in filas
+                               if r["seconds"] and (r["chars_synthesized"] or 0) >= MIN_HISTORY_CHARS
+                               and 2 * (r["cache_hits"] or 0) <= (r["chunks"] or 0)],
+                              DEFAULT_SYNTHESIS_CHARS_PER_SECOND)
+
+    segundos_audio: float = caracteres / lectura
+    return JobEstimate(
+        pages=rango[1] - rango[0],
+        chars=caracteres,
+        audio_seconds=segundos_audio,
+        synthesis_seconds=caracteres / sintesis,
+        output_bytes=int(segundos_audio * bytes_por_segundo),
+        concurrency=learned_concurrency(history, backend) or DEFAULT_CONCURRENCY,
+        sampled_pages=muestras,
+        history_runs=len(filas),
+    )
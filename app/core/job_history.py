@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core import metrics
+from app.core.config_manager import ConfigManager
+
+# Ejecuciones que se guardan como mucho; las más viejas se borran
+MAX_HISTORY_RUNS: int = 2000
+
+# Columnas de cada ejecución, en el orden de la tabla
+RUN_FIELDS = (
+    "finished", "job", "pdf", "voice", "rate", "backend", "status",
+    "pages", "chars", "chars_synthesized", "chunks", "chunk_chars",
+    "audio_seconds", "audio_bytes", "seconds",
+    "extract_seconds", "clean_seconds", "tts_seconds", "mux_seconds",
+    "concurrency", "cache_hits",
+)
+_TEXT_FIELDS = {"job", "pdf", "voice", "rate", "backend", "status"}
+
+# Historial de conversiones en <config>/history.sqlite3: lo que tenía cada trabajo
+# (páginas, caracteres, trozos, voz, velocidad), lo que salió (duración y tamaño del
+# audio) y cuánto tardó cada etapa. Con esto se estima el coste de la próxima
+# conversión antes de empezarla (ver estimator).
+# Los tiempos de tts y clean son la suma de todas las peticiones, que van a la vez:
+# la duración real del trabajo es seconds.
+# También guarda con qué límites de trozo se partió cada documento (chunk_plans), para
+# que al convertirlo otra vez los trozos salgan iguales (ver chunk_tuner.ChunkPlan).
+class JobHistory:
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path: Path = Path(path) if path else ConfigManager().config_dir / "history.sqlite3"
+        self._lock: threading.Lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        columnas: str = ", ".join(f"{campo} {'TEXT' if campo in _TEXT_FIELDS else 'REAL'}" for campo in RUN_FIELDS)
+        with self._connect() as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, {columnas})")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_voice ON runs (voice, rate)")
+            db.execute("CREATE TABLE IF NOT EXISTS chunk_plans (document TEXT, pages TEXT, plan TEXT, "
+                       "updated REAL, PRIMARY KEY (document, pages))")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Una conexión por operación: escriben varios trabajos y procesos a la vez
+        db: sqlite3.Connection = sqlite3.connect(str(self.path), timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, run: Dict[str, Any]) -> None:
+        # Las claves que falten se guardan vacías
+        datos: Dict[str, Any] = dict(run)
+        datos.setdefault("finished", time.time())
+        fila = [datos.get(campo) for campo in RUN_FIELDS]
+        try:
+            with self._lock, self._connect() as db:
+                db.execute(f"INSERT INTO runs ({', '.join(RUN_FIELDS)}) VALUES ({', '.join('?' * len(RUN_FIELDS))})",
+                           fila)
+                db.execute("DELETE FROM runs WHERE id <= (SELECT MAX(id) FROM runs) - ?", (MAX_HISTORY_RUNS,))
+        except sqlite3.Error as e:
+            metrics.record_error("history", e, "No se pudo guardar el historial de conversiones")
+
+    def recent(self, voice: Optional[str] = None, rate: Optional[str] = None, backend: Optional[str] = None,
+               status: Optional[str] = "succeeded", limit: int = 20) -> List[Dict[str, Any]]:
+        # Últimas ejecuciones, de la más nueva a la más vieja, filtrando por voz, velocidad y servicio
+        condiciones: List[str] = []
+        valores: List[Any] = []
+        for campo, valor in (("voice", voice), ("rate", rate), ("backend", backend), ("status", status)):
+            if valor is not None:
+                condiciones.append(f"{campo} = ?")
+                valores.append(valor)
+        donde: str = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        try:
+            with self._connect() as db:
+                filas = db.execute(f"SELECT {', '.join(RUN_FIELDS)} FROM runs {donde} ORDER BY id DESC LIMIT ?",
+                                   valores + [limit]).fetchall()
+        except sqlite3.Error as e:
+            metrics.record_error("history", e, "No se pudo leer el historial de conversiones")
+            return []
+        return [dict(zip(RUN_FIELDS, fila)) for fila in filas]
+
+    @staticmethod
+    def _pages_key(pages: Optional[Tuple[int, int]]) -> str:
+        return f"{pages[0]}-{pages[1]}" if pages else ""
+
+    def chunk_plan(self, document: str, pages: Optional[Tuple[int, int]] = None) -> Optional[List[List[int]]]:
+        # Límites de trozo de la última conversión de ese documento (hash del PDF) y páginas
+        try:
+            with self._connect() as db:
+                fila = db.execute("SELECT plan FROM chunk_plans WHERE document = ? AND pages = ?",
+                                  (document, self._pages_key(pages))).fetchone()
+        except sqlite3.Error as e:
+            metrics.record_error("history", e, "No se pudo leer el troceo guardado")
+            return None
+        try:
+            return json.loads(fila[0]) if fila else None
+        except ValueError:
+            return None
+
+    def save_chunk_plan(self, document: str, pages: Optional[Tuple[int, int]], plan: List[List[int]]) -> None:
+        try:
+            with self._lock, self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO chunk_plans (document, pages, plan, updated) VALUES (?, ?, ?, ?)",
+                           (document, self._pages_key(pages), json.dumps(plan), time.time()))
+                db.execute("DELETE FROM chunk_plans WHERE rowid NOT IN "
+                           "(SELECT rowid FROM chunk_plans ORDER BY updated DESC LIMIT ?)", (MAX_HISTORY_RUNS,))
+        except sqlite3.Error as e:
+            metrics.record_error("history", e, "No se pudo guardar el troceo del documento")
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM runs")
+            db.execute("DELETE FROM chunk_plans")
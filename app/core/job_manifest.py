@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config_manager import ConfigManager
+
+# Se sube si cambia el formato del manifiesto; los viejos se descartan
+MANIFEST_VERSION: int = 2
+# El manifiesto se escribe entero cada vez, así que con miles de trozos guardarlo en cada
+# uno costaría O(n²). Se guarda cada tantos cambios o segundos, y al cerrar (flush).
+# Lo guardado puede ir por detrás del .part, nunca por delante: tras un corte se retoma
+# un poco antes y se repiten esos trozos.
+SAVE_EVERY_CHANGES: int = 64
+SAVE_INTERVAL_SECONDS: float = 5.0
+
+# Calcula el sha256 de un archivo leyéndolo por bloques
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(block_size), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Manifiesto de un trabajo de conversión. Guarda qué PDF y qué ajustes se usaron,
+# cómo se partió el texto y cuántos trozos ya están escritos en el archivo a medias
+# (<salida>.part, ver audio_builder.StreamingMp3Writer), para poder retomar la
+# conversión si se corta a la mitad.
+class JobManifest:
+    def __init__(self, job_dir: Path, data: Dict[str, Any]) -> None:
+        self.job_dir: Path = job_dir
+        self.path: Path = job_dir / "manifest.json"
+        self.data: Dict[str, Any] = data
+        # El productor de trozos y la síntesis lo tocan desde hilos distintos
+        self._lock: threading.RLock = threading.RLock()
+        # Cambios aún no escritos en disco y cuándo se guardó por última vez
+        self._unsaved: int = 0
+        self._saved_at: float = time.monotonic()
+
+    @staticmethod
+    def jobs_dir() -> Path:
+        return ConfigManager().config_dir / "jobs"
+
+    @staticmethod
+    def make_job_id(pdf_hash: str, settings: Dict[str, Any]) -> str:
+        # El mismo PDF con los mismos ajustes es siempre el mismo trabajo
+        clave: str = pdf_hash + json.dumps(settings, sort_keys=True)
+        return hashlib.sha256(clave.encode("utf-8")).hexdigest()[:24]
+
+    @classmethod
+    def open(cls, pdf_path: str, settings: Dict[str, Any]) -> "JobManifest":
+        # Carga el manifiesto del trabajo si existe, o prepara uno nuevo
+        pdf_hash: str = file_sha256(pdf_path)
+        job_id: str = cls.make_job_id(pdf_hash, settings)
+        job_dir: Path = cls.jobs_dir() / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+
+        manifest: JobManifest = cls(job_dir, {})
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as f:
+                data: Dict[str, Any] = json.load(f)
+            if data.get("version") == MANIFEST_VERSION and data.get("pdf_hash") == pdf_hash:
+                manifest.data = data
+        except (OSError, ValueError):
+            pass
+
+        if not manifest.data:
+            manifest.data = {
+                "version": MANIFEST_VERSION,
+                "job_id": job_id,
+                "pdf_path": os.path.abspath(pdf_path),
+                "pdf_hash": pdf_hash,
+                "settings": settings,
+                "created": time.time(),
+                "chunks": [],
+                # Trozos ya escritos en orden en el .part de la salida y su tamaño
+                "committed": 0,
+                "committed_bytes": 0,
+            }
+        return manifest
+
+    @property
+    def job_id(self) -> str:
+        return self.data["job_id"]
+
+    @property
+    def pdf_hash(self) -> str:
+        return self.data["pdf_hash"]
+
+    def record_chunk(self, index: int, chunk: str) -> bool:
+        # Registra los límites de un trozo dentro del texto limpio según se va produciendo.
+        # Si coincide con lo que ya había se conserva lo escrito; si no, el texto
+        # o el troceo cambiaron y todo lo que venía desde aquí ya no sirve.
+        # Devuelve True si había audio escrito desde este trozo, que hay que recortar del .part.
+        with self._lock:
+            chunks: List[Dict[str, Any]] = self.data["chunks"]
+            inicio: int = chunks[index - 1]["end"] + 1 if index > 0 else 0
+            registro: Dict[str, Any] = {"start": inicio, "end": inicio + len(chunk), "sha256": _text_sha256(chunk)}
+
+            if index < len(chunks) and all(chunks[index].get(k) == v for k, v in registro.items()):
+                return False
+            recortado: bool = self._truncate(index)
+            chunks.append(registro)
+            # Si se invalidó audio escrito se guarda ya: el .part se va a recortar
+            self._changed(force=recortado)
+            return recortado
+
+    def chunk_length(self, index: int) -> Optional[int]:
+        # Largo del trozo tal como se cortó en una ejecución anterior (None si no se llegó a él)
+        with self._lock:
+            chunks: List[Dict[str, Any]] = self.data["chunks"]
+            if index < len(chunks):
+                return chunks[index]["end"] - chunks[index]["start"]
+            return None
+
+    def finish_chunks(self, count: int) -> None:
+        # Se llama al acabar de leer el texto: descarta trozos sobrantes de una versión anterior
+        with self._lock:
+            if count < len(self.data["chunks"]):
+                self._truncate(count)
+                self.save()
+
+    def _truncate(self, index: int) -> bool:
+        # Lo escrito en el .part a partir de este trozo deja de valer
+        del self.data["chunks"][index:]
+        if self.data["committed"] <= index:
+            return False
+        self.data["committed"] = index
+        self.data["committed_bytes"] = self.data["chunks"][index - 1].get("bytes", 0) if index > 0 else 0
+        return True
+
+    @property
+    def committed_chunks(self) -> int:
+        return self.data["committed"]
+
+    @property
+    def committed_bytes(self) -> int:
+        return self.data["committed_bytes"]
+
+    def is_done(self, index: int) -> bool:
+        return index < self.data["committed"]
+
+    def mark_committed(self, count: int, nbytes: int) -> None:
+        # Los primeros `count` trozos ya están en el .part de la salida, que mide nbytes
+        with self._lock:
+            self.data["committed"] = count
+            self.data["committed_bytes"] = nbytes
+            if 0 < count <= len(self.data["chunks"]):
+                self.data["chunks"][count - 1]["bytes"] = nbytes
+            self._changed(force=count == 0)
+
+    def audio_ranges(self) -> List[Optional[Tuple[int, int]]]:
+        # Dónde está el audio de cada trozo dentro de la salida: (inicio, fin) en bytes,
+        # o None si no se sabe (trozos de un manifiesto que no apuntaba cada final)
+        with self._lock:
+            rangos: List[Optional[Tuple[int, int]]] = []
+            anterior: Optional[int] = 0
+            for chunk in self.data["chunks"]:
+                fin: Optional[int] = chunk.get("bytes")
+                rangos.append((anterior, fin) if anterior is not None and fin is not None else None)
+                anterior = fin
+            return rangos
+
+    def _changed(self, force: bool = False) -> None:
+        self._unsaved += 1
+        if force or self._unsaved >= SAVE_EVERY_CHANGES or \
+                time.monotonic() - self._saved_at >= SAVE_INTERVAL_SECONDS:
+            self.save()
+
+    def flush(self) -> None:
+        # Escribe lo que falte; se llama al parar el trabajo sin terminarlo
+        with self._lock:
+            if self._unsaved:
+                self.save()
+
+    def save(self) -> None:
+        # Escritura atómica para que un cierre repentino no deje el manifiesto corrupto
+        with self._lock:
+            self.data["updated"] = time.time()
+            tmp: Path = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f)
+            os.replace(tmp, self.path)
+            self._unsaved = 0
+            self._saved_at = time.monotonic()
+
+    def cleanup_partial(self) -> None:
+        # Borra escrituras a medias (p. ej. al cancelar); lo terminado se conserva para retomar
+        for tmp in self.job_dir.glob("*.tmp"):
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+    def remove(self) -> None:
+        # Borra el trabajo completo cuando la conversión terminó bien
+        with self._lock:
+            self._unsaved = 0
+        shutil.rmtree(self.job_dir, ignore_errors=True)
@@ -0,0 +1,745 @@
+import asyncio
+import heapq
+import ipaddress
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.pdf_reader import iter_pages, ExtractionError
+from app.core.text_cleaner import clean_text_stream
+from app.core.tts_engine import EdgeTTSBackend, iter_text_chunks, retry_delay
+from app.core.tts_engine import DEFAULT_CHUNK_CHARS, DEFAULT_CONCURRENCY, DEFAULT_RETRIES
+from app.core.config_manager import ConfigManager
+from app.core.audio_cache import AudioCache, audio_cache
+from app.core.audio_builder import StreamingMp3Writer, iter_mp3_frames_bytes, DEFAULT_REORDER_CHUNKS
+from app.core.job_manifest import JobManifest
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+# Puerto por defecto del coordinador
+DEFAULT_SERVER_PORT: int = 8770
+# Lo que dura un préstamo de trozo sin noticias del trabajador que lo tiene
+DEFAULT_LEASE_SECONDS: float = 30.0
+# Cada cuánto avisa un trabajador de que sigue vivo (renueva sus préstamos)
+DEFAULT_HEARTBEAT_SECONDS: float = 5.0
+# Lo que espera como mucho una petición de trabajo si no hay nada que repartir
+LEASE_WAIT_SECONDS: float = 10.0
+# Veces que se reparte un trozo que falla antes de dar el documento por perdido
+MAX_CHUNK_ATTEMPTS: int = DEFAULT_RETRIES + 1
+# Cabecera con la clave compartida (server_token en la configuración)
+TOKEN_HEADER: str = "X-Narralib-Token"
+
+# Un trozo prestado a un trabajador hasta `expires`
+class Lease:
+    def __init__(self, worker: str, job: str, index: int, seconds: float) -> None:
+        self.id: str = uuid.uuid4().hex
+        self.worker: str = worker
+        self.job: str = job
+        self.index: int = index
+        self.expires: float = time.monotonic() + seconds
+
+# Un documento en el coordinador: su texto se va cortando en trozos según se reparten,
+# y el audio que devuelven los trabajadores se escribe en orden en la salida.
+class ServerJob:
+    def __init__(self, job_id: str, pdf_path: str, output_path: str, voice: str, rate: str,
+                 pages: Optional[Tuple[int, int]] = None) -> None:
+        self.id: str = job_id
+        self.pdf_path: str = pdf_path
+        self.output_path: str = output_path
+        self.voice: str = voice
+        self.rate: str = rate
+        self.pages: Optional[Tuple[int, int]] = tuple(pages) if pages else None
+        self.state: str = "queued" # queued, running, finishing, done, failed, cancelled
+        self.message: str = ""
+        self.manifest: Optional[JobManifest] = None
+        self.writer: Optional[StreamingMp3Writer] = None
+        self.chunks: Optional[Iterator[str]] = None
+        self.exhausted: bool = False
+        self.produced: int = 0
+        self.chunks_done: int = 0
+        self.chars_done: int = 0
+        # Trozos cortados y aún sin audio, los que esperan trabajador y los prestados
+        self.texts: Dict[int, str] = {}
+        self.pending: List[int] = []
+        self.leased: Dict[int, str] = {}
+        # Todos los préstamos dados de cada trozo: solo se acepta audio que venga con uno
+        self.issued: Dict[int, Set[str]] = {}
+        self.attempts: Dict[int, int] = {}
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.submitted: float = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+    def to_dict(self) -> Dict[str, Any]:
+        fin: float = self.finished or time.time()
+        return {
+            "job": self.id,
+            "pdf": self.pdf_path,
+            "output": self.output_path,
+            "voice": self.voice,
+            "rate": self.rate,
+            "page_range": list(self.pages) if self.pages else None,
+            "state": self.state,
+            "message": self.message,
+            "chunks": self.produced if self.exhausted else None,
+            "chunks_done": self.chunks_done,
+            "chunks_leased": len(self.leased),
+            "chars_done": self.chars_done,
+            "seconds": round(fin - self.started, 3) if self.started else None,
+        }
+
+# Coordinador del modo servidor: corta los documentos en trozos y los presta por HTTP
+# a cualquier número de trabajadores (JobWorker), en esta máquina o en otras.
+# Cada préstamo caduca si el trabajador deja de dar señales (latido) y el trozo vuelve
+# a la cola para otro; si un trozo llega dos veces, la segunda se descarta. El audio se
+# escribe con StreamingMp3Writer y el avance queda en el manifiesto del trabajo, como en
+# ConversionJob, así que reiniciar el coordinador retoma desde lo ya escrito.
+# Todo el estado vive en el bucle asyncio; leer el PDF y escribir el MP3 van a hilos.
+#
+#   POST   /api/jobs                            {"pdf", "output", "voice", "rate", "pages"}
+#   GET    /api/jobs/<job>          DELETE /api/jobs/<job>          GET /api/status
+#   POST   /api/workers                         {"name", "concurrency"} -> {"worker", ...}
+#   POST   /api/workers/<id>/heartbeat
+#   POST   /api/workers/<id>/lease              -> {"lease", "job", "index", "text", "voice", "rate"} o 204
+#   PUT    /api/jobs/<job>/chunks/<n>?lease=…   cuerpo: el MP3 del trozo
+#   POST   /api/jobs/<job>/chunks/<n>/fail      {"lease", "error"}
+#
+# Sin token solo escucha en la máquina local. Los documentos que llegan por HTTP solo
+# pueden escribir en output_dir ("server_output_dir") o, sin ella, junto a su PDF.
+class JobCoordinator:
+    def __init__(self, lease_seconds: Optional[float] = None, heartbeat_seconds: Optional[float] = None,
+                 token: Optional[str] = None, chunk_chars: Optional[int] = None,
+                 output_dir: Optional[str] = None) -> None:
+        config = ConfigManager()
+        self.lease_seconds: float = float(lease_seconds or config.get("server_lease_seconds", DEFAULT_LEASE_SECONDS))
+        self.heartbeat_seconds: float = float(heartbeat_seconds or min(DEFAULT_HEARTBEAT_SECONDS,
+                                                                       self.lease_seconds / 3))
+        self.token: Optional[str] = token if token is not None else config.get("server_token")
+        self.chunk_chars: int = int(chunk_chars or config.get("tts_chunk_chars", DEFAULT_CHUNK_CHARS))
+        carpeta: Optional[str] = output_dir or config.get("server_output_dir")
+        self.output_dir: Optional[str] = os.path.realpath(carpeta) if carpeta else None
+        self.max_pending: int = int(config.get("reorder_buffer_chunks", DEFAULT_REORDER_CHUNKS))
+        self.jobs: Dict[str, ServerJob] = {}
+        self.workers: Dict[str, Dict[str, Any]] = {}
+        self.leases: Dict[str, Lease] = {}
+        self._version: int = 0
+        self._changed: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._closing: bool = False
+
+    # --- Trabajos ---
+
+    def submit(self, pdf_path: str, output_path: str, voice: str, rate: str,
+               pages: Optional[Tuple[int, int]] = None) -> str:
+        job_id: str = uuid.uuid4().hex[:12]
+        self.jobs[job_id] = ServerJob(job_id, os.path.abspath(pdf_path), os.path.abspath(output_path),
+                                      voice, rate, pages)
+        logger.info("Documento %s en cola: %s", job_id, pdf_path,
+                    extra={"event": "server_job_queued", "job": job_id, "pdf": pdf_path})
+        self._bump()
+        return job_id
+
+    def output_for(self, pdf_path: str, output_path: Optional[str]) -> Optional[str]:
+        # Salida de un documento pedido por HTTP, o None si cae fuera de la carpeta permitida
+        carpeta: str = self.output_dir or os.path.dirname(os.path.realpath(pdf_path))
+        if not output_path:
+            output_path = os.path.join(carpeta, os.path.splitext(os.path.basename(pdf_path))[0] + ".mp3")
+        salida: str = os.path.realpath(output_path)
+        if os.path.commonpath([carpeta, salida]) != carpeta or not salida.lower().endswith(".mp3"):
+            return None
+        return salida
+
+    def cancel(self, job_id: str) -> bool:
+        job: Optional[ServerJob] = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        self._close_job(job, "cancelled", "Conversión cancelada")
+        if job.manifest is not None:
+            job.manifest.cleanup_partial()
+        return True
+
+    def all_done(self) -> bool:
+        return not any(job.active or job.state == "finishing" for job in self.jobs.values())
+
+    def status(self) -> Dict[str, Any]:
+        ahora: float = time.monotonic()
+        return {
+            "jobs": [job.to_dict() for job in self.jobs.values()],
+            "workers": [{"worker": worker_id, "name": datos["name"], "leases": len(datos["leases"]),
+                         "chunks_done": datos["chunks_done"], "idle_seconds": round(ahora - datos["last_seen"], 1)}
+                        for worker_id, datos in self.workers.items()],
+            "pending": sum(len(job.pending) for job in self.jobs.values()),
+            "leases": len(self.leases),
+        }
+
+    async def _start(self, job: ServerJob) -> None:
+        # Prepara el manifiesto y la salida, igual que ConversionJob
+        config = ConfigManager()
+        settings: Dict[str, Any] = {"voice": job.voice, "rate": job.rate, "chunk_chars": self.chunk_chars,
+                                    "output": job.output_path, "mode": "server"}
+        if job.pages:
+            settings["pages"] = list(job.pages)
+        manifest: JobManifest = await asyncio.to_thread(JobManifest.open, job.pdf_path, settings)
+        writer = StreamingMp3Writer(job.output_path, max_pending=self.max_pending, on_commit=manifest.mark_committed)
+        if await asyncio.to_thread(writer.resume, manifest.committed_chunks,
+                                   manifest.committed_bytes) < manifest.committed_chunks:
+            manifest.mark_committed(0, 0)
+        job.manifest, job.writer = manifest, writer
+
+        def limite(indice: int) -> int:
+            # Al retomar, los trozos ya cortados se repiten igual para aprovechar lo hecho
+            return manifest.chunk_length(indice) or self.chunk_chars
+
+        paginas = clean_text_stream(iter_pages(job.pdf_path, config.get("extract_workers"), job.pages),
+                                    strip_headers=bool(config.get("strip_headers", True)))
+        job.chunks = iter_text_chunks(paginas, limite)
+        job.state = "running"
+        job.started = time.time()
+        logger.info("Documento %s en marcha (%d trozos ya escritos)", job.id, manifest.committed_chunks,
+                    extra={"event": "server_job_started", "job": job.id, "committed": manifest.committed_chunks})
+
+    def _next_chunk(self, job: ServerJob) -> Optional[Tuple[int, str, bool]]:
+        # En un hilo: corta el siguiente trozo y lo apunta en el manifiesto
+        chunk: Optional[str] = next(job.chunks, None)
+        if chunk is None:
+            return None
+        indice: int = job.produced
+        return indice, chunk, job.manifest.record_chunk(indice, chunk)
+
+    async def _fill(self, job: ServerJob) -> None:
+        # Corta trozos nuevos mientras quepan en la ventana del escritor, así un trozo
+        # que se retrasa no hace que se acumule en memoria el audio de los siguientes
+        async with job.lock:
+            if job.state == "queued":
+                await self._start(job)
+            while job.state == "running" and not job.exhausted \
+                    and job.produced < job.writer.next_index + self.max_pending:
+                siguiente = await asyncio.to_thread(self._next_chunk, job)
+                if siguiente is None:
+                    job.exhausted = True
+                    job.manifest.finish_chunks(job.produced)
+                    break
+                indice, chunk, recortar = siguiente
+                job.produced += 1
+                if job.manifest.is_done(indice):
+                    # Ya está en el .part de una ejecución anterior
+                    job.chunks_done += 1
+                    job.chars_done += len(chunk)
+                    continue
+                if recortar:
+                    # El texto cambió antes de lo ya escrito: se recorta el .part hasta ahí
+                    await asyncio.to_thread(job.writer.resume, job.manifest.committed_chunks,
+                                            job.manifest.committed_bytes)
+                job.texts[indice] = chunk
+                heapq.heappush(job.pending, indice)
+        await self._maybe_finish(job)
+
+    async def _maybe_finish(self, job: ServerJob) -> None:
+        if job.state != "running" or not job.exhausted or job.texts:
+            return
+        if job.produced == 0:
+            self._close_job(job, "failed", "No se pudo leer el texto del PDF.", remove=True)
+            return
+        job.state = "finishing"
+        try:
+            with metrics.span("mux"):
+                await asyncio.to_thread(job.writer.finish)
+        except (OSError, ValueError) as e:
+            metrics.record_error("server", e, f"No se pudo cerrar el audio de {job.id}")
+            self._close_job(job, "failed", f"Error al guardar el audio: {e}")
+            return
+        job.manifest.remove()
+        job.state = "done"
+        job.finished = time.time()
+        job.message = f"Audio guardado en: {job.output_path}"
+        logger.info("Documento %s terminado en %.1fs", job.id, job.finished - job.started,
+                    extra={"event": "server_job_done", "job": job.id, "chunks": job.produced,
+                           "seconds": job.finished - job.started})
+        self._bump()
+
+    def _close_job(self, job: ServerJob, state: str, message: str, remove: bool = False) -> None:
+        job.state = state
+        job.message = message
+        job.finished = time.time()
+        for lease_id in job.leased.values():
+            self._drop_lease(lease_id)
+        job.leased.clear()
+        job.issued.clear()
+        job.pending.clear()
+        job.texts.clear()
+        if job.writer is not None:
+            # Sin remove, el .part se queda para retomar
+            job.writer.close(remove=remove)
+        if job.manifest is not None:
+            job.manifest.flush()
+        logger.info("Documento %s: %s (%s)", job.id, state, message,
+                    extra={"event": f"server_job_{state}", "job": job.id})
+        self._bump()
+
+    # --- Préstamos ---
+
+    def _drop_lease(self, lease_id: str) -> Optional[Lease]:
+        lease: Optional[Lease] = self.leases.pop(lease_id, None)
+        if lease is not None and lease.worker in self.workers:
+            self.workers[lease.worker]["leases"].discard(lease_id)
+        return lease
+
+    def _requeue(self, lease: Lease, motivo: str) -> None:
+        # El trozo vuelve a la cola (delante de todo: el escritor lo está esperando)
+        self._drop_lease(lease.id)
+        job: Optional[ServerJob] = self.jobs.get(lease.job)
+        if job is None or job.leased.get(lease.index) != lease.id:
+            return
+        del job.leased[lease.index]
+        intentos: int = job.attempts.get(lease.index, 0) + 1
+        job.attempts[lease.index] = intentos
+        metrics.incr("chunks_reassigned")
+        logger.warning("Trozo %d de %s vuelve a la cola (%s, intento %d)", lease.index, job.id, motivo, intentos,
+                       extra={"event": "chunk_requeued", "job": job.id, "chunk": lease.index,
+                              "reason": motivo, "attempt": intentos})
+        if intentos >= MAX_CHUNK_ATTEMPTS:
+            self._close_job(job, "failed", f"El trozo {lease.index} falló {intentos} veces: {motivo}")
+            return
+        heapq.heappush(job.pending, lease.index)
+        self._bump()
+
+    async def lease(self, worker_id: str, wait: float = LEASE_WAIT_SECONDS) -> Optional[Dict[str, Any]]:
+        # Da el siguiente trozo (el de índice más bajo del documento más antiguo);
+        # si no hay ninguno, espera hasta `wait` segundos a que aparezca
+        limite: float = time.monotonic() + wait
+        while True:
+            version: int = self._version
+            trabajo: Optional[Dict[str, Any]] = await self._take(worker_id)
+            restante: float = limite - time.monotonic()
+            if trabajo is not None or restante <= 0 or worker_id not in self.workers or self._closing:
+                return trabajo
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self._version != version), restante)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _take(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        for job in list(self.jobs.values()):
+            if not job.active:
+                continue
+            try:
+                await self._fill(job)
+            except ExtractionError as e:
+                # El .part y el manifiesto se quedan para retomar cuando se pueda leer
+                self._close_job(job, "failed", str(e))
+                continue
+            except Exception as e:
+                metrics.record_error("server", e, f"Error al leer {job.pdf_path}")
+                self._close_job(job, "failed", f"Ocurrió un error inesperado: {e}")
+                continue
+            while job.state == "running" and job.pending:
+                indice: int = heapq.heappop(job.pending)
+                # Entradas viejas: trozo ya recibido o prestado de nuevo
+                if indice not in job.texts or indice in job.leased:
+                    continue
+                worker = self.workers.get(worker_id)
+                if worker is None:
+                    heapq.heappush(job.pending, indice)
+                    return None
+                lease = Lease(worker_id, job.id, indice, self.lease_seconds)
+                self.leases[lease.id] = lease
+                job.leased[indice] = lease.id
+                job.issued.setdefault(indice, set()).add(lease.id)
+                worker["leases"].add(lease.id)
+                metrics.incr("chunks_leased")
+                return {"lease": lease.id, "job": job.id, "index": indice, "text": job.texts[indice],
+                        "voice": job.voice, "rate": job.rate, "lease_seconds": self.lease_seconds}
+        return None
+
+    async def complete(self, job_id: str, index: int, lease_id: Optional[str], audio: bytes) -> str:
+        # Audio de un trozo. Tiene que venir con un préstamo de ese trozo; vale aunque
+        # haya caducado, si nadie lo entregó antes
+        job: Optional[ServerJob] = self.jobs.get(job_id)
+        if job is not None and job.state == "running" and lease_id not in job.issued.get(index, ()):
+            metrics.incr("chunks_forbidden")
+            return "forbidden"
+        lease: Optional[Lease] = self.leases.get(lease_id) if lease_id else None
+        if job is None or job.state != "running" or index not in job.texts:
+            if lease is not None:
+                self._drop_lease(lease.id)
+            metrics.incr("chunks_duplicate")
+            return "duplicate" if job is not None and job.state == "running" else "gone"
+        if not any(True for _ in iter_mp3_frames_bytes(audio)):
+            if lease is not None:
+                self._requeue(lease, "audio vacío o no es MP3")
+            return "rejected"
+
+        worker = self.workers.get(lease.worker) if lease is not None else None
+        texto: str = job.texts.pop(index)
+        otro: Optional[str] = job.leased.pop(index, None)
+        if otro is not None:
+            # Si el trozo se había vuelto a prestar, el otro trabajador ya no hace falta
+            self._drop_lease(otro)
+        if lease is not None:
+            self._drop_lease(lease.id)
+        try:
+            await asyncio.to_thread(job.writer.add, index, audio)
+        except (OSError, ValueError) as e:
+            metrics.record_error("server", e, f"No se pudo escribir el audio de {job.id}")
+            self._close_job(job, "failed", f"Error al escribir el audio: {e}")
+            return "failed"
+        job.chunks_done += 1
+        job.chars_done += len(texto)
+        if worker is not None:
+            worker["chunks_done"] += 1
+        metrics.incr("chunks_done")
+        # El escritor avanzó: puede que quepan trozos nuevos en la ventana
+        self._bump()
+        await self._maybe_finish(job)
+        return "ok"
+
+    def fail(self, lease_id: str, error: str) -> None:
+        lease: Optional[Lease] = self.leases.get(lease_id)
+        if lease is not None:
+            self._requeue(lease, error or "error del trabajador")
+
+    # --- Trabajadores ---
+
+    def register(self, name: str, concurrency: int) -> str:
+        worker_id: str = uuid.uuid4().hex[:12]
+        self.workers[worker_id] = {"name": name, "concurrency": concurrency, "last_seen": time.monotonic(),
+                                   "leases": set(), "chunks_done": 0}
+        logger.info("Trabajador %s (%s) conectado", worker_id, name,
+                    extra={"event": "worker_registered", "worker": worker_id, "worker_name": name})
+        return worker_id
+
+    def heartbeat(self, worker_id: str) -> bool:
+        # Renueva los préstamos del trabajador
+        worker = self.workers.get(worker_id)
+        if worker is None:
+            return False
+        ahora: float = time.monotonic()
+        worker["last_seen"] = ahora
+        for lease_id in worker["leases"]:
+            if lease_id in self.leases:
+                self.leases[lease_id].expires = ahora + self.lease_seconds
+        return True
+
+    def _reap(self) -> None:
+        # Préstamos caducados y trabajadores que dejaron de dar señales
+        ahora: float = time.monotonic()
+        for lease in [prestamo for prestamo in self.leases.values() if prestamo.expires <= ahora]:
+            metrics.incr("leases_expired")
+            self._requeue(lease, "préstamo caducado")
+        for worker_id, datos in list(self.workers.items()):
+            if ahora - datos["last_seen"] > self.lease_seconds:
+                metrics.incr("workers_lost")
+                logger.warning("Trabajador %s (%s) sin señales: se reparte lo que tenía", worker_id, datos["name"],
+                               extra={"event": "worker_lost", "worker": worker_id, "leases": len(datos["leases"])})
+                for lease_id in list(datos["leases"]):
+                    if lease_id in self.leases:
+                        self._requeue(self.leases[lease_id], "trabajador perdido")
+                del self.workers[worker_id]
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(min(1.0, self.lease_seconds / 4))
+            self._reap()
+
+    def _bump(self) -> None:
+        # Despierta a los trabajadores que esperan trozo
+        self._version += 1
+        if self._changed is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    # --- HTTP ---
+
+    def build_app(self):
+        from aiohttp import web
+
+        @web.middleware
+        async def autenticar(request, handler):
+            if self.token and request.headers.get(TOKEN_HEADER) != self.token:
+                return web.json_response({"error": "unauthorized"}, status=401)
+            return await handler(request)
+
+        async def crear_trabajo(request):
+            datos = await request.json()
+            if not datos.get("pdf") or not os.path.isfile(datos["pdf"]):
+                return web.json_response({"error": "pdf not found"}, status=400)
+            config = ConfigManager()
+            salida: Optional[str] = self.output_for(datos["pdf"], datos.get("output"))
+            if salida is None:
+                return web.json_response({"error": "output not allowed"}, status=403)
+            job_id: str = self.submit(datos["pdf"], salida, datos.get("voice") or config.get("voice", "es-ES-AlvaroNeural"),
+                                      datos.get("rate") or config.get("rate", "+0%"), datos.get("pages"))
+            return web.json_response(self.jobs[job_id].to_dict(), status=201)
+
+        async def ver_trabajo(request):
+            job = self.jobs.get(request.match_info["job"])
+            if job is None:
+                return web.json_response({"error": "unknown job"}, status=404)
+            return web.json_response(job.to_dict())
+
+        async def cancelar_trabajo(request):
+            if not self.cancel(request.match_info["job"]):
+                return web.json_response({"error": "unknown or finished job"}, status=404)
+            return web.json_response(self.jobs[request.match_info["job"]].to_dict())
+
+        async def estado(request):
+            return web.json_response(self.status())
+
+        async def registrar(request):
+            datos = await request.json() if request.can_read_body else {}
+            worker_id: str = self.register(str(datos.get("name") or request.remote),
+                                           int(datos.get("concurrency") or 1))
+            return web.json_response({"worker": worker_id, "lease_seconds": self.lease_seconds,
+                                      "heartbeat_seconds": self.heartbeat_seconds})
+
+        async def latido(request):
+            if not self.heartbeat(request.match_info["worker"]):
+                return web.json_response({"error": "unknown worker"}, status=404)
+            return web.json_response({"ok": True})
+
+        async def prestar(request):
+            worker_id: str = request.match_info["worker"]
+            if not self.heartbeat(worker_id):
+                return web.json_response({"error": "unknown worker"}, status=404)
+            espera: float = min(float(request.query.get("wait", LEASE_WAIT_SECONDS)), LEASE_WAIT_SECONDS)
+            trabajo = await self.lease(worker_id, espera)
+            if trabajo is None:
+                return web.Response(status=204)
+            return web.json_response(trabajo)
+
+        async def entregar(request):
+            audio: bytes = await request.read()
+            resultado: str = await self.complete(request.match_info["job"], int(request.match_info["index"]),
+                                                 request.query.get("lease"), audio)
+            codigos: Dict[str, int] = {"rejected": 422, "forbidden": 403}
+            return web.json_response({"result": resultado}, status=codigos.get(resultado, 200))
+
+        async def fallar(request):
+            datos = await request.json()
+            self.fail(str(datos.get("lease", "")), str(datos.get("error", "")))
+            return web.json_response({"ok": True})
+
+        async def arrancar(app):
+            self._changed = asyncio.Condition()
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+        async def cerrar(app):
+            # Las peticiones de trabajo que esperan vuelven ya, para no retrasar el cierre
+            self._closing = True
+            self._bump()
+
+        async def parar(app):
+            if self._reaper is not None:
+                self._reaper.cancel()
+            # Lo que quede a medias se queda en su .part para retomar
+            for job in self.jobs.values():
+                if job.writer is not None and job.state == "running":
+                    job.writer.close()
+                    job.manifest.flush()
+
+        app = web.Application(middlewares=[autenticar], client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/api/jobs", crear_trabajo)
+        app.router.add_get("/api/jobs/{job}", ver_trabajo)
+        app.router.add_delete("/api/jobs/{job}", cancelar_trabajo)
+        app.router.add_get("/api/status", estado)
+        app.router.add_post("/api/workers", registrar)
+        app.router.add_post("/api/workers/{worker}/heartbeat", latido)
+        app.router.add_post("/api/workers/{worker}/lease", prestar)
+        app.router.add_put("/api/jobs/{job}/chunks/{index}", entregar)
+        app.router.add_post("/api/jobs/{job}/chunks/{index}/fail", fallar)
+        app.on_startup.append(arrancar)
+        app.on_shutdown.append(cerrar)
+        app.on_cleanup.append(parar)
+        return app
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_SERVER_PORT,
+                    until_done: bool = False) -> None:
+        # Atiende hasta que se cancele; con until_done, hasta que no quede ningún documento
+        from aiohttp import web
+        if not self.token and not _is_loopback(host):
+            raise ValueError(f"Para escuchar en {host} hace falta una clave (--token o server_token)")
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Coordinador escuchando en %s:%d", host, port,
+                    extra={"event": "server_started", "host": host, "port": port})
+        try:
+            while not (until_done and self.all_done()):
+                await asyncio.sleep(0.2)
+        finally:
+            await runner.cleanup()
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+# Trabajador del modo servidor: pide trozos al coordinador, los sintetiza con su propio
+# backend (y su caché de audio) y devuelve el MP3. Mantiene `concurrency` trozos a la vez
+# y manda un latido periódico; si se cae, el coordinador reparte sus trozos a otro.
+# Si el coordinador se reinicia, vuelve a registrarse solo.
+class JobWorker:
+    def __init__(self, server_url: str, backend=None, concurrency: int = DEFAULT_CONCURRENCY,
+                 name: Optional[str] = None, token: Optional[str] = None, cache: Optional[AudioCache] = None) -> None:
+        self.server_url: str = server_url.rstrip("/")
+        self.backend = backend or EdgeTTSBackend()
+        self.concurrency: int = max(1, concurrency)
+        self.name: str = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.token: Optional[str] = token if token is not None else ConfigManager().get("server_token")
+        self.cache: AudioCache = cache or audio_cache()
+        self.worker_id: Optional[str] = None
+        self.heartbeat_seconds: float = DEFAULT_HEARTBEAT_SECONDS
+        self.chunks_done: int = 0
+        self.chunks_failed: int = 0
+        self._session = None
+        self._stop: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._register_lock: Optional[asyncio.Lock] = None
+
+    def run(self) -> None:
+        asyncio.run(self.run_async())
+
+    def stop(self) -> None:
+        # Se puede llamar desde otro hilo
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run_async(self) -> None:
+        import aiohttp
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._register_lock = asyncio.Lock()
+        cabeceras: Dict[str, str] = {TOKEN_HEADER: self.token} if self.token else {}
+        tiempo = aiohttp.ClientTimeout(total=LEASE_WAIT_SECONDS + 60)
+        async with aiohttp.ClientSession(headers=cabeceras, timeout=tiempo) as session:
+            self._session = session
+            await self._register(None)
+            tareas: List[asyncio.Task] = [asyncio.create_task(self._heartbeat_loop())]
+            tareas += [asyncio.create_task(self._slot()) for _ in range(self.concurrency)]
+            try:
+                await self._stop.wait()
+            finally:
+                for tarea in tareas:
+                    tarea.cancel()
+                await asyncio.gather(*tareas, return_exceptions=True)
+                await self.backend.close()
+
+    async def _request(self, method: str, path: str, **kwargs) -> Tuple[int, Any]:
+        async with self._session.request(method, self.server_url + path, **kwargs) as response:
+            if response.status == 204:
+                return 204, None
+            if response.status >= 400 and response.status != 404:
+                raise RuntimeError(f"El coordinador respondió {response.status}: {await response.text()}")
+            return response.status, await response.json(content_type=None)
+
+    async def _register(self, anterior: Optional[str]) -> None:
+        # Con varios huecos a la vez, solo el primero que lo note vuelve a registrarse
+        async with self._register_lock:
+            if self.worker_id != anterior:
+                return
+            intento: int = 0
+            while True:
+                try:
+                    _, datos = await self._request("POST", "/api/workers",
+                                                   json={"name": self.name, "concurrency": self.concurrency})
+                    break
+                except Exception as e:
+                    # El coordinador todavía no arrancó o se está reiniciando
+                    intento += 1
+                    logger.warning("No se pudo conectar con el coordinador: %s", e)
+                    await asyncio.sleep(retry_delay(intento))
+            self.worker_id = datos["worker"]
+            self.heartbeat_seconds = float(datos.get("heartbeat_seconds", DEFAULT_HEARTBEAT_SECONDS))
+            logger.info("Registrado en %s como %s", self.server_url, self.worker_id,
+                        extra={"event": "worker_connected", "worker": self.worker_id})
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            worker_id: Optional[str] = self.worker_id
+            try:
+                status, _ = await self._request("POST", f"/api/workers/{worker_id}/heartbeat")
+            except Exception as e:
+                logger.debug("Latido fallido: %s", e)
+                continue
+            if status == 404:
+                await self._register(worker_id)
+
+    async def _slot(self) -> None:
+        fallos: int = 0
+        while True:
+            worker_id: Optional[str] = self.worker_id
+            try:
+                status, trabajo = await self._request("POST", f"/api/workers/{worker_id}/lease")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                fallos += 1
+                logger.debug("No se pudo pedir trabajo: %s", e)
+                await asyncio.sleep(retry_delay(fallos, e))
+                continue
+            if status == 404:
+                await self._register(worker_id)
+                continue
+            if trabajo is None:
+                continue
+
+            try:
+                audio: bytes = await self._synthesize(trabajo)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # El coordinador lo presta a otro; aquí se espera un poco antes de seguir
+                fallos += 1
+                self.chunks_failed += 1
+                metrics.record_error("tts", e, f"Error al sintetizar el trozo {trabajo['index']}")
+                try:
+                    await self._request("POST", f"/api/jobs/{trabajo['job']}/chunks/{trabajo['index']}/fail",
+                                        json={"lease": trabajo["lease"], "error": repr(e)})
+                except Exception:
+                    pass
+                await asyncio.sleep(retry_delay(fallos, e))
+                continue
+
+            try:
+                await self._request("PUT", f"/api/jobs/{trabajo['job']}/chunks/{trabajo['index']}",
+                                    params={"lease": trabajo["lease"]}, data=audio,
+                                    headers={"Content-Type": "audio/mpeg"})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Si no llega, el préstamo caduca y el trozo se repite (ya en la caché)
+                logger.warning("No se pudo entregar el trozo %d: %s", trabajo["index"], e)
+                continue
+            fallos = 0
+            self.chunks_done += 1
+
+    async def _synthesize(self, trabajo: Dict[str, Any]) -> bytes:
+        texto, voz, velocidad = trabajo["text"], trabajo["voice"], trabajo["rate"]
+        audio: Optional[bytes] = await asyncio.to_thread(self.cache.get, texto, voz, velocidad)
+        if audio:
+            return audio
+        partes: List[bytes] = []
+        with metrics.span("tts"):
+            async for data in self.backend.stream(texto, voz, velocidad):
+                partes.append(data)
+        audio = b"".join(partes)
+        if not audio:
+            raise ValueError("El servicio no devolvió audio")
+        await asyncio.to_thread(self.cache.put, texto, voz, velocidad, audio)
+        return audio
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from app.core.config_manager import ConfigManager
+
+logger = logging.getLogger(__name__)
+
+# Conexiones TTS abiertas a la vez entre todos los trabajos
+DEFAULT_MAX_TTS_CONNECTIONS: int = 8
+# Tareas de CPU (leer PDF, unir audio) a la vez entre todos los trabajos
+DEFAULT_MAX_CPU_WORKERS: int = 2
+# Cada cuánto se reintenta coger un hueco desde asyncio
+_POLL_SECONDS: float = 0.02
+
+# Límite compartido entre hilos: cada trabajo corre en su propio hilo con su propio
+# bucle asyncio, así que un asyncio.Semaphore no sirve para repartir entre ellos.
+class SharedLimiter:
+    def __init__(self, limit: int) -> None:
+        self.limit: int = max(1, limit)
+        self._semaphore: threading.Semaphore = threading.Semaphore(self.limit)
+        self._lock: threading.Lock = threading.Lock()
+        self.in_use: int = 0
+
+    def _take(self, blocking: bool) -> bool:
+        if not self._semaphore.acquire(blocking=blocking):
+            return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_use -= 1
+        self._semaphore.release()
+
+    @contextmanager
+    def hold(self):
+        # Para código normal (hilos): espera bloqueando hasta que haya hueco
+        self._take(blocking=True)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot(self):
+        # Para corrutinas: espera sin bloquear el bucle, y si la tarea se cancela
+        # mientras espera no se queda con ningún hueco
+        while not self._take(blocking=False):
+            await asyncio.sleep(_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            self._release()
+
+# Control de concurrencia AIMD (como el de congestión de TCP) para las peticiones de un
+# trabajo: sube de uno en uno mientras todo va bien y se parte a la mitad cuando el
+# servicio pide frenar (429/503) o no contesta a tiempo. Así se trabaja cerca de lo que
+# aguanta el servicio sin saber de antemano cuánto es. Vive en el bucle asyncio del trabajo.
+class AdaptiveConcurrency:
+    def __init__(self, initial: int, maximum: Optional[int] = None, minimum: int = 1) -> None:
+        self.minimum: int = max(1, minimum)
+        self.maximum: int = max(self.minimum, maximum or initial)
+        self.limit: int = min(max(initial, self.minimum), self.maximum)
+        self.in_flight: int = 0
+        self._successes: int = 0
+        self._last_decrease: float = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Se crea dentro del bucle que la usa
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def slot(self):
+        condicion = self._get_condition()
+        async with condicion:
+            await condicion.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with condicion:
+                self.in_flight -= 1
+                condicion.notify_all()
+
+    def on_success(self) -> None:
+        # Suma uno por cada "ventana" completa de peticiones buenas
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self._successes = 0
+            self._set_limit(self.limit + 1)
+
+    def on_overload(self) -> None:
+        # Varias peticiones de la misma tanda suelen fallar juntas: solo bajamos una vez por tanda
+        ahora: float = time.monotonic()
+        if ahora - self._last_decrease < 1.0:
+            return
+        self._last_decrease = ahora
+        self._successes = 0
+        self._set_limit(max(self.minimum, self.limit // 2))
+
+    def _set_limit(self, limit: int) -> None:
+        if limit == self.limit:
+            return
+        logger.debug("Concurrencia TTS: %d -> %d", self.limit, limit,
+                     extra={"event": "concurrency", "limit": limit})
+        # on_success/on_overload se llaman con el hueco aún tomado: al soltarlo se
+        # despierta a los que esperan y vuelven a mirar el límite nuevo
+        self.limit = limit
+
+_tts_limiter: Optional[SharedLimiter] = None
+_cpu_limiter: Optional[SharedLimiter] = None
+_init_lock: threading.Lock = threading.Lock()
+
+# Límite global de conexiones al servicio TTS para todo el proceso
+def tts_limiter() -> SharedLimiter:
+    global _tts_limiter
+    with _init_lock:
+        if _tts_limiter is None:
+            limite = int(ConfigManager().get("max_tts_connections", DEFAULT_MAX_TTS_CONNECTIONS))
+            _tts_limiter = SharedLimiter(limite)
+        return _tts_limiter
+
+# Límite global de tareas pesadas de CPU (extracción y unión de audio) para todo el proceso
+def cpu_limiter() -> SharedLimiter:
+    global _cpu_limiter
+    with _init_lock:
+        if _cpu_limiter is None:
+            limite = int(ConfigManager().get("max_cpu_workers", DEFAULT_MAX_CPU_WORKERS))
+            _cpu_limiter = SharedLimiter(limite)
+        return _cpu_limiter
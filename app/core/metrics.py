@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Métricas de un trabajo de conversión: cuánto tarda cada etapa (extracción, limpieza,
+# síntesis, unión...), contadores de páginas, caracteres, bytes, reintentos y errores.
+# Los módulos no reciben el objeto como parámetro: usan el del trabajo en curso, que
+# viaja en una ContextVar (asyncio y asyncio.to_thread la copian solos).
+class JobMetrics:
+    def __init__(self, job_id: str = "global") -> None:
+        self.job_id: str = job_id
+        self.started: float = time.time()
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def add_span(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            datos = self.spans.setdefault(stage, {"seconds": 0.0, "count": 0, "max": 0.0})
+            datos["seconds"] += seconds
+            datos["count"] += 1
+            datos["max"] = max(datos["max"], seconds)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "spans": {k: dict(v) for k, v in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self) -> str:
+        # Formato de texto de Prometheus (para node_exporter textfile o similar)
+        datos = self.to_dict()
+        job: str = _escape_label(self.job_id)
+        lineas = [
+            "# HELP narralib_stage_seconds_total Tiempo acumulado por etapa.",
+            "# TYPE narralib_stage_seconds_total counter",
+        ]
+        for etapa, valores in sorted(datos["spans"].items()):
+            lineas.append(f'narralib_stage_seconds_total{{job="{job}",stage="{_escape_label(etapa)}"}} {valores["seconds"]:.6f}')
+        lineas += [
+            "# HELP narralib_stage_calls_total Veces que se ejecutó cada etapa.",
+            "# TYPE narralib_stage_calls_total counter",
+        ]
+        for etapa, valores in sorted(datos["spans"].items()):
+            lineas.append(f'narralib_stage_calls_total{{job="{job}",stage="{_escape_label(etapa)}"}} {int(valores["count"])}')
+        for nombre, valor in sorted(datos["counters"].items()):
+            metrica: str = "narralib_" + re.sub(r"[^a-zA-Z0-9_]", "_", nombre) + "_total"
+            lineas.append(f"# TYPE {metrica} counter")
+            lineas.append(f'{metrica}{{job="{job}"}} {valor}')
+        lineas.append(f'narralib_job_elapsed_seconds{{job="{job}"}} {datos["elapsed"]:.6f}')
+        return "\n".join(lineas) + "\n"
+
+    def write(self, directory: Optional[Path] = None) -> Path:
+        # Escribe <job_id>.json y <job_id>.prom en la carpeta de métricas
+        if directory is None:
+            from app.core.config_manager import ConfigManager
+            directory = ConfigManager().config_dir / "metrics"
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        nombre: str = re.sub(r"[^a-zA-Z0-9_.-]", "_", self.job_id)
+        ruta_json: Path = directory / f"{nombre}.json"
+        _write_atomic(ruta_json, json.dumps(self.to_dict(), indent=2))
+        _write_atomic(directory / f"{nombre}.prom", self.to_prometheus())
+        return ruta_json
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp: Path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# Métricas fuera de un trabajo (por ejemplo, la ventana leyendo voces)
+_global_metrics: JobMetrics = JobMetrics()
+_current: ContextVar[Optional[JobMetrics]] = ContextVar("narralib_metrics", default=None)
+
+def current() -> JobMetrics:
+    return _current.get() or _global_metrics
+
+@contextmanager
+def job_context(metrics: JobMetrics):
+    # Todo lo que se ejecute dentro (y las tareas o hilos que lance) registra en metrics
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def span(stage: str, **fields: Any):
+    # Mide cuánto tarda un bloque y lo suma a la etapa indicada
+    inicio: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos: float = time.perf_counter() - inicio
+        metricas = current()
+        metricas.add_span(stage, segundos)
+        logger.debug("span %s %.4fs", stage, segundos,
+                     extra={"event": "span", "job": metricas.job_id, "stage": stage, "seconds": segundos, **fields})
+
+def incr(name: str, value: float = 1) -> None:
+    current().incr(name, value)
+
+def record_error(stage: str, error: BaseException, message: str) -> None:
+    # Sustituye a los print() de error: cuenta el error y lo deja en el log con su etapa
+    metricas = current()
+    metricas.incr("errors")
+    metricas.incr(f"{stage}_errors")
+    logger.error("%s: %s", message, error,
+                 extra={"event": "error", "job": metricas.job_id, "stage": stage, "error": repr(error)})
+
+# Formato JSON de una línea por evento, para mandar los logs a un agregador
+class JsonFormatter(logging.Formatter):
+    _STANDARD = set(vars(logging.makeLogRecord({})))
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos: Dict[str, Any] = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in self._STANDARD and clave not in datos:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["exception"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+def configure_logging(level: int = logging.WARNING, json_format: bool = False) -> None:
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    raiz = logging.getLogger("app")
+    raiz.handlers[:] = [handler]
+    raiz.setLevel(level)
@@ -1,21 +1,204 @@
-import fitz
+import os
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    # Desde PyMuPDF 1.24 el módulo es pymupdf; con el nombre viejo (fitz) avisa por stdout
+    # al importarse, y eso estropearía el JSON o el audio que la línea de comandos escribe ahí
+    import pymupdf as fitz
+except ImportError:
+    import fitz
+
+from app.core import metrics
+from app.core.config_manager import ConfigManager
+from app.core.text_cache import TextCache
+
+# Por debajo de este número de páginas no compensa arrancar procesos
+PARALLEL_MIN_PAGES: int = 64
+# Páginas que procesa cada tarea del pool
+PAGES_PER_SHARD: int = 16
+# Lo que devuelve la extracción depende de la versión de PyMuPDF: si cambia, la caché de texto no vale
+EXTRACTOR_VERSION: str = f"fitz-{fitz.VersionBind}"
+
+_text_cache = None
+_text_cache_lock = threading.Lock()
+
+# La lectura del PDF falló a mitad. Se lanza en vez de terminar antes de tiempo para
+# que el trabajo falle (y se pueda retomar) en lugar de guardar medio libro como bueno.
+class ExtractionError(RuntimeError):
+    pass
+
+# Caché de texto compartida por todo el proceso; None si está apagada ("text_cache": false)
+def text_cache():
+    global _text_cache
+    if not ConfigManager().get("text_cache", True):
+        return None
+    with _text_cache_lock:
+        if _text_cache is None:
+            try:
+                _text_cache = TextCache(EXTRACTOR_VERSION)
+            except (OSError, sqlite3.Error) as e:
+                metrics.record_error("text_cache", e, "No se pudo abrir la caché de texto")
+                return None
+        return _text_cache
+
+def _cached_document(pdf_path):
+    # (caché, clave del documento), o (None, None) si no se puede usar la caché
+    cache = text_cache()
+    doc = cache.document_key(pdf_path) if cache is not None else None
+    return (cache, doc) if doc is not None else (None, None)
+
+# Cuenta las páginas sin leer su contenido
+def get_page_count(pdf_path):
+    cache, doc = _cached_document(pdf_path)
+    if doc is not None:
+        total = cache.get_info(doc).get("page_count")
+        if total is not None:
+            return total
+    try:
+        with fitz.open(pdf_path) as documento:
+            total = documento.page_count
+        if doc is not None:
+            cache.put_info(doc, page_count=total)
+        return total
+    except Exception as e:
+        metrics.record_error("extract", e, "Hubo un error al leer el PDF")
+        return 0
+
+# Índice del PDF (los marcadores que muestran los visores): lista de [nivel, título, página],
+# con las páginas empezando en 1. Vacía si el documento no tiene.
+def get_outline(pdf_path):
+    cache, doc = _cached_document(pdf_path)
+    if doc is not None:
+        indice = cache.get_info(doc).get("outline")
+        if indice is not None:
+            return indice
+    try:
+        with fitz.open(pdf_path) as documento:
+            indice = documento.get_toc(simple=True)
+        if doc is not None:
+            cache.put_info(doc, outline=indice)
+        return indice
+    except Exception as e:
+        metrics.record_error("extract", e, "Hubo un error al leer el índice del PDF")
+        return []
+
+# Lo ejecuta cada proceso del pool: abre su propia copia del documento
+# (los objetos de fitz no se pueden compartir entre procesos) y lee un rango de páginas.
+def _extract_page_range(pdf_path, inicio, fin):
+    with fitz.open(pdf_path) as documento:
+        return [documento[i].get_text() for i in range(inicio, fin)]
+
+# Lee el PDF página por página y va entregando el texto de cada una,
+# así no hace falta tener el documento entero en memoria.
+# Con workers > 1 los rangos de páginas se reparten entre varios procesos.
+# pages=(inicio, fin) lee solo esas páginas (desde 0, sin incluir fin), p. ej. un capítulo.
+# Las páginas que ya se leyeron alguna vez salen de la caché de texto sin abrir el PDF;
+# los huecos se leen con fitz y se guardan para la próxima.
+def iter_pages(pdf_path, workers=1, pages=None):
+    cache, doc = _cached_document(pdf_path)
+    if doc is None:
+        yield from _extract_pages(pdf_path, workers, pages)
+        return
+
+    inicio, fin = pages if pages else (0, get_page_count(pdf_path))
+    guardadas = cache.cached_pages(doc, inicio, fin)
+    pagina = inicio
+    while pagina < fin:
+        # Tramo de páginas seguidas que están (o no) en la caché
+        tramo = pagina
+        while tramo < fin and (tramo in guardadas) == (pagina in guardadas):
+            tramo += 1
+
+        if pagina in guardadas:
+            for bloque in range(pagina, tramo, PAGES_PER_SHARD):
+                textos = cache.get_pages(doc, bloque, min(bloque + PAGES_PER_SHARD, tramo))
+                for numero in range(bloque, min(bloque + PAGES_PER_SHARD, tramo)):
+                    texto = textos.get(numero)
+                    if texto is None:
+                        # Otro proceso la sacó de la caché mientras tanto
+                        texto = "".join(_extract_pages(pdf_path, 1, (numero, numero + 1)))
+                    yield texto
+        else:
+            nuevas = {}
+            try:
+                for numero, texto in enumerate(_extract_pages(pdf_path, workers, (pagina, tramo)), pagina):
+                    nuevas[numero] = texto
+                    if len(nuevas) >= PAGES_PER_SHARD:
+                        cache.put_pages(doc, nuevas)
+                        nuevas = {}
+                    yield texto
+            finally:
+                # También si la conversión se corta: lo ya leído sirve para la próxima vez
+                cache.put_pages(doc, nuevas)
+        pagina = tramo
+
+def _extract_pages(pdf_path, workers, pages):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        inicio, fin = pages if pages else (0, get_page_count(pdf_path))
+        if fin - inicio >= PARALLEL_MIN_PAGES:
+            yield from _iter_pages_parallel(pdf_path, inicio, fin, workers)
+            return
 
-# Esta función se encarga de leer el archivo PDF y sacar todo el texto que tiene adentro.
-def extract_text_from_pdf(pdf_path):
-    texto_completo = ""
-    
     try:
         # Abrimos el documento PDF usando la herramienta fitz
         documento = fitz.open(pdf_path)
-        
+    except Exception as e:
+        metrics.record_error("extract", e, "Hubo un error al leer el PDF")
+        raise ExtractionError(f"Hubo un error al leer el PDF: {e}") from e
+
+    try:
         # Vamos página por página para leer lo que dice
-        for pagina in documento:
-            # Extraemos las palabras de la página actual
-            texto_completo += pagina.get_text() + "\n"
-            
-        documento.close()
-        return texto_completo
-        
+        inicio, fin = pages if pages else (0, documento.page_count)
+        numero = inicio
+        for numero in range(inicio, min(fin, documento.page_count)):
+            with metrics.span("extract"):
+                texto = documento[numero].get_text()
+            metrics.incr("pages_extracted")
+            metrics.incr("chars_extracted", len(texto))
+            yield texto
     except Exception as e:
-        print(f"Hubo un error al leer el PDF: {e}")
+        metrics.record_error("extract", e, f"Hubo un error al leer la página {numero + 1} del PDF")
+        raise ExtractionError(f"Hubo un error al leer la página {numero + 1} del PDF: {e}") from e
+    finally:
+        documento.close()
+
+def _iter_pages_parallel(pdf_path, inicio, fin, workers):
+    rangos = deque((i, min(i + PAGES_PER_SHARD, fin)) for i in range(inicio, fin, PAGES_PER_SHARD))
+    pendientes = deque()
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # Solo adelantamos unos pocos rangos por proceso para que la memoria no crezca
+        # con el tamaño del libro, y los devolvemos en el orden de las páginas
+        while rangos or pendientes:
+            while rangos and len(pendientes) < workers * 2:
+                inicio, fin = rangos.popleft()
+                pendientes.append((inicio, pool.submit(_extract_page_range, pdf_path, inicio, fin)))
+            primera, futuro = pendientes.popleft()
+            try:
+                # Solo medimos la espera: el trabajo real ocurre en los otros procesos
+                with metrics.span("extract"):
+                    textos = futuro.result()
+            except Exception as e:
+                metrics.record_error("extract", e, f"Hubo un error al leer el PDF desde la página {primera + 1}")
+                raise ExtractionError(f"Hubo un error al leer el PDF desde la página {primera + 1}: {e}") from e
+            metrics.incr("pages_extracted", len(textos))
+            metrics.incr("chars_extracted", sum(len(t) for t in textos))
+            yield from textos
+    finally:
+        # También si quien lee deja el generador a medias: los rangos encargados que
+        # aún no empezaron se descartan en vez de esperar a que se lean para nada
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# Esta función se encarga de leer el archivo PDF y sacar todo el texto que tiene adentro.
+def extract_text_from_pdf(pdf_path, workers=1):
+    # Juntamos las páginas de una vez en lugar de ir sumando cadenas
+    try:
+        return "".join(pagina + "\n" for pagina in iter_pages(pdf_path, workers))
+    except ExtractionError:
         return ""
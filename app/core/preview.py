@@ -0,0 +1,148 @@
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.pdf_reader import iter_pages, get_page_count, ExtractionError
+from app.core.text_cleaner import clean_text_stream
+from app.core.tts_engine import TTSEngine, EdgeTTSBackend, iter_text_chunks, split_sentences, split_text
+from app.core.config_manager import ConfigManager
+from app.core.audio_cache import audio_cache
+from app.core.limits import tts_limiter
+
+logger = logging.getLogger(__name__)
+
+# Texto que se lee si no hay ningún documento abierto
+SAMPLE_TEXT: str = "Hola. Esta es la voz que se usará para leer tu documento."
+# Caracteres que se leen al escuchar el principio del documento (unas pocas oraciones)
+PREVIEW_CHARS: int = 400
+# Tope de texto al escuchar un rango de páginas
+PREVIEW_RANGE_CHARS: int = 6000
+# El primer trozo es corto para que el primer audio llegue cuanto antes
+FIRST_CHUNK_CHARS: int = 200
+# Páginas que se abren como mucho (portadas, páginas en blanco...)
+PREVIEW_MAX_PAGES: int = 20
+# Es para escuchar ya: si el servicio falla se reintenta poco
+PREVIEW_RETRIES: int = 1
+
+# "12" o "12-14" (contando desde 1) -> (11, 14), como los rangos de pdf_reader.iter_pages
+def parse_page_range(texto: str) -> Optional[Tuple[int, int]]:
+    m = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?', texto or "")
+    if not m:
+        return None
+    inicio: int = int(m.group(1))
+    fin: int = int(m.group(2) or inicio)
+    if inicio < 1 or fin < inicio:
+        return None
+    return inicio - 1, fin
+
+# Texto de la vista previa: las primeras oraciones del documento o el rango de páginas
+# pedido. Solo se abren las páginas necesarias, así da igual lo grande que sea el PDF.
+def preview_text(pdf_path: str, pages: Optional[Tuple[int, int]] = None) -> str:
+    if pages:
+        inicio, fin = pages
+        limite: int = PREVIEW_RANGE_CHARS
+    else:
+        inicio, fin = 0, PREVIEW_MAX_PAGES
+        limite = PREVIEW_CHARS
+    fin = min(fin, inicio + PREVIEW_MAX_PAGES, get_page_count(pdf_path))
+    if fin <= inicio:
+        return ""
+
+    oraciones: List[str] = []
+    largo: int = 0
+    paginas = clean_text_stream(iter_pages(pdf_path, 1, (inicio, fin)),
+                                strip_headers=bool(ConfigManager().get("strip_headers", True)))
+    try:
+        for pagina in paginas:
+            for oracion in split_sentences(pagina):
+                if oraciones and largo + len(oracion) > limite:
+                    return " ".join(oraciones)
+                oraciones.append(oracion)
+                largo += len(oracion) + 1
+    finally:
+        # Deja de leer el PDF en cuanto hay texto suficiente
+        paginas.close()
+    texto: str = " ".join(oraciones)
+    return split_text(texto, limite)[0] if len(texto) > limite else texto
+
+# Vista previa de una voz: sintetiza un poco de texto y va entregando el audio con
+# on_data(bytes) según llega, para empezar a reproducir sin esperar al final.
+# Mide el tiempo hasta el primer audio (TTFA) desde que se pide, leyendo el PDF incluido.
+class VoicePreview:
+    def __init__(self, pdf_path: Optional[str], voice: str, rate: str,
+                 on_data: Callable[[bytes], None],
+                 pages: Optional[Tuple[int, int]] = None, backend=None) -> None:
+        self.pdf_path: Optional[str] = pdf_path
+        self.voice: str = voice
+        self.rate: str = rate
+        self.on_data: Callable[[bytes], None] = on_data
+        self.pages: Optional[Tuple[int, int]] = pages
+        self.backend = backend
+        self.text: str = ""
+        self.text_seconds: Optional[float] = None
+        self.time_to_first_audio: Optional[float] = None
+        self.elapsed: float = 0.0
+        self.audio_bytes: int = 0
+        self._tts: Optional[TTSEngine] = None
+        self._is_running: bool = True
+
+    def run(self) -> Tuple[bool, str]:
+        inicio: float = time.monotonic()
+        try:
+            self.text = preview_text(self.pdf_path, self.pages) if self.pdf_path else SAMPLE_TEXT
+            self.text_seconds = time.monotonic() - inicio
+            if not self.text:
+                return False, "No hay texto en esas páginas."
+
+            backend = self.backend or EdgeTTSBackend()
+            maximo: int = getattr(backend, "max_chars", None) or PREVIEW_RANGE_CHARS
+            trozos: List[str] = list(iter_text_chunks([self.text],
+                                                      lambda i: FIRST_CHUNK_CHARS if i == 0 else maximo))
+
+            def recibir(data: bytes) -> None:
+                if self.time_to_first_audio is None:
+                    self.time_to_first_audio = time.monotonic() - inicio
+                    logger.info("Primer audio de la vista previa en %.2fs", self.time_to_first_audio,
+                                extra={"event": "preview_first_audio", "voice": self.voice,
+                                       "seconds": round(self.time_to_first_audio, 3)})
+                self.audio_bytes += len(data)
+                self.on_data(data)
+
+            # Con la caché, volver a escuchar la misma voz es inmediato. Comparte el límite
+            # de conexiones con las conversiones en curso
+            self._tts = TTSEngine(backend=backend, cache=audio_cache(), limiter=tts_limiter(),
+                                  retries=PREVIEW_RETRIES)
+            if not self._is_running:
+                self._tts.cancel()
+            if self._tts.stream_audio(trozos, recibir, self.voice, self.rate):
+                return True, "Vista previa terminada"
+            if not self._is_running:
+                return False, "Vista previa detenida"
+            return False, f"No se pudo generar la vista previa: {self._tts.last_error}"
+        except ExtractionError as e:
+            return False, str(e)
+        finally:
+            self.elapsed = time.monotonic() - inicio
+
+    def cancel(self) -> None:
+        self._is_running = False
+        if self._tts is not None:
+            self._tts.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return not self._is_running
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "pdf": self.pdf_path,
+            "voice": self.voice,
+            "rate": self.rate,
+            "page_range": list(self.pages) if self.pages else None,
+            "chars": len(self.text),
+            "text_seconds": round(self.text_seconds, 3) if self.text_seconds is not None else None,
+            "time_to_first_audio": round(self.time_to_first_audio, 3) if self.time_to_first_audio is not None else None,
+            "seconds": round(self.elapsed, 3),
+            "audio_bytes": self.audio_bytes,
+        }
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Optional
+
+# Peso de la última medida en la media de velocidad (más alto = reacciona más rápido)
+_SMOOTHING: float = 0.3
+# Cada cuánto se recalcula la velocidad (segundos)
+_SAMPLE_SECONDS: float = 1.0
+
+# Lleva la cuenta del avance de una conversión: páginas leídas, caracteres
+# sintetizados y bytes de audio recibidos, y a partir de ahí estima la velocidad
+# y el tiempo que falta. Lo alimentan varios hilos a la vez.
+class ProgressTracker:
+    def __init__(self, total_pages: int = 0) -> None:
+        self.total_pages: int = total_pages
+        self.pages_read: int = 0
+        self.chars_read: int = 0
+        self.chars_done: int = 0
+        self.chars_skipped: int = 0
+        self.chunks_done: int = 0
+        self.audio_bytes: int = 0
+        self.started: float = time.monotonic()
+
+        self._lock: threading.Lock = threading.Lock()
+        self._rate: Optional[float] = None  # caracteres por segundo, suavizado
+        self._sample_time: float = self.started
+        self._sample_chars: int = 0
+
+    def page_read(self, chars: int) -> None:
+        with self._lock:
+            self.pages_read += 1
+            self.chars_read += chars
+
+    def chunk_done(self, chars: int) -> None:
+        with self._lock:
+            self.chunks_done += 1
+            self.chars_done += chars
+            self._update_rate()
+
+    def chunk_skipped(self, chars: int) -> None:
+        # Trozos ya hechos en una ejecución anterior: cuentan como avance, no como velocidad
+        with self._lock:
+            self.chars_done += chars
+            self.chars_skipped += chars
+            self._sample_chars += chars
+
+    def audio_received(self, nbytes: int) -> None:
+        with self._lock:
+            self.audio_bytes += nbytes
+
+    def _update_rate(self) -> None:
+        ahora: float = time.monotonic()
+        transcurrido: float = ahora - self._sample_time
+        if transcurrido < _SAMPLE_SECONDS:
+            return
+        medida: float = (self.chars_done - self._sample_chars) / transcurrido
+        self._rate = medida if self._rate is None else _SMOOTHING * medida + (1 - _SMOOTHING) * self._rate
+        self._sample_time = ahora
+        self._sample_chars = self.chars_done
+
+    @property
+    def estimated_total_chars(self) -> int:
+        # Mientras se sigue leyendo el PDF, extrapolamos con la media de caracteres por página
+        with self._lock:
+            if self.pages_read == 0:
+                return 0
+            if self.total_pages <= self.pages_read:
+                return self.chars_read
+            return int(self.chars_read / self.pages_read * self.total_pages)
+
+    @property
+    def fraction(self) -> float:
+        total: int = self.estimated_total_chars
+        if total <= 0:
+            return 0.0
+        return min(1.0, self.chars_done / total)
+
+    @property
+    def chars_per_second(self) -> float:
+        with self._lock:
+            if self._rate is not None:
+                return self._rate
+            transcurrido: float = time.monotonic() - self.started
+            sintetizados: int = self.chars_done - self.chars_skipped
+            return sintetizados / transcurrido if transcurrido > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        velocidad: float = self.chars_per_second
+        if velocidad <= 0:
+            return None
+        return max(0.0, (self.estimated_total_chars - self.chars_done) / velocidad)
+
+    def describe(self) -> str:
+        # Texto corto para la barra de estado
+        partes = [f"{self.fraction * 100:.0f}%", f"{self.audio_bytes / (1024 * 1024):.1f} MB"]
+        velocidad: float = self.chars_per_second
+        if velocidad > 0:
+            partes.append(f"{velocidad:.0f} car/s")
+        eta: Optional[float] = self.eta_seconds
+        if eta is not None:
+            partes.append(f"quedan ~{format_duration(eta)}")
+        return " · ".join(partes)
+
+# Da formato legible a una duración en segundos (ej. "1 h 05 min", "42 s")
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} s"
+    minutos, segundos = divmod(seconds, 60)
+    if minutos < 60:
+        return f"{minutos} min {segundos:02d} s"
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas} h {minutos:02d} min"
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app.core import metrics
+from app.core.audio_cache import normalize_chunk_text
+from app.core.config_manager import ConfigManager
+from app.core.tts_engine import split_sentences, split_text
+
+logger = logging.getLogger(__name__)
+
+# Se sube si cambia el formato de las huellas; las viejas se ignoran
+FINGERPRINT_VERSION: int = 1
+
+def sentence_hash(sentence: str) -> str:
+    return hashlib.sha1(normalize_chunk_text(sentence).encode("utf-8")).hexdigest()[:16]
+
+def chunk_key(chunk: str) -> str:
+    return hashlib.sha256(normalize_chunk_text(chunk).encode("utf-8")).hexdigest()[:32]
+
+# Lo que se guarda de cada trozo: su clave y el hash de cada oración que lo forma
+def describe_chunk(chunk: str) -> Dict[str, Any]:
+    return {"key": chunk_key(chunk), "sentences": [sentence_hash(o) for o in split_sentences(chunk)]}
+
+# Huella de la última conversión hecha a un archivo de salida: cómo se partió el texto
+# (oración a oración) y dónde quedó el audio de cada trozo dentro del MP3.
+# Cuando llega una versión revisada del documento, el texto se vuelve a partir
+# alineado con los trozos anteriores: lo que no cambió sale en trozos idénticos, cuyo
+# audio se copia del MP3 anterior (o sale de la caché), y solo se sintetizan los
+# trozos que tocan oraciones nuevas o editadas.
+class DocumentFingerprint:
+    def __init__(self, path: Path, data: Dict[str, Any]) -> None:
+        self.path: Path = path
+        self.data: Dict[str, Any] = data
+        self._by_key: Dict[str, Tuple[int, int]] = {
+            chunk["key"]: tuple(chunk["audio"]) for chunk in data.get("chunks", []) if chunk.get("audio")
+        }
+        self._audio_ok: Optional[bool] = None
+
+    @staticmethod
+    def fingerprints_dir() -> Path:
+        return ConfigManager().config_dir / "fingerprints"
+
+    @classmethod
+    def path_for(cls, output_path: str) -> Path:
+        # La huella va con la salida: una revisión del PDF suele convertirse al mismo archivo
+        clave: str = hashlib.sha256(os.path.abspath(output_path).encode("utf-8")).hexdigest()[:24]
+        return cls.fingerprints_dir() / f"{clave}.json"
+
+    @classmethod
+    def load(cls, output_path: str) -> Optional["DocumentFingerprint"]:
+        path: Path = cls.path_for(output_path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data: Dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != FINGERPRINT_VERSION or not data.get("chunks"):
+            return None
+        return cls(path, data)
+
+    @classmethod
+    def save(cls, output_path: str, voice: str, rate: str, chunks: List[Dict[str, Any]],
+             ranges: List[Optional[Tuple[int, int]]]) -> None:
+        # chunks viene de describe_chunk y ranges de JobManifest.audio_ranges, en el mismo orden
+        st = os.stat(output_path)
+        data: Dict[str, Any] = {
+            "version": FINGERPRINT_VERSION,
+            "output": os.path.abspath(output_path),
+            "voice": voice,
+            "rate": rate,
+            # Para saber si el MP3 sigue siendo el que se generó
+            "output_size": st.st_size,
+            "output_mtime": st.st_mtime,
+            "updated": time.time(),
+            "chunks": [dict(chunk, audio=list(rango) if rango else None)
+                       for chunk, rango in zip(chunks, ranges)],
+        }
+        path: Path = cls.path_for(output_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp: Path = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _audio_usable(self, voice: str, rate: str) -> bool:
+        # Solo se copia audio del MP3 anterior si es de la misma voz y nadie lo ha tocado
+        if self._audio_ok is None:
+            try:
+                st = os.stat(self.data["output"])
+                self._audio_ok = (st.st_size == self.data.get("output_size")
+                                  and st.st_mtime == self.data.get("output_mtime"))
+            except OSError:
+                self._audio_ok = False
+        return self._audio_ok and self.data.get("voice") == voice and self.data.get("rate") == rate
+
+    def audio_for(self, chunk: str, voice: str, rate: str) -> Optional[bytes]:
+        # Audio del trozo en la conversión anterior, si el texto es el mismo
+        rango: Optional[Tuple[int, int]] = self._by_key.get(chunk_key(chunk))
+        if rango is None or not self._audio_usable(voice, rate):
+            return None
+        inicio, fin = rango
+        try:
+            with open(self.data["output"], "rb") as f:
+                f.seek(inicio)
+                audio: bytes = f.read(fin - inicio)
+        except OSError as e:
+            logger.warning("No se pudo leer el audio anterior: %s", e)
+            self._audio_ok = False
+            return None
+        # El primer trozo lleva delante la cabecera Xing; al unirlo se descarta sola
+        return audio if len(audio) == fin - inicio else None
+
+    def iter_chunks(self, parts: Iterable[str], max_chars: Union[int, Callable[[int], int]]) -> Iterator[str]:
+        # Como tts_engine.iter_text_chunks, pero en vez de llenar cada trozo hasta el límite
+        # se buscan primero los trozos de la versión anterior: si las oraciones que vienen
+        # forman uno entero, sale igual; si no, se hace un trozo nuevo que corta justo
+        # antes de donde empieza el siguiente trozo anterior, para volver a coincidir.
+        limite_de: Callable[[int], int] = max_chars if callable(max_chars) else (lambda indice: max_chars)
+
+        # hash de la primera oración -> oraciones de los trozos anteriores que empiezan por ella
+        inicios: Dict[str, List[List[str]]] = {}
+        for chunk in self.data["chunks"]:
+            if chunk["sentences"]:
+                inicios.setdefault(chunk["sentences"][0], []).append(chunk["sentences"])
+
+        frases: List[str] = []
+        hashes: List[str] = []
+        indice: int = 0
+
+        def coincide(pos: int, final: bool) -> Optional[int]:
+            # Cuántas oraciones desde pos forman un trozo anterior completo: 0 si ninguno,
+            # None si aún no hay oraciones suficientes para saberlo
+            falta: bool = False
+            for oraciones in inicios.get(hashes[pos], ()):
+                vistas: List[str] = hashes[pos:pos + len(oraciones)]
+                if vistas != oraciones[:len(vistas)]:
+                    continue
+                if len(vistas) == len(oraciones):
+                    return len(oraciones)
+                falta = not final
+            return None if falta else 0
+
+        def sacar(n: int) -> str:
+            nonlocal indice
+            chunk: str = " ".join(frases[:n])
+            del frases[:n]
+            del hashes[:n]
+            indice += 1
+            return chunk
+
+        def repartir(final: bool) -> Iterator[str]:
+            while frases:
+                n: Optional[int] = coincide(0, final)
+                if n is None:
+                    return
+                if n:
+                    metrics.incr("chunks_aligned")
+                    yield sacar(n)
+                    continue
+
+                limite: int = max(1, limite_de(indice))
+                if len(frases[0]) > limite:
+                    # Oración gigante: se parte por palabras como en split_text
+                    piezas: List[str] = split_text(frases[0], limite)
+                    frases[0] = piezas[0]
+                    if len(piezas) > 1:
+                        frases.insert(1, " ".join(piezas[1:]))
+                        hashes.insert(1, sentence_hash(frases[1]))
+                    yield sacar(1)
+                    continue
+
+                # Trozo nuevo: oraciones enteras hasta el límite o hasta donde empieza un trozo anterior
+                largo: int = len(frases[0])
+                n = 1
+                while True:
+                    if n == len(frases):
+                        if not final:
+                            return  # falta texto para saber dónde cortar
+                        break
+                    if largo + 1 + len(frases[n]) > limite:
+                        break
+                    siguiente: Optional[int] = coincide(n, final)
+                    if siguiente is None:
+                        return
+                    if siguiente:
+                        break
+                    largo += 1 + len(frases[n])
+                    n += 1
+                yield sacar(n)
+
+        # La última oración de cada página puede seguir en la siguiente, así que se guarda aparte
+        resto: str = ""
+        for parte in parts:
+            if not parte:
+                continue
+            oraciones: List[str] = split_sentences(f"{resto} {parte}" if resto else parte)
+            resto = oraciones.pop() if oraciones else ""
+            frases.extend(oraciones)
+            hashes.extend(sentence_hash(o) for o in oraciones)
+            yield from repartir(final=False)
+        if resto:
+            frases.append(resto)
+            hashes.append(sentence_hash(resto))
+        yield from repartir(final=True)
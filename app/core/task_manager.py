@@ -1,62 +1,329 @@
-from PySide6.QtCore import QThread, Signal
-from app.core.pdf_reader import extract_text_from_pdf
-from app.core.text_cleaner import clean_text
-from app.core.tts_engine import TTSEngine
-import os
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from PySide6.QtCore import QObject, QThread, Signal
+from app.core.converter import ConversionJob
+from app.core.preview import VoicePreview
+from app.core.estimator import estimate_job, plan_concurrency
+from app.core.config_manager import ConfigManager
+from app.core.voice_catalog import VoiceCatalog
+from app.core.update_download import download_latest
+from app import __version__
+
+logger = logging.getLogger(__name__)
+
+# Documentos que se convierten a la vez si se fija max_parallel_jobs sin valor. Sin esa
+# clave se decide con el historial (ver estimator.plan_concurrency). Las conexiones TTS
+# y el trabajo de CPU tienen además sus propios límites globales (ver limits.py).
+DEFAULT_MAX_PARALLEL_JOBS: int = 2
 
 # Este es el trabajador que hace las tareas pesadas en segundo plano
-# para que la ventana no se congele.
+# para que la ventana no se congele. La conversión en sí está en converter.ConversionJob.
 class ConversionWorker(QThread):
     # Definimos las señales para comunicarnos con la ventana principal
     update_progress = Signal(int) # Para la barra de progreso
     update_status = Signal(str)   # Para el texto de estado
     finished_task = Signal(bool, str) # Cuando termina (éxito/fracaso, mensaje)
+    cancelled_task = Signal()     # Cuando el usuario cancela la conversión
     
-    def __init__(self, pdf_path, voice, speed, output_path):
+    def __init__(self, pdf_path, voice, speed, output_path, pages=None, concurrency=None):
         super().__init__()
         self.pdf_path = pdf_path
         self.voice = voice
         self.speed = speed
         self.output_path = output_path
-        self._is_running = True
+        self.job = ConversionJob(pdf_path, voice, speed, output_path,
+                                 on_progress=self.update_progress.emit,
+                                 on_status=self.update_status.emit,
+                                 pages=pages, concurrency=concurrency)
+
+    def run(self):
+        success, message = self.job.run()
+        if self.job.cancelled:
+            self.cancelled_task.emit()
+        else:
+            self.finished_task.emit(success, message)
+
+    def stop(self):
+        self.job.cancel()
+
+# Datos de un trabajo en la cola del planificador
+class ScheduledJob:
+    def __init__(self, job_id, pdf_path, voice, speed, output_path, priority, pages=None):
+        self.job_id = job_id
+        self.pdf_path = pdf_path
+        self.voice = voice
+        self.speed = speed
+        self.output_path = output_path
+        self.priority = priority
+        self.pages = pages # (inicio, fin) si es un capítulo
+        self.state = "queued" # queued, running, paused, done, failed, cancelled
+        self.worker = None # hasta que su hilo termina del todo (QThread.finished)
+        self.resume_requested = False
+        self.queued_at = time.monotonic()
+
+# Planificador de conversiones: acepta muchos trabajos con prioridad, los arranca
+# respetando un máximo de documentos a la vez y permite pausar y reanudar.
+# Pausar un trabajo en marcha lo detiene; al reanudarlo vuelve a la cola y
+# continúa desde su manifiesto, así que no se pierde lo ya sintetizado.
+class JobScheduler(QObject):
+    job_progress = Signal(str, int)        # (id, porcentaje)
+    job_status = Signal(str, str)          # (id, texto)
+    job_finished = Signal(str, bool, str)  # (id, éxito, mensaje)
+    job_cancelled = Signal(str)
+    queue_changed = Signal()
+
+    def __init__(self, max_parallel_jobs=None, parent=None):
+        super().__init__(parent)
+        configurado = ConfigManager().get("max_parallel_jobs")
+        # Sin valor fijo, los documentos a la vez y las peticiones de cada uno salen de
+        # cómo respondió el servicio en las conversiones anteriores
+        self.auto_parallel = max_parallel_jobs is None and configurado is None
+        if max_parallel_jobs is None:
+            max_parallel_jobs = int(configurado or DEFAULT_MAX_PARALLEL_JOBS)
+        self.max_parallel_jobs = max(1, max_parallel_jobs)
+        self.job_concurrency = None # None = lo decide cada trabajo
+        if self.auto_parallel:
+            self._plan()
+        self.jobs = {}
+        self._queue = [] # heap de (-prioridad, orden de llegada, id)
+        self._counter = itertools.count()
+
+    def submit(self, pdf_path, voice, speed, output_path, priority=0, pages=None):
+        job_id = f"job-{next(self._counter)}"
+        self.jobs[job_id] = ScheduledJob(job_id, pdf_path, voice, speed, output_path, priority, pages)
+        self._enqueue(job_id)
+        self._dispatch()
+        return job_id
+
+    def _enqueue(self, job_id):
+        job = self.jobs[job_id]
+        job.state = "queued"
+        job.queued_at = time.monotonic()
+        logger.info("Trabajo %s en cola (prioridad %s)", job_id, job.priority,
+                    extra={"event": "job_queued", "job": job_id, "priority": job.priority})
+        heapq.heappush(self._queue, (-job.priority, next(self._counter), job_id))
+        self.queue_changed.emit()
+
+    def set_priority(self, job_id, priority):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.priority = priority
+        if job.state == "queued":
+            # Volvemos a meterlo con la prioridad nueva; la entrada vieja se ignora al sacarla
+            self._enqueue(job_id)
+            self._dispatch()
+
+    def pause(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        if job.state == "queued":
+            job.state = "paused"
+            self.queue_changed.emit()
+        elif job.state == "running":
+            job.state = "paused"
+            job.worker.stop()
+
+    def resume(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != "paused":
+            return
+        if job.worker is not None:
+            # Todavía se está deteniendo: se vuelve a encolar cuando termine de parar
+            job.resume_requested = True
+            return
+        self._enqueue(job_id)
+        self._dispatch()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        if job.state == "running":
+            job.state = "cancelled"
+            job.worker.stop()
+        elif job.state in ("queued", "paused"):
+            job.state = "cancelled"
+            self.job_cancelled.emit(job_id)
+            self.queue_changed.emit()
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def running_count(self):
+        # Cuenta también los que se están deteniendo: su hilo sigue vivo
+        return sum(1 for job in self.jobs.values() if job.worker is not None)
+
+    def pending_count(self):
+        return sum(1 for job in self.jobs.values() if job.state in ("queued", "paused"))
+
+    def is_busy(self):
+        return self.running_count() > 0 or any(job.state == "queued" for job in self.jobs.values())
+
+    def _plan(self):
+        self.max_parallel_jobs, self.job_concurrency = plan_concurrency()
+        logger.debug("Planificador: %d documentos a la vez, %d peticiones cada uno",
+                     self.max_parallel_jobs, self.job_concurrency,
+                     extra={"event": "scheduler_plan", "jobs": self.max_parallel_jobs,
+                            "concurrency": self.job_concurrency})
+
+    def _dispatch(self):
+        while self._queue and self.running_count() < self.max_parallel_jobs:
+            prioridad, _, job_id = heapq.heappop(self._queue)
+            job = self.jobs[job_id]
+            # Entradas viejas (trabajo pausado, cancelado o con otra prioridad)
+            if job.state != "queued" or -prioridad != job.priority:
+                continue
+            self._start(job)
+
+    def _start(self, job):
+        job.state = "running"
+        espera = time.monotonic() - job.queued_at
+        logger.info("Trabajo %s arranca tras %.1fs en cola", job.job_id, espera,
+                    extra={"event": "job_started", "job": job.job_id, "queue_seconds": espera})
+        worker = ConversionWorker(job.pdf_path, job.voice, job.speed, job.output_path, job.pages,
+                                  concurrency=self.job_concurrency)
+        job.worker = worker
+        worker.update_progress.connect(lambda value, i=job.job_id: self.job_progress.emit(i, value))
+        worker.update_status.connect(lambda text, i=job.job_id: self.job_status.emit(i, text))
+        worker.finished_task.connect(lambda ok, msg, i=job.job_id: self._on_finished(i, ok, msg))
+        worker.cancelled_task.connect(lambda i=job.job_id: self._on_stopped(i))
+        worker.finished.connect(lambda i=job.job_id, w=worker: self._on_thread_done(i, w))
+        worker.start()
+        self.queue_changed.emit()
+
+    # Estas dos llegan desde dentro de run(): el hilo sigue vivo, así que el trabajador
+    # no se suelta aquí sino en _on_thread_done
+    def _on_finished(self, job_id, success, message):
+        job = self.jobs[job_id]
+        job.state = "done" if success else "failed"
+        logger.info("Trabajo %s terminado: %s", job_id, job.state,
+                    extra={"event": "job_finished", "job": job_id, "state": job.state})
+        self.job_finished.emit(job_id, success, message)
+        self.queue_changed.emit()
+
+    def _on_stopped(self, job_id):
+        job = self.jobs[job_id]
+        logger.info("Trabajo %s detenido (%s)", job_id, job.state,
+                    extra={"event": "job_stopped", "job": job_id, "state": job.state})
+        if job.state == "paused":
+            if not job.resume_requested:
+                self.job_status.emit(job_id, "En pausa")
+        else:
+            job.state = "cancelled"
+            self.job_cancelled.emit(job_id)
+        self.queue_changed.emit()
+
+    def _on_thread_done(self, job_id, worker):
+        # QThread.finished sale justo antes de que el hilo acabe: wait() espera ese último
+        # tramo para que soltar la última referencia no destruya un hilo aún en marcha
+        worker.wait()
+        job = self.jobs[job_id]
+        if job.worker is worker:
+            job.worker = None
+        if self.auto_parallel:
+            # El historial solo cambia cuando termina un trabajo: es el único momento en que
+            # vale la pena volver a consultarlo (y no en cada _dispatch, que va en el hilo de la ventana)
+            self._plan()
+        if job.state == "paused" and job.resume_requested:
+            job.resume_requested = False
+            self._enqueue(job_id)
+        self.queue_changed.emit()
+        self._dispatch()
+
+# Descarga la lista de voces en segundo plano para no bloquear el arranque de la ventana
+class VoiceRefreshWorker(QThread):
+    voices_loaded = Signal(list)
+
+    def run(self):
+        voices = VoiceCatalog().refresh()
+        if voices:
+            self.voices_loaded.emit(voices)
+
+# Estima lo que costará convertir un PDF (ver estimator) sin bloquear la ventana
+class EstimateWorker(QThread):
+    estimated = Signal(object) # JobEstimate, o None si no se pudo estimar
+
+    def __init__(self, pdf_path, voice, speed, pages=None):
+        super().__init__()
+        self.pdf_path = pdf_path
+        self.voice = voice
+        self.speed = speed
+        self.pages = pages
 
     def run(self):
         try:
-            self.update_progress.emit(10)
-            self.update_status.emit("Leyendo PDF...")
-            
-            # Paso 1: Leer el PDF
-            raw_text = extract_text_from_pdf(self.pdf_path)
-            if not raw_text:
-                self.finished_task.emit(False, "No se pudo leer el texto del PDF.")
-                return
-
-            if not self._is_running: return
-
-            self.update_progress.emit(30)
-            self.update_status.emit("Limpiando texto...")
-            
-            # Paso 2: Limpiar texto
-            clean_txt = clean_text(raw_text)
-            
-            if not self._is_running: return
-            
-            self.update_progress.emit(50)
-            self.update_status.emit("Generando audio (esto puede tardar)...")
-            
-            # Paso 3: Convertir a audio
-            tts = TTSEngine()
-            success = tts.generate_audio(clean_txt, self.output_path, self.voice, self.speed)
-            
-            if success:
-                self.update_progress.emit(100)
-                self.update_status.emit("¡Completado!")
-                self.finished_task.emit(True, f"Audio guardado en: {self.output_path}")
-            else:
-                self.finished_task.emit(False, "Error al generar el audio, revisa tu conexión a internet.")
-                
+            estimacion = estimate_job(self.pdf_path, self.voice, self.speed, self.pages)
         except Exception as e:
-            self.finished_task.emit(False, f"Ocurrió un error inesperado: {str(e)}")
+            logger.warning("No se pudo estimar la conversión: %s", e)
+            estimacion = None
+        self.estimated.emit(estimacion)
+
+# Vista previa de una voz en segundo plano. El audio va directo a on_data (desde este
+# hilo, según llega del servicio); la ventana solo recibe los avisos.
+class PreviewWorker(QThread):
+    first_audio = Signal(float)          # segundos hasta el primer audio
+    finished_preview = Signal(bool, str) # (éxito, mensaje)
+
+    def __init__(self, pdf_path, voice, speed, on_data, pages=None):
+        super().__init__()
+        self.on_data = on_data
+        self.preview = VoicePreview(pdf_path, voice, speed, self._receive, pages=pages)
+        self._started = False
+
+    def _receive(self, data):
+        self.on_data(data)
+        if not self._started:
+            self._started = True
+            self.first_audio.emit(self.preview.time_to_first_audio)
+
+    def run(self):
+        success, message = self.preview.run()
+        self.finished_preview.emit(success, message)
 
     def stop(self):
+        self.preview.cancel()
+
+# Descarga de la actualización en segundo plano: baja el ZIP de la release por partes,
+# comprueba el sha256 y lo deja preparado para instalarse al reiniciar
+class UpdateDownloadWorker(QThread):
+    update_progress = Signal(int)            # porcentaje
+    finished_download = Signal(bool, str)    # (preparada, mensaje)
+
+    def __init__(self):
+        super().__init__()
+        self._downloader = None
+        self._is_running = True
+
+    def _attach(self, downloader):
+        self._downloader = downloader
+        if not self._is_running:
+            downloader.cancel()
+
+    def _progress(self, done, total):
+        self.update_progress.emit(int(done * 100 / total) if total else 0)
+
+    def run(self):
+        try:
+            info, preparada = asyncio.run(download_latest(__version__, on_progress=self._progress,
+                                                          downloader=self._attach))
+        except Exception as e:
+            logger.warning("No se pudo descargar la actualización: %s", e)
+            self.finished_download.emit(False, f"No se pudo descargar la actualización: {e}")
+            return
+        if preparada is None:
+            mensaje = "Descarga detenida" if not self._is_running else "Ya tienes la última versión"
+            self.finished_download.emit(False, mensaje)
+            return
+        self.finished_download.emit(True, f"La versión {info.version} se instalará al reiniciar Narralib.")
+
+    def cancel(self):
+        # Lo descargado se conserva y la próxima vez se sigue desde ahí
         self._is_running = False
+        if self._downloader is not None:
+            self._downloader.cancel()
@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from app.core import metrics
+from app.core.config_manager import ConfigManager
+from app.core.job_manifest import file_sha256
+
+# Tamaño máximo por defecto de la caché de texto (en MB, ya comprimido)
+DEFAULT_TEXT_CACHE_MB: int = 256
+# Se sube si cambia lo que se guarda; lo anterior deja de usarse
+TEXT_CACHE_VERSION: str = "1"
+
+# Caché en disco del texto extraído de cada página de los PDF, para que volver a abrir
+# o convertir un libro no tenga que pasar otra vez por fitz.
+# Cada documento se identifica por el sha256 de su contenido más la versión del
+# extractor; para no calcular el hash cada vez, se recuerda el de cada ruta junto con
+# su tamaño y fecha de modificación. Las páginas van comprimidas en una base SQLite
+# (miles de textos pequeños ocupan mucho menos así que en archivos sueltos) y, al
+# pasar del límite, se borran los documentos usados hace más tiempo.
+class TextCache:
+    def __init__(self, extractor_version: str, path: Optional[Path] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        config: ConfigManager = ConfigManager()
+        self.path: Path = Path(path) if path else config.config_dir / "cache" / "text.sqlite3"
+        if max_bytes is None:
+            max_bytes = int(config.get("text_cache_max_mb", DEFAULT_TEXT_CACHE_MB)) * 1024 * 1024
+        self.max_bytes: int = max_bytes
+        self.version: str = f"{TEXT_CACHE_VERSION}-{extractor_version}"
+        self._lock: threading.Lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT);
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc TEXT PRIMARY KEY, page_count INTEGER, outline TEXT,
+                    bytes INTEGER NOT NULL DEFAULT 0, used REAL);
+                CREATE TABLE IF NOT EXISTS pages (
+                    doc TEXT, page INTEGER, text BLOB, PRIMARY KEY (doc, page));
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Una conexión por operación: la usan hilos y procesos distintos a la vez
+        db: sqlite3.Connection = sqlite3.connect(str(self.path), timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def document_key(self, pdf_path: str) -> Optional[str]:
+        # Identificador del contenido del PDF. Si la ruta tiene el mismo tamaño y fecha
+        # que la última vez, se reutiliza el hash sin volver a leer el archivo.
+        # None si no se puede usar la caché para este archivo.
+        try:
+            return self._document_key(os.path.abspath(pdf_path))
+        except (OSError, sqlite3.Error) as e:
+            metrics.record_error("text_cache", e, "Error al consultar la caché de texto")
+            return None
+
+    def _document_key(self, ruta: str) -> str:
+        st = os.stat(ruta)
+        with self._lock, self._connect() as db:
+            fila = db.execute("SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (ruta,)).fetchone()
+            if fila and fila[0] == st.st_size and fila[1] == st.st_mtime_ns:
+                sha: str = fila[2]
+            else:
+                sha = file_sha256(ruta)
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                           (ruta, st.st_size, st.st_mtime_ns, sha))
+            doc: str = f"{sha}:{self.version}"
+            db.execute("INSERT OR IGNORE INTO documents (doc, used) VALUES (?, ?)", (doc, time.time()))
+            db.execute("UPDATE documents SET used = ? WHERE doc = ?", (time.time(), doc))
+        return doc
+
+    def get_info(self, doc: str) -> Dict[str, Any]:
+        # Número de páginas e índice del documento, si ya se leyeron alguna vez
+        try:
+            with self._connect() as db:
+                fila = db.execute("SELECT page_count, outline FROM documents WHERE doc = ?", (doc,)).fetchone()
+        except sqlite3.Error as e:
+            metrics.record_error("text_cache", e, "Error al consultar la caché de texto")
+            return {}
+        if not fila:
+            return {}
+        info: Dict[str, Any] = {}
+        if fila[0] is not None:
+            info["page_count"] = fila[0]
+        if fila[1] is not None:
+            info["outline"] = json.loads(fila[1])
+        return info
+
+    def put_info(self, doc: str, page_count: Optional[int] = None, outline: Optional[List[Any]] = None) -> None:
+        try:
+            with self._connect() as db:
+                if page_count is not None:
+                    db.execute("UPDATE documents SET page_count = ? WHERE doc = ?", (page_count, doc))
+                if outline is not None:
+                    db.execute("UPDATE documents SET outline = ? WHERE doc = ?", (json.dumps(outline), doc))
+        except sqlite3.Error as e:
+            metrics.record_error("text_cache", e, "Error al guardar en la caché de texto")
+
+    def cached_pages(self, doc: str, inicio: int, fin: int) -> Set[int]:
+        # Qué páginas de [inicio, fin) están guardadas, sin leer su texto
+        try:
+            with self._connect() as db:
+                filas = db.execute("SELECT page FROM pages WHERE doc = ? AND page >= ? AND page < ?",
+                                   (doc, inicio, fin)).fetchall()
+        except sqlite3.Error as e:
+            metrics.record_error("text_cache", e, "Error al consultar la caché de texto")
+            return set()
+        return {pagina for (pagina,) in filas}
+
+    def get_pages(self, doc: str, inicio: int, fin: int) -> Dict[int, str]:
+        # Páginas guardadas dentro de [inicio, fin), por número
+        try:
+            with self._connect() as db:
+                filas = db.execute("SELECT page, text FROM pages WHERE doc = ? AND page >= ? AND page < ?",
+                                   (doc, inicio, fin)).fetchall()
+        except sqlite3.Error as e:
+            metrics.record_error("text_cache", e, "Error al consultar la caché de texto")
+            return {}
+        paginas: Dict[int, str] = {pagina: zlib.decompress(texto).decode("utf-8") for pagina, texto in filas}
+        metrics.incr("text_cache_hits", len(paginas))
+        return paginas
+
+    def put_pages(self, doc: str, paginas: Dict[int, str]) -> None:
+        if not paginas:
+            return
+        filas = [(doc, pagina, zlib.compress(texto.encode("utf-8"))) for pagina, texto in paginas.items()]
+        try:
+            with self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", filas)
+                db.execute("UPDATE documents SET bytes = (SELECT COALESCE(SUM(LENGTH(text)), 0) "
+                           "FROM pages WHERE doc = ?) WHERE doc = ?", (doc, doc))
+                total: int = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM documents").fetchone()[0]
+                if total > self.max_bytes:
+                    self._evict(db, total, doc)
+        except sqlite3.Error as e:
+            metrics.record_error("text_cache", e, "Error al guardar en la caché de texto")
+            return
+        metrics.incr("text_cache_stored", len(filas))
+
+    def _evict(self, db: sqlite3.Connection, total: int, keep: str) -> None:
+        # Borra documentos enteros, del usado hace más tiempo al más reciente
+        for doc, nbytes in db.execute("SELECT doc, bytes FROM documents WHERE doc != ? ORDER BY used",
+                                      (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._delete(db, doc)
+            total -= nbytes
+
+    @staticmethod
+    def _delete(db: sqlite3.Connection, doc: str) -> None:
+        db.execute("DELETE FROM pages WHERE doc = ?", (doc,))
+        db.execute("DELETE FROM documents WHERE doc = ?", (doc,))
+
+    def invalidate(self, pdf_path: str) -> None:
+        # Olvida el texto guardado de un PDF (p. ej. para forzar que se vuelva a leer)
+        ruta: str = os.path.abspath(pdf_path)
+        with self._lock, self._connect() as db:
+            fila = db.execute("SELECT sha256 FROM files WHERE path = ?", (ruta,)).fetchone()
+            db.execute("DELETE FROM files WHERE path = ?", (ruta,))
+            if fila:
+                for (doc,) in db.execute("SELECT doc FROM documents WHERE doc LIKE ?", (fila[0] + ":%",)).fetchall():
+                    self._delete(db, doc)
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as db:
+            db.executescript("DELETE FROM pages; DELETE FROM documents; DELETE FROM files;")
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as db:
+            documentos, nbytes = db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM documents").fetchone()
+            paginas: int = db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {"documents": documentos, "pages": paginas, "bytes": nbytes, "max_bytes": self.max_bytes}
@@ -1,4 +1,33 @@
+import math
 import re
+from collections import Counter, deque
+
+from app.core import metrics
+
+# Líneas de arriba y de abajo de cada página donde buscamos encabezados y pies
+EDGE_LINES: int = 3
+# Páginas que se miran alrededor de cada una para decidir qué se repite
+BOILERPLATE_WINDOW: int = 12
+# Una línea se considera encabezado/pie si aparece al menos en estas páginas...
+BOILERPLATE_MIN_PAGES: int = 3
+# ...y en esta fracción de la ventana (bajo porque muchos libros alternan encabezado par/impar)
+BOILERPLATE_RATIO: float = 0.35
+# Los encabezados son cortos; una línea más larga es texto aunque se repita
+BOILERPLATE_MAX_CHARS: int = 120
+
+# "12", "- 12 -", "Página 12", "p. 12", "12 de 300", "Page 12 of 300", "xiv".
+# Solo romanos bien formados y por debajo de 400 (los de las primeras páginas):
+# así "did", "mix", "civil" o "vivid" no parecen números de página.
+_PAGE_NUMBER = re.compile(
+    r'^(?:p[aá]g(?:ina)?\.?|page|p\.)?\s*[-–—]?\s*'
+    r'(?:(?P<arabic>\d{1,4})|(?P<roman>(?-i:(?=[ivxlc])c{0,3}(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3}))))'
+    r'\s*[-–—]?(?:\s*(?:de|of|/)\s*\d{1,4})?$',
+    re.IGNORECASE,
+)
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100}
+# Palabra cortada con guion al final de una línea
+_HYPHEN_BREAK = re.compile(r'([^\W\d_])-\n([^\W\d_])')
+_TRAILING_FRAGMENT = re.compile(r'(\S*[^\W\d_])-$')
 
 # Esta función limpia el texto para quitar cosas que no nos sirven, como espacios extra o caracteres raros.
 def clean_text(texto):
@@ -12,7 +41,138 @@ def clean_text(texto):
     # \s+ significa "uno o más espacios en blanco (incluyendo enter)"
     texto = re.sub(r'\s+', ' ', texto)
     
-    # Aquí podríamos quitar números de página o encabezados si tuviéramos un patrón claro,
-    # pero por ahora haremos una limpieza básica.
-    
+    # Los encabezados, pies y números de página los quita strip_boilerplate,
+    # que necesita ver varias páginas; aquí solo hacemos la limpieza básica.
+
     return texto
+
+def _line_key(linea):
+    # Los números cambian de una página a otra ("Capítulo 3 · 45"), así que no cuentan
+    return re.sub(r'\s+', ' ', re.sub(r'\d+', '#', linea.lower())).strip()
+
+def _roman_to_int(numero):
+    total = 0
+    for actual, siguiente in zip(numero, numero[1:] + " "):
+        valor = _ROMAN_VALUES[actual]
+        total += -valor if valor < _ROMAN_VALUES.get(siguiente, 0) else valor
+    return total
+
+# Valor del número de página que hay en la línea, o None si no lo parece
+def _page_number(linea):
+    m = _PAGE_NUMBER.match(linea.strip())
+    if not m:
+        return None
+    return int(m.group("arabic")) if m.group("arabic") else _roman_to_int(m.group("roman"))
+
+def _edge_numbers(lineas):
+    # Números de página candidatos en los bordes de una página
+    bordes = lineas[:EDGE_LINES] + lineas[-EDGE_LINES:]
+    return {n for n in map(_page_number, bordes) if n is not None}
+
+def _edge_keys(lineas):
+    # Claves (zona, texto) de las líneas de arriba y de abajo; cada una cuenta una vez por página
+    claves = {("top", _line_key(l)) for l in lineas[:EDGE_LINES]}
+    claves |= {("bottom", _line_key(l)) for l in lineas[-EDGE_LINES:]}
+    return claves
+
+# numeros: candidatos de cada página de la ventana; posicion: la de esta página en ella
+def _strip_page(lineas, indice, numeros, posicion):
+    minimo = max(BOILERPLATE_MIN_PAGES, math.ceil(BOILERPLATE_RATIO * len(numeros)))
+
+    def numerada(valor):
+        # Un número suelto puede ser un año o una cifra que cierra un párrafo: solo es
+        # número de página si otra página de la ventana sigue la misma cuenta
+        return any(valor + otra - posicion in candidatos
+                   for otra, candidatos in enumerate(numeros) if otra != posicion)
+
+    def sobra(linea, zona):
+        valor = _page_number(linea)
+        if valor is not None:
+            # Su clave ("#") coincide con la de los números de página: que se repita no basta
+            return numerada(valor)
+        return len(linea) <= BOILERPLATE_MAX_CHARS and indice[(zona, _line_key(linea))] >= minimo
+
+    # Solo quitamos desde los bordes hacia dentro: una línea repetida en medio del texto se queda
+    inicio, fin = 0, len(lineas)
+    while inicio < min(EDGE_LINES, fin) and sobra(lineas[inicio], "top"):
+        inicio += 1
+    while fin > max(inicio, len(lineas) - EDGE_LINES) and sobra(lineas[fin - 1], "bottom"):
+        fin -= 1
+    return lineas[inicio:fin]
+
+# Quita encabezados, pies y números de página. Lleva un índice de cuántas páginas
+# tienen cada línea en sus bordes dentro de una ventana alrededor de la página actual,
+# así funciona en streaming: solo adelanta BOILERPLATE_WINDOW / 2 páginas.
+def strip_boilerplate(paginas, window=BOILERPLATE_WINDOW):
+    mitad = max(1, window // 2)
+    indice = Counter()
+    ventana = deque()
+    numeros = deque()  # candidatos a número de página de cada página de la ventana
+    emitidas = 0  # páginas de la ventana ya devueltas
+
+    def devolver(posicion):
+        lineas = ventana[posicion]
+        limpias = _strip_page(lineas, indice, numeros, posicion)
+        quitados = sum(len(l) for l in lineas) - sum(len(l) for l in limpias)
+        if quitados:
+            metrics.incr("chars_stripped", quitados)
+        return "\n".join(limpias)
+
+    for pagina in paginas:
+        lineas = [l.strip() for l in (pagina or "").splitlines() if l.strip()]
+        ventana.append(lineas)
+        numeros.append(_edge_numbers(lineas))
+        indice.update(_edge_keys(lineas))
+        # Cada página sale cuando ya tiene delante la mitad de la ventana
+        while len(ventana) - emitidas > mitad:
+            yield devolver(emitidas)
+            emitidas += 1
+            if emitidas > mitad:
+                numeros.popleft()
+                indice.subtract(_edge_keys(ventana.popleft()))
+                emitidas -= 1
+
+    while emitidas < len(ventana):
+        yield devolver(emitidas)
+        emitidas += 1
+
+# Une las palabras cortadas con guion al final de línea ("conver-\nsión" -> "conversión").
+# Si lo que sigue empieza en mayúscula es un guion de verdad ("anti-\nFranco") y solo se quita el salto.
+def rejoin_hyphenation(texto):
+    def unir(m):
+        return m.group(1) + m.group(2) if m.group(2).islower() else m.group(1) + "-" + m.group(2)
+    return _HYPHEN_BREAK.sub(unir, texto)
+
+# Lo mismo, pero entre páginas: el trozo de palabra del final de una página
+# se pasa al principio de la siguiente.
+def _rejoin_across_pages(paginas):
+    pendiente = ""
+    for pagina in paginas:
+        pagina = rejoin_hyphenation(pagina)
+        if pendiente:
+            if pagina[:1].islower():
+                pagina = pendiente + pagina
+            else:
+                pagina = pendiente + "- " + pagina
+            pendiente = ""
+        m = _TRAILING_FRAGMENT.search(pagina)
+        if m:
+            pendiente = m.group(1)
+            pagina = pagina[:m.start()]
+        yield pagina
+    if pendiente:
+        yield pendiente + "-"
+
+# Versión por partes de clean_text: limpia cada página según llega.
+# Con strip_headers quita antes encabezados, pies y números de página, y une las
+# palabras partidas con guion; sin él, unir lo que devuelve con espacios da lo mismo
+# que clean_text sobre el texto completo.
+def clean_text_stream(paginas, strip_headers=True):
+    if strip_headers:
+        paginas = _rejoin_across_pages(strip_boilerplate(paginas))
+    for pagina in paginas:
+        with metrics.span("clean"):
+            limpio = clean_text(pagina)
+        metrics.incr("chars_cleaned", len(limpio))
+        if limpio:
+            yield limpio
@@ -1,22 +1,234 @@
 import edge_tts
 import asyncio
+import logging
+import random
+import re
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from app.core import metrics
+from app.core.limits import AdaptiveConcurrency
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Tamaño objetivo (en caracteres) de cada trozo de texto que se manda al servicio
+DEFAULT_CHUNK_CHARS: int = 2000
+# Número de peticiones de síntesis que pueden estar en vuelo a la vez
+DEFAULT_CONCURRENCY: int = 4
+# Tope al que puede subir el control de concurrencia si el servicio responde bien
+DEFAULT_MAX_CONCURRENCY: int = 16
+# Trozos de texto que el productor puede adelantar antes de esperar a la síntesis
+DEFAULT_QUEUE_SIZE: int = 16
+# Reintentos por trozo antes de dar la conversión por fallida
+DEFAULT_RETRIES: int = 4
+# Espera base y máxima entre reintentos (se dobla en cada intento, con azar)
+RETRY_BASE_SECONDS: float = 1.0
+RETRY_MAX_SECONDS: float = 30.0
+
+# Separa el texto en oraciones: corta después de . ! ? … seguido de espacio
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+# Separa el texto en oraciones (sin las vacías)
+def split_sentences(text: str) -> List[str]:
+    return [oracion for oracion in _SENTENCE_END.split(text.strip()) if oracion]
+
+# Divide el texto en trozos que terminan en final de oración y no pasan de max_chars.
+# Si una oración sola es más larga que el límite, se corta por espacios.
+def split_text(text: str, max_chars: int = DEFAULT_CHUNK_CHARS) -> List[str]:
+    chunks: List[str] = []
+    actual: str = ""
+
+    for oracion in split_sentences(text):
+        # Oraciones gigantes (tablas, listas sin puntos...) se parten por palabras
+        while len(oracion) > max_chars:
+            corte: int = oracion.rfind(" ", 0, max_chars)
+            if corte <= 0:
+                corte = max_chars
+            if actual:
+                chunks.append(actual)
+                actual = ""
+            chunks.append(oracion[:corte].strip())
+            oracion = oracion[corte:].strip()
+
+        if not actual:
+            actual = oracion
+        elif len(actual) + 1 + len(oracion) <= max_chars:
+            actual += " " + oracion
+        else:
+            chunks.append(actual)
+            actual = oracion
+
+    if actual:
+        chunks.append(actual)
+    return chunks
+
+# Versión incremental de split_text: recibe el texto por partes (por ejemplo página a página)
+# y va entregando trozos completos en cuanto los tiene. El resultado es el mismo que
+# split_text(" ".join(partes)), pero sin tener nunca el libro entero en memoria.
+# max_chars puede ser una función que recibe el índice del trozo y devuelve su límite,
+# para poder cambiar el tamaño a mitad de camino (ver chunk_tuner.ChunkTuner).
+def iter_text_chunks(parts: Iterable[str], max_chars: Union[int, Callable[[int], int]] = DEFAULT_CHUNK_CHARS) -> Iterator[str]:
+    if callable(max_chars):
+        yield from _iter_text_chunks_variable(parts, max_chars)
+        return
+
+    pendiente: str = ""
+    for parte in parts:
+        if not parte:
+            continue
+        pendiente = f"{pendiente} {parte}" if pendiente else parte
+        if len(pendiente) <= max_chars:
+            continue
+
+        # El último trozo puede acabar en una oración cortada por el salto de página,
+        # así que lo guardamos hasta recibir más texto
+        chunks: List[str] = split_text(pendiente, max_chars)
+        for chunk in chunks[:-1]:
+            yield chunk
+        pendiente = chunks[-1] if chunks else ""
+
+    if pendiente:
+        yield from split_text(pendiente, max_chars)
+
+def _iter_text_chunks_variable(parts: Iterable[str], limit_for: Callable[[int], int]) -> Iterator[str]:
+    # Igual, pero se corta de a un trozo para pedir el límite justo antes de cada uno.
+    # El texto ya viene con los espacios normalizados, así que unir el resto con " " no lo cambia.
+    pendiente: str = ""
+    indice: int = 0
+
+    def cortar(final: bool) -> Iterator[str]:
+        nonlocal pendiente, indice
+        while pendiente:
+            limite: int = max(1, limit_for(indice))
+            if not final and len(pendiente) <= limite:
+                return
+            chunks: List[str] = split_text(pendiente, limite)
+            if not chunks:
+                pendiente = ""
+                return
+            if not final and len(chunks) == 1:
+                return
+            pendiente = " ".join(chunks[1:])
+            indice += 1
+            yield chunks[0]
+
+    for parte in parts:
+        if not parte:
+            continue
+        pendiente = f"{pendiente} {parte}" if pendiente else parte
+        yield from cortar(final=False)
+    yield from cortar(final=True)
+
+# Clasifica un error de síntesis:
+#   "throttle"  el servicio pide frenar (429, 503)
+#   "timeout"   no contestó a tiempo
+#   "fatal"     repetir no va a servir (petición mal formada, voz inexistente...)
+#   "transient" cualquier otro fallo de red o del servicio
+def classify_error(error: BaseException) -> str:
+    status: Optional[int] = getattr(error, "status", None)
+    if status in (429, 503):
+        return "throttle"
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or status == 408:
+        return "timeout"
+    if isinstance(status, int) and 400 <= status < 500:
+        return "fatal"
+    if isinstance(error, (ValueError, TypeError)):
+        return "fatal"
+    return "transient"
+
+# Espera exponencial con azar completo (0..base*2^intento), para que los trozos que
+# fallaron juntos no vuelvan a llegar juntos. Si el servicio manda Retry-After, se respeta.
+def retry_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    espera: float = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+    cabeceras = getattr(error, "headers", None)
+    if cabeceras:
+        try:
+            espera = max(espera, min(RETRY_MAX_SECONDS, float(cabeceras.get("Retry-After", 0))))
+        except (TypeError, ValueError):
+            pass
+    return espera
+
+# Backend por defecto: el servicio de voces de Microsoft Edge
+class EdgeTTSBackend:
+    # edge_tts parte los textos de más de ~4 KB en varias peticiones; nos quedamos por debajo
+    max_chars: int = 3000
+
+    async def stream(self, text: str, voice: str, rate: str) -> AsyncIterator[bytes]:
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+    async def close(self) -> None:
+        pass
+
+# Backend que habla con un servidor HTTP propio (por ejemplo un TTS local falso para pruebas).
+# Hace un POST a {base_url}/synthesize con {"text", "voice", "rate"} y recibe el MP3 como cuerpo.
+class HttpTTSBackend:
+    def __init__(self, base_url: str, timeout: float = 120.0, max_chars: Optional[int] = None) -> None:
+        self.base_url: str = base_url.rstrip("/")
+        self.timeout: float = timeout
+        # Texto máximo que acepta el servidor por petición (None = sin límite conocido)
+        self.max_chars: Optional[int] = max_chars
+        self._session = None
+
+    async def _get_session(self):
+        # aiohttp viene como dependencia de edge_tts
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def stream(self, text: str, voice: str, rate: str) -> AsyncIterator[bytes]:
+        session = await self._get_session()
+        payload: Dict[str, str] = {"text": text, "voice": voice, "rate": rate}
+        async with session.post(f"{self.base_url}/synthesize", json=payload) as response:
+            response.raise_for_status()
+            async for data in response.content.iter_any():
+                yield data
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
 # Esta clase se encarga de convertir el texto a voz usando el servicio de Edge.
 class TTSEngine:
-    def __init__(self):
+    def __init__(self, backend=None, cache=None, limiter=None, tuner=None, retries: int = DEFAULT_RETRIES):
         self.voice = "es-ES-AlvaroNeural" # Voz por defecto
         self.rate = "+0%" # Velocidad normal
+        self.backend = backend or EdgeTTSBackend()
+        # Caché opcional de trozos ya sintetizados (ver audio_cache.AudioCache)
+        self.cache = cache
+        # Límite opcional de conexiones compartido con otros trabajos (ver limits.SharedLimiter)
+        self.limiter = limiter
+        # Ajuste opcional del tamaño de trozo según lo que tarda cada petición (ver chunk_tuner.ChunkTuner)
+        self.tuner = tuner
+        # Cada trozo se reintenta hasta retries veces si el fallo no es definitivo
+        self.retries: int = max(0, retries)
+        # Control AIMD de peticiones a la vez; lo crea cada ejecución (ver limits.AdaptiveConcurrency)
+        self.concurrency: Optional[AdaptiveConcurrency] = None
+        # Último error que hizo fallar la síntesis, para explicarlo al usuario
+        self.last_error: Optional[BaseException] = None
+        # Bucle y tarea en curso, para poder cancelar desde otro hilo
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._cancelled: bool = False
 
     async def _generate_audio_async(self, text, output_file):
-        openai_tts = edge_tts.Communicate(text, self.voice, rate=self.rate)
-        await openai_tts.save(output_file)
+        async def guardar():
+            openai_tts = edge_tts.Communicate(text, self.voice, rate=self.rate)
+            await openai_tts.save(output_file)
+        await self._with_retries(guardar)
 
     def generate_audio(self, text, output_file, voice=None, rate=None):
         if voice:
             self.voice = voice
         if rate:
             self.rate = rate
-            
+
         try:
             # Creamos un bucle para ejecutar la tarea asíncrona y esperamos a que termine
             loop = asyncio.new_event_loop()
@@ -25,8 +237,307 @@ class TTSEngine:
             loop.close()
             return True
         except Exception as e:
-            print(f"Error al generar audio: {e}")
+            metrics.record_error("tts", e, "Error al generar audio")
+            return False
+
+    async def _synthesize_chunk(self, text: str, on_audio: Optional[Callable[[int], None]] = None) -> bytes:
+        if self.cache is not None:
+            audio: Optional[bytes] = self.cache.get(text, self.voice, self.rate)
+            if audio:
+                if on_audio:
+                    on_audio(len(audio))
+                return audio
+
+        async def pedir() -> bytes:
+            recibidos: int = 0
+
+            def contar(n: int) -> None:
+                nonlocal recibidos
+                recibidos += n
+                if on_audio:
+                    on_audio(n)
+
+            try:
+                return await self._request_chunk(text, contar)
+            except Exception:
+                # Lo recibido de un intento fallido no cuenta para el progreso
+                if on_audio and recibidos:
+                    on_audio(-recibidos)
+                raise
+
+        audio = await self._with_retries(pedir)
+
+        if self.cache is not None:
+            self.cache.put(text, self.voice, self.rate, audio)
+        return audio
+
+    @asynccontextmanager
+    async def _request_slot(self):
+        # Primero el límite AIMD de este trabajo y luego el global de conexiones
+        async with AsyncExitStack() as pila:
+            if self.concurrency is not None:
+                await pila.enter_async_context(self.concurrency.slot())
+            if self.limiter is not None:
+                await pila.enter_async_context(self.limiter.slot())
+            yield
+
+    async def _with_retries(self, call: Callable[[], Awaitable[T]],
+                            can_retry: Optional[Callable[[], bool]] = None) -> T:
+        # Repite la petición con espera creciente si falla por algo pasajero
+        # (y si can_retry, cuando se da, lo permite).
+        # Los avisos al control de concurrencia se dan con el hueco aún tomado.
+        intento: int = 0
+        while True:
+            async with self._request_slot():
+                try:
+                    resultado: T = await call()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error: Exception = e
+                    tipo: str = classify_error(e)
+                    if tipo in ("throttle", "timeout"):
+                        metrics.incr(f"tts_{tipo}s")
+                        if self.concurrency is not None:
+                            self.concurrency.on_overload()
+                else:
+                    if self.concurrency is not None:
+                        self.concurrency.on_success()
+                    return resultado
+
+            if tipo == "fatal" or intento >= self.retries or (can_retry is not None and not can_retry()):
+                raise error
+            espera: float = retry_delay(intento, error)
+            intento += 1
+            metrics.incr("tts_retries")
+            logger.warning("Fallo de síntesis (%s: %s); reintento %d/%d en %.1fs", tipo, error,
+                           intento, self.retries, espera,
+                           extra={"event": "tts_retry", "kind": tipo, "attempt": intento})
+            await asyncio.sleep(espera)
+
+    async def _request_chunk(self, text: str, on_audio: Optional[Callable[[int], None]]) -> bytes:
+        partes: List[bytes] = []
+        metrics.incr("tts_requests")
+        inicio: float = time.perf_counter()
+        primer_byte: Optional[float] = None
+        with metrics.span("tts"):
+            async for data in self.backend.stream(text, self.voice, self.rate):
+                if primer_byte is None:
+                    primer_byte = time.perf_counter() - inicio
+                partes.append(data)
+                # Avisamos de cada bloque recibido para poder mostrar progreso fino
+                if on_audio:
+                    on_audio(len(data))
+        audio = b"".join(partes)
+        if self.tuner is not None and primer_byte is not None:
+            self.tuner.observe(len(text), primer_byte, time.perf_counter() - inicio)
+        metrics.incr("tts_chars", len(text))
+        metrics.incr("tts_bytes", len(audio))
+        return audio
+
+    async def _run_stream_async(self, items: Iterator[Tuple[int, str]], on_chunk: Callable[[int, bytes], None],
+                                max_concurrency: int, queue_size: int = DEFAULT_QUEUE_SIZE,
+                                on_audio: Optional[Callable[[int], None]] = None,
+                                max_concurrency_cap: Optional[int] = None) -> None:
+        # Productor/consumidor: un productor saca trozos (indice, texto) del iterador en un
+        # hilo aparte y los deja en una cola acotada; varios consumidores los sintetizan y
+        # avisan con on_chunk(indice, audio) a medida que terminan, en cualquier orden.
+        # La cola acotada frena la lectura del PDF si la síntesis va más lenta.
+        # Las peticiones a la vez empiezan en max_concurrency y el control AIMD las mueve
+        # entre 1 y max_concurrency_cap; hay un consumidor por cada hueco posible.
+        self.concurrency = AdaptiveConcurrency(max_concurrency, max(max_concurrency, max_concurrency_cap or 0))
+        consumidores: int = self.concurrency.maximum
+        cola: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+        async def productor() -> None:
+            while True:
+                item = await asyncio.to_thread(next, items, None)
+                if item is None:
+                    break
+                await cola.put(item)
+            # Solo al terminar bien: si algo falla se cancelan todas las tareas, y esperar
+            # a meter los avisos en una cola llena que ya nadie vacía colgaría el trabajo
+            for _ in range(consumidores):
+                await cola.put(None)
+
+        async def consumidor() -> None:
+            while True:
+                item = await cola.get()
+                if item is None:
+                    return
+                indice, texto = item
+                on_chunk(indice, await self._synthesize_chunk(texto, on_audio))
+
+        tareas = [asyncio.ensure_future(productor())]
+        tareas += [asyncio.ensure_future(consumidor()) for _ in range(consumidores)]
+        try:
+            await asyncio.gather(*tareas)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            await self.backend.close()
+
+    async def _generate_chunked_async(self, chunks: List[str], output_file: str, max_concurrency: int) -> None:
+        terminados: Dict[int, bytes] = {}
+        siguiente: int = 0
+
+        with open(output_file, "wb") as salida:
+            # Los trozos llegan en cualquier orden; los escribimos en cuanto
+            # tenemos el siguiente que toca, para no guardar todo en memoria
+            def escribir(indice: int, audio: bytes) -> None:
+                nonlocal siguiente
+                terminados[indice] = audio
+                while siguiente in terminados:
+                    salida.write(terminados.pop(siguiente))
+                    siguiente += 1
+
+            await self._run_stream_async(enumerate(chunks), escribir, max_concurrency)
+
+    async def _stream_audio_async(self, chunks: List[str], on_data: Callable[[bytes], None], prefetch: int) -> None:
+        # Cada trozo deja sus bytes en su propia cola según llegan; se entregan en orden,
+        # así los del trozo que suena salen al momento y los siguientes esperan su turno
+        colas: List[asyncio.Queue] = [asyncio.Queue() for _ in chunks]
+        self.concurrency = AdaptiveConcurrency(1 + prefetch)
+
+        async def pedir(indice: int) -> None:
+            texto: str = chunks[indice]
+            try:
+                audio: Optional[bytes] = self.cache.get(texto, self.voice, self.rate) if self.cache else None
+                if audio:
+                    colas[indice].put_nowait(audio)
+                else:
+                    await self._stream_one(texto, colas[indice])
+            except Exception as e:
+                colas[indice].put_nowait(e)
+                return
+            colas[indice].put_nowait(None)
+
+        tareas: Dict[int, asyncio.Future] = {}
+        try:
+            for indice in range(len(chunks)):
+                for siguiente in range(indice, min(len(chunks), indice + 1 + prefetch)):
+                    if siguiente not in tareas:
+                        tareas[siguiente] = asyncio.ensure_future(pedir(siguiente))
+                while True:
+                    item = await colas[indice].get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    on_data(item)
+        finally:
+            for tarea in tareas.values():
+                tarea.cancel()
+            await asyncio.gather(*tareas.values(), return_exceptions=True)
+            await self.backend.close()
+
+    async def _stream_one(self, texto: str, cola: asyncio.Queue) -> None:
+        # Pide un trozo pasando cada bloque a la cola, con los mismos huecos y reintentos
+        # que el resto de peticiones. Solo se reintenta si aún no llegó nada: repetir a
+        # mitad duplicaría lo que ya se está oyendo.
+        partes: List[bytes] = []
+
+        async def pedir() -> None:
+            metrics.incr("tts_requests")
+            with metrics.span("tts"):
+                async for data in self.backend.stream(texto, self.voice, self.rate):
+                    partes.append(data)
+                    cola.put_nowait(data)
+
+        await self._with_retries(pedir, can_retry=lambda: not partes)
+        if self.cache is not None:
+            self.cache.put(texto, self.voice, self.rate, b"".join(partes))
+
+    def stream_audio(self, chunks: List[str], on_data: Callable[[bytes], None],
+                     voice=None, rate=None, prefetch: int = 1) -> bool:
+        # Sintetiza los trozos uno tras otro y entrega los bytes de audio en orden según
+        # llegan del servicio, para poder reproducir mientras tanto (vista previa de voz).
+        # Los `prefetch` trozos siguientes se piden mientras suena el actual.
+        if voice:
+            self.voice = voice
+        if rate:
+            self.rate = rate
+
+        return self._run(self._stream_audio_async(chunks, on_data, max(0, prefetch)))
+
+    def synthesize_chunks(self, chunks: Dict[int, str], on_chunk: Callable[[int, bytes], None],
+                          voice=None, rate=None, max_concurrency: int = DEFAULT_CONCURRENCY) -> bool:
+        # Sintetiza solo los trozos indicados ({indice: texto}) y entrega cada audio a on_chunk
+        return self.synthesize_stream(iter(sorted(chunks.items())), on_chunk, voice, rate, max_concurrency)
+
+    def synthesize_stream(self, items: Iterator[Tuple[int, str]], on_chunk: Callable[[int, bytes], None],
+                          voice=None, rate=None, max_concurrency: int = DEFAULT_CONCURRENCY,
+                          queue_size: int = DEFAULT_QUEUE_SIZE,
+                          on_audio: Optional[Callable[[int], None]] = None,
+                          max_concurrency_cap: Optional[int] = None) -> bool:
+        # Como synthesize_chunks, pero los trozos se van leyendo de un iterador mientras
+        # se sintetiza, así el audio empieza a generarse con la primera página del PDF.
+        # on_audio(n) se llama con cada bloque de bytes de audio recibido (negativo si un
+        # intento falla y hay que descontarlo). Con max_concurrency_cap la concurrencia sube
+        # sola hasta ese tope mientras el servicio responda bien.
+        if voice:
+            self.voice = voice
+        if rate:
+            self.rate = rate
+
+        return self._run(self._run_stream_async(items, on_chunk, max_concurrency, queue_size, on_audio,
+                                                max_concurrency_cap))
+
+    def generate_audio_chunked(self, text, output_file, voice=None, rate=None,
+                               max_concurrency: int = DEFAULT_CONCURRENCY,
+                               chunk_chars: int = DEFAULT_CHUNK_CHARS) -> bool:
+        # Igual que generate_audio, pero parte el texto en oraciones y sintetiza
+        # varios trozos a la vez. Los MP3 del servicio se pueden concatenar tal cual.
+        if voice:
+            self.voice = voice
+        if rate:
+            self.rate = rate
+
+        chunks: List[str] = split_text(text, chunk_chars)
+        if not chunks:
+            return False
+
+        return self._run(self._generate_chunked_async(chunks, output_file, max_concurrency))
+
+    def _run(self, coro) -> bool:
+        # Ejecuta la corrutina en un bucle propio y deja a mano la tarea para cancel()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._loop = loop
+            self.last_error = None
+            self._task = loop.create_task(coro)
+            if self._cancelled:
+                self._task.cancel()
+            loop.run_until_complete(self._task)
+            return True
+        except asyncio.CancelledError:
+            return False
+        except Exception as e:
+            self.last_error = e
+            metrics.record_error("tts", e, "Error al generar audio")
             return False
+        finally:
+            self._task = None
+            self._loop = None
+            loop.close()
+
+    def cancel(self) -> None:
+        # Se puede llamar desde cualquier hilo: corta las peticiones en vuelo de inmediato
+        # en lugar de esperar a que termine la síntesis en curso
+        self._cancelled = True
+        loop, tarea = self._loop, self._task
+        if loop is not None and tarea is not None:
+            try:
+                loop.call_soon_threadsafe(tarea.cancel)
+            except RuntimeError:
+                # El bucle ya se cerró
+                pass
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
 
     async def get_voices_async(self):
         voices = await edge_tts.list_voices()
@@ -37,6 +548,7 @@ class TTSEngine:
     def get_voices(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        voces = loop.run_until_complete(self.get_voices_async())
-        loop.close()
-        return voces
+        try:
+            return loop.run_until_complete(self.get_voices_async())
+        finally:
+            loop.close()
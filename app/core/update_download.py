@@ -0,0 +1,448 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config_manager import ConfigManager
+from app.core.tts_engine import retry_delay
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+GITHUB_REPO: str = "KnnabizCode/Narralib"
+# Se puede cambiar con update_api_url (p. ej. un servidor local para probar)
+DEFAULT_API_URL: str = "https://api.github.com"
+USER_AGENT: str = "Narralib-App"
+# Peticiones de rango a la vez para bajar el archivo
+DEFAULT_DOWNLOAD_PARTS: int = 4
+# Por debajo de esto no merece la pena partir la descarga
+MIN_PART_BYTES: int = 1024 * 1024
+DOWNLOAD_BLOCK: int = 64 * 1024
+# Cada cuánto apunta cada parte lo que lleva, para poder retomar
+STATE_SAVE_BYTES: int = 1024 * 1024
+# Fallos seguidos de una parte (sin avanzar nada) antes de rendirse
+DOWNLOAD_RETRIES: int = 5
+# Segundos sin recibir nada antes de dar la conexión por perdida
+READ_TIMEOUT_SECONDS: float = 60.0
+# Archivos de la release con las sumas sha256, si el asset no trae "digest"
+CHECKSUM_FILES = ("SHA256SUMS", "SHA256SUMS.txt", "checksums.txt")
+# Qué buscar en el nombre del ZIP según el sistema
+_PLATFORM_TAGS = {"win32": "win", "darwin": "mac", "linux": "linux"}
+
+class ReleaseAsset(NamedTuple):
+    name: str
+    url: str
+    size: int
+    sha256: Optional[str]
+
+class ReleaseInfo(NamedTuple):
+    version: str
+    html_url: str
+    asset: Optional[ReleaseAsset]
+
+# La descarga terminó pero el archivo no es el que anuncia la release
+class ChecksumMismatch(ValueError):
+    pass
+
+# El servidor no entiende Range: se baja de una vez
+class _RangesUnsupported(Exception):
+    pass
+
+def is_newer(remote_ver: str, local_ver: str) -> bool:
+    try:
+        return [int(p) for p in remote_ver.split('.')] > [int(p) for p in local_ver.split('.')]
+    except ValueError:
+        # Fallback a comparación de cadenas simple
+        return remote_ver > local_ver
+
+def releases_url(api_url: Optional[str] = None) -> str:
+    base: str = api_url or ConfigManager().get("update_api_url") or DEFAULT_API_URL
+    return f"{base.rstrip('/')}/repos/{GITHUB_REPO}/releases/latest"
+
+def updates_dir() -> Path:
+    return ConfigManager().config_dir / "updates"
+
+def _pick_asset(assets: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # El ZIP de este sistema si hay varios; si no, el único que haya
+    zips = [a for a in assets if str(a.get("name", "")).lower().endswith(".zip")]
+    etiqueta: Optional[str] = _PLATFORM_TAGS.get(sys.platform)
+    propios = [a for a in zips if etiqueta and etiqueta in a["name"].lower()]
+    return (propios or zips or [None])[0]
+
+# "<sha256>  <nombre>" por línea (formato de sha256sum), o solo la suma
+def parse_checksums(texto: str) -> Dict[str, str]:
+    sumas: Dict[str, str] = {}
+    for linea in texto.splitlines():
+        m = re.match(r'\s*([0-9a-fA-F]{64})(?:\s+\*?(.+?))?\s*$', linea)
+        if m:
+            sumas[(m.group(2) or "").strip()] = m.group(1).lower()
+    return sumas
+
+def parse_release(data: Dict[str, Any], checksums: Optional[Dict[str, str]] = None) -> ReleaseInfo:
+    version: str = str(data.get("tag_name", "")).lstrip("v")
+    elegido = _pick_asset(data.get("assets") or [])
+    asset: Optional[ReleaseAsset] = None
+    if elegido is not None:
+        sha: Optional[str] = None
+        # GitHub pone "sha256:<suma>" en digest; las releases viejas no lo tienen
+        digest: str = str(elegido.get("digest") or "")
+        if digest.startswith("sha256:"):
+            sha = digest.split(":", 1)[1].lower()
+        elif checksums:
+            sha = checksums.get(elegido["name"]) or checksums.get("")
+        asset = ReleaseAsset(elegido["name"], elegido["browser_download_url"], int(elegido.get("size") or 0), sha)
+    return ReleaseInfo(version, str(data.get("html_url", "")), asset)
+
+# Última release con el ZIP a descargar y su sha256 (del digest del asset o de un
+# archivo de sumas publicado en la misma release)
+async def fetch_release(session, api_url: Optional[str] = None) -> ReleaseInfo:
+    async with session.get(releases_url(api_url), headers={"Accept": "application/vnd.github+json"}) as response:
+        response.raise_for_status()
+        data: Dict[str, Any] = await response.json(content_type=None)
+    info: ReleaseInfo = parse_release(data)
+    if info.asset is None or info.asset.sha256:
+        return info
+    nombres = {info.asset.name + ".sha256", *CHECKSUM_FILES}
+    for asset in data.get("assets") or []:
+        if asset.get("name") in nombres:
+            async with session.get(asset["browser_download_url"]) as response:
+                response.raise_for_status()
+                sumas: Dict[str, str] = parse_checksums(await response.text())
+            return parse_release(data, sumas)
+    return info
+
+# Descarga de un asset de la release a <config>/updates/<versión>/, con varias peticiones
+# de rango a la vez. Lo que lleva cada parte se apunta en <archivo>.part.json, así una
+# descarga cortada (o la aplicación cerrada) sigue donde se quedó. Al terminar se
+# comprueba el sha256; si no coincide se borra todo y no se instala nada.
+class UpdateDownloader:
+    def __init__(self, asset: ReleaseAsset, version: str, parts: Optional[int] = None,
+                 on_progress: Optional[Callable[[int, int], None]] = None,
+                 directory: Optional[Path] = None) -> None:
+        if not asset.sha256:
+            raise ValueError("La release no publica el sha256 del archivo")
+        if asset.size <= 0:
+            raise ValueError("La release no indica el tamaño del archivo")
+        self.asset: ReleaseAsset = asset
+        self.version: str = version
+        self.parts: int = max(1, parts or int(ConfigManager().get("update_download_parts", DEFAULT_DOWNLOAD_PARTS)))
+        # on_progress(bytes descargados, total)
+        self.on_progress: Callable[[int, int], None] = on_progress or (lambda done, total: None)
+        self.directory: Path = Path(directory or updates_dir()) / version
+        self.path: Path = self.directory / asset.name
+        self.part_path: Path = self.directory / (asset.name + ".part")
+        self.state_path: Path = self.directory / (asset.name + ".part.json")
+        self.state: Dict[str, Any] = {}
+        self.done_bytes: int = 0
+        self.resumed_bytes: int = 0
+        self._cancelled: bool = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def _plan(self) -> Dict[str, Any]:
+        partes: int = max(1, min(self.parts, self.asset.size // MIN_PART_BYTES))
+        cortes: List[int] = [self.asset.size * i // partes for i in range(partes + 1)]
+        return {"url": self.asset.url, "size": self.asset.size, "sha256": self.asset.sha256,
+                "parts": [{"start": cortes[i], "end": cortes[i + 1], "done": 0} for i in range(partes)]}
+
+    def _load_state(self) -> Optional[Dict[str, Any]]:
+        # Solo vale si es la misma descarga y el .part sigue ahí con su tamaño
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                estado: Dict[str, Any] = json.load(f)
+            if os.path.getsize(self.part_path) != self.asset.size:
+                return None
+        except (OSError, ValueError):
+            return None
+        if (estado.get("url"), estado.get("size"), estado.get("sha256")) != \
+                (self.asset.url, self.asset.size, self.asset.sha256):
+            return None
+        return estado
+
+    def _save_state(self) -> None:
+        tmp: Path = self.state_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    def _remove_partial(self) -> None:
+        for path in (self.part_path, self.state_path):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def sha256(self, path: Path) -> str:
+        resumen = hashlib.sha256()
+        with open(path, "rb") as f:
+            for bloque in iter(lambda: f.read(DOWNLOAD_BLOCK * 4), b""):
+                resumen.update(bloque)
+        return resumen.hexdigest()
+
+    async def download(self) -> Optional[Path]:
+        # Devuelve la ruta del archivo ya comprobado, o None si se canceló (se puede retomar)
+        import aiohttp
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.sha256(self.path) == self.asset.sha256:
+            return self.path
+
+        estado: Optional[Dict[str, Any]] = self._load_state()
+        if estado is None:
+            self.state = self._plan()
+            with open(self.part_path, "wb") as f:
+                f.truncate(self.asset.size)
+            self._save_state()
+        else:
+            self.state = estado
+        self.resumed_bytes = self.done_bytes = sum(p["done"] for p in self.state["parts"])
+        if self.resumed_bytes:
+            metrics.incr("update_resumed_bytes", self.resumed_bytes)
+            logger.info("Se retoma la descarga de %s en %d bytes", self.asset.name, self.resumed_bytes,
+                        extra={"event": "update_resumed", "version": self.version, "bytes": self.resumed_bytes})
+
+        tiempo = aiohttp.ClientTimeout(total=None, sock_connect=READ_TIMEOUT_SECONDS,
+                                       sock_read=READ_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}, timeout=tiempo) as session:
+            try:
+                await self._run_parts(session)
+            except _RangesUnsupported:
+                # Todo en una sola petición desde el principio
+                metrics.incr("update_ranges_unsupported")
+                self.state["parts"] = [{"start": 0, "end": self.asset.size, "done": 0}]
+                self.done_bytes = 0
+                self._save_state()
+                await self._part(session, self.state["parts"][0])
+            finally:
+                if self.state["parts"]:
+                    self._save_state()
+
+        if self._cancelled:
+            return None
+        suma: str = self.sha256(self.part_path)
+        if suma != self.asset.sha256:
+            self._remove_partial()
+            metrics.incr("update_checksum_mismatches")
+            raise ChecksumMismatch(f"El sha256 de {self.asset.name} no coincide ({suma})")
+        os.replace(self.part_path, self.path)
+        self._remove_partial()
+        return self.path
+
+    async def _run_parts(self, session) -> None:
+        # Si una parte falla, las demás se paran (y se espera a que paren) antes de seguir:
+        # si no, seguirían escribiendo en el .part mientras se descarga de una vez o se cierra
+        tareas: List[asyncio.Task] = [asyncio.create_task(self._part(session, parte))
+                                      for parte in self.state["parts"]]
+        try:
+            await asyncio.gather(*tareas)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+    async def _part(self, session, parte: Dict[str, Any]) -> None:
+        import aiohttp
+
+        fallos: int = 0
+        while parte["start"] + parte["done"] < parte["end"] and not self._cancelled:
+            inicio: int = parte["start"] + parte["done"]
+            entera: bool = inicio == 0 and parte["end"] == self.asset.size
+            pendiente: int = 0
+            try:
+                cabeceras: Dict[str, str] = {"Range": f"bytes={inicio}-{parte['end'] - 1}"}
+                async with session.get(self.asset.url, headers=cabeceras) as response:
+                    if response.status == 200 and not entera:
+                        raise _RangesUnsupported()
+                    response.raise_for_status()
+                    with open(self.part_path, "r+b") as f:
+                        f.seek(inicio)
+                        async for bloque in response.content.iter_chunked(DOWNLOAD_BLOCK):
+                            bloque = bloque[:parte["end"] - inicio - pendiente]
+                            f.write(bloque)
+                            pendiente += len(bloque)
+                            self.done_bytes += len(bloque)
+                            self.on_progress(self.done_bytes, self.asset.size)
+                            if pendiente >= STATE_SAVE_BYTES:
+                                # Solo se apunta lo que ya está escrito
+                                f.flush()
+                                parte["done"] += pendiente
+                                inicio += pendiente
+                                pendiente = 0
+                                fallos = 0
+                                self._save_state()
+                            if self._cancelled or inicio + pendiente >= parte["end"]:
+                                break
+                        f.flush()
+                        parte["done"] += pendiente
+                        pendiente = 0
+                if parte["start"] + parte["done"] < parte["end"] and not self._cancelled:
+                    raise aiohttp.ClientPayloadError("La conexión se cerró antes de tiempo")
+            except _RangesUnsupported:
+                raise
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500 and e.status != 429:
+                    raise
+                self.done_bytes -= pendiente
+                fallos += 1
+                if fallos > DOWNLOAD_RETRIES:
+                    raise
+                await asyncio.sleep(retry_delay(fallos, e))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Lo recibido antes del corte no se pierde: se sigue desde ahí
+                self.done_bytes -= pendiente
+                fallos += 1
+                metrics.incr("update_retries")
+                logger.warning("Descarga de la actualización interrumpida (%s); se reintenta", e)
+                if fallos > DOWNLOAD_RETRIES:
+                    raise
+                await asyncio.sleep(retry_delay(fallos))
+
+# Prepara la versión descargada para instalarla en el próximo arranque: descomprime el
+# ZIP en <updates>/<versión>/files y lo apunta en <updates>/pending.json
+def stage_update(zip_path: Path, version: str, directory: Optional[Path] = None) -> Path:
+    base: Path = Path(directory or updates_dir())
+    destino: Path = base / version / "files"
+    tmp: Path = base / version / "files.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    with zipfile.ZipFile(zip_path) as z:
+        malo: Optional[str] = z.testzip()
+        if malo is not None:
+            raise ValueError(f"El ZIP de la actualización está dañado ({malo})")
+        for nombre in z.namelist():
+            # Nada puede salir de la carpeta (rutas absolutas o con ..)
+            if not (tmp / nombre).resolve().is_relative_to(tmp.resolve()):
+                raise ValueError(f"Ruta no válida en el ZIP de la actualización: {nombre}")
+        z.extractall(tmp)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp, destino)
+    # Los ZIP de las releases suelen llevar una carpeta con todo dentro
+    raiz: Path = destino
+    contenido: List[Path] = list(raiz.iterdir())
+    while len(contenido) == 1 and contenido[0].is_dir():
+        raiz = contenido[0]
+        contenido = list(raiz.iterdir())
+
+    pendiente: Path = base / "pending.json"
+    with open(pendiente.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "files": str(raiz), "staged": time.time()}, f)
+    os.replace(pendiente.with_suffix(".tmp"), pendiente)
+    logger.info("Actualización %s lista para instalarse al reiniciar", version,
+                extra={"event": "update_staged", "version": version})
+    return raiz
+
+def pending_update(directory: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    try:
+        with open(Path(directory or updates_dir()) / "pending.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Carpeta del ejecutable compilado; None si se ejecuta desde el código fuente
+def install_dir() -> Optional[Path]:
+    if getattr(sys, 'frozen', False):
+        return Path(os.path.dirname(sys.executable))
+    return None
+
+def _remove_old_files(target: Path) -> None:
+    # Lo que quedó de la versión anterior (el ejecutable no se puede borrar mientras corre)
+    for viejo in target.rglob("*.old"):
+        try:
+            viejo.unlink()
+        except OSError:
+            pass
+
+# Pone en su sitio la actualización preparada, antes de cargar nada más. Cada archivo
+# viejo se renombra a .old (Windows deja renombrar un ejecutable en uso, no borrarlo) y
+# si algo falla se deshace lo movido. Devuelve la versión instalada o None.
+def apply_pending_update(target: Optional[Path] = None, directory: Optional[Path] = None) -> Optional[str]:
+    target = target or install_dir()
+    if target is None:
+        return None
+    base: Path = Path(directory or updates_dir())
+    _remove_old_files(target)
+    pendiente: Optional[Dict[str, Any]] = pending_update(base)
+    if pendiente is None:
+        return None
+    version: str = str(pendiente.get("version", ""))
+    origen: Path = Path(pendiente.get("files", ""))
+
+    movidos: List[Tuple[Path, Optional[Path]]] = []
+    try:
+        if not origen.is_dir():
+            raise OSError(f"No está la carpeta de la actualización: {origen}")
+        for archivo in sorted(p for p in origen.rglob("*") if p.is_file()):
+            destino: Path = target / archivo.relative_to(origen)
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            viejo: Optional[Path] = None
+            if destino.exists():
+                viejo = destino.with_name(destino.name + ".old")
+                if viejo.exists():
+                    viejo.unlink()
+                os.replace(destino, viejo)
+            movidos.append((destino, viejo))
+            shutil.move(str(archivo), str(destino))
+    except OSError as e:
+        for destino, viejo in reversed(movidos):
+            try:
+                if destino.exists():
+                    destino.unlink()
+                if viejo is not None:
+                    os.replace(viejo, destino)
+            except OSError:
+                pass
+        metrics.record_error("update", e, "No se pudo instalar la actualización")
+        version = ""
+    finally:
+        # Bien o mal, no se vuelve a intentar en cada arranque; se puede volver a descargar
+        try:
+            (base / "pending.json").unlink()
+        except OSError:
+            pass
+        if origen.parts:
+            shutil.rmtree(base / version if version else origen, ignore_errors=True)
+    if version:
+        logger.info("Actualización %s instalada", version, extra={"event": "update_applied", "version": version})
+    return version or None
+
+# Arranca otra instancia de la aplicación (que instala la versión preparada); quien
+# llama tiene que cerrar esta
+def relaunch() -> None:
+    argumentos: List[str] = sys.argv[1:] if getattr(sys, 'frozen', False) else sys.argv
+    subprocess.Popen([sys.executable] + argumentos)
+
+# Busca la última release y, si es más nueva que `current`, la descarga y la deja
+# preparada. Devuelve la release y la carpeta preparada (None si no había nada nuevo o
+# se canceló la descarga).
+async def download_latest(current: str, api_url: Optional[str] = None, parts: Optional[int] = None,
+                          on_progress: Optional[Callable[[int, int], None]] = None,
+                          directory: Optional[Path] = None,
+                          downloader: Optional[Callable[[UpdateDownloader], None]] = None
+                          ) -> Tuple[ReleaseInfo, Optional[Path]]:
+    import aiohttp
+
+    tiempo = aiohttp.ClientTimeout(total=READ_TIMEOUT_SECONDS)
+    async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}, timeout=tiempo) as session:
+        info: ReleaseInfo = await fetch_release(session, api_url)
+    if not is_newer(info.version, current):
+        return info, None
+    if info.asset is None:
+        raise ValueError(f"La versión {info.version} no tiene ningún ZIP para descargar")
+    descarga = UpdateDownloader(info.asset, info.version, parts, on_progress, directory)
+    if downloader is not None:
+        # Para poder cancelarla desde otro sitio
+        downloader(descarga)
+    with metrics.span("update_download"):
+        archivo: Optional[Path] = await descarga.download()
+    if archivo is None:
+        return info, None
+    return info, stage_update(archivo, info.version, directory)
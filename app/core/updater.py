@@ -1,16 +1,18 @@
 import sys
 import json
 import webbrowser
-from typing import Optional, List, Any, Dict
+from typing import Optional, Any, Dict
 from datetime import datetime, timedelta
 
 from PySide6.QtCore import QObject, Signal, Qt, QUrl
 from PySide6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
-from PySide6.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QWidget
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QWidget, QProgressBar,
+                               QApplication)
 from app.core.config_manager import ConfigManager
+from app.core.update_download import releases_url, install_dir, relaunch, is_newer, USER_AGENT
+from app.core.task_manager import UpdateDownloadWorker
 from app import __version__
 
-GITHUB_REPO: str = "KnnabizCode/Narralib"
 CHECK_INTERVAL_HOURS: int = 24
 
 # Gestiona la verificación de actualizaciones en segundo plano utilizando QtNetwork
@@ -38,10 +40,10 @@ class UpdateChecker(QObject):
                 except ValueError:
                     pass
 
-            # Prepara la solicitud a la API de GitHub
-            url: QUrl = QUrl(f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest")
+            # Prepara la solicitud a la API de GitHub (o a la de update_api_url)
+            url: QUrl = QUrl(releases_url())
             request: QNetworkRequest = QNetworkRequest(url)
-            request.setHeader(QNetworkRequest.UserAgentHeader, "Narralib-App")
+            request.setHeader(QNetworkRequest.UserAgentHeader, USER_AGENT)
             
             self.manager.get(request)
             
@@ -70,13 +72,7 @@ class UpdateChecker(QObject):
 
     def is_newer(self, remote_ver: str, local_ver: str) -> bool:
         # Compara dos cadenas de versión
-        try:
-            r_parts: List[int] = [int(p) for p in remote_ver.split('.')]
-            l_parts: List[int] = [int(p) for p in local_ver.split('.')]
-            return r_parts > l_parts
-        except Exception:
-            # Fallback a comparación de cadenas simple
-            return remote_ver > local_ver
+        return is_newer(remote_ver, local_ver)
 
 # Diálogo modal para notificar al usuario sobre nuevas actualizaciones
 class UpdateDialog(QDialog):
@@ -85,7 +81,9 @@ class UpdateDialog(QDialog):
         self.download_url: str = download_url
         self.setWindowTitle("Actualización disponible")
         
-        self.setFixedSize(320, 180)
+        self.setFixedSize(320, 210)
+        self.worker: Optional[UpdateDownloadWorker] = None
+        self.staged: bool = False
         
         # Elimina el botón de ayuda del contexto en la barra de título
         self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
@@ -105,6 +103,13 @@ class UpdateDialog(QDialog):
         info_label.setWordWrap(True)
         info_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(info_label)
+        self.info_label: QLabel = info_label
+
+        # Progreso de la descarga dentro de la aplicación
+        self.progress_bar: QProgressBar = QProgressBar()
+        self.progress_bar.setValue(0)
+        self.progress_bar.hide()
+        layout.addWidget(self.progress_bar)
         
         # Configura los botones de acción
         btn_layout: QHBoxLayout = QHBoxLayout()
@@ -141,9 +146,49 @@ class UpdateDialog(QDialog):
         layout.addLayout(btn_layout)
 
     def open_download(self) -> None:
-        # Abre el navegador predeterminado en la URL de descarga
-        webbrowser.open(self.download_url)
-        self.accept()
+        if self.staged:
+            # La versión nueva se pone en su sitio al arrancar otra vez
+            relaunch()
+            QApplication.quit()
+            return
+        if self.worker is not None:
+            return
+        if install_dir() is None:
+            # Desde el código fuente no hay ejecutable que cambiar: se abre la página de la release
+            webbrowser.open(self.download_url)
+            self.accept()
+            return
+        # Descarga por partes, comprobada con el sha256 de la release y preparada para el reinicio
+        self.worker = UpdateDownloadWorker()
+        self.worker.update_progress.connect(self.progress_bar.setValue)
+        self.worker.finished_download.connect(self.on_download_finished)
+        self.worker.finished.connect(self.on_worker_done)
+        self.progress_bar.show()
+        self.btn_update.setEnabled(False)
+        self.info_label.setText("Descargando la actualización...")
+        self.worker.start()
+
+    def on_download_finished(self, success: bool, message: str) -> None:
+        self.info_label.setText(message)
+        if success:
+            self.staged = True
+            self.progress_bar.setValue(100)
+            self.btn_update.setText("Reiniciar ahora")
+        else:
+            self.progress_bar.hide()
+
+    def on_worker_done(self) -> None:
+        # El hilo se suelta cuando ha terminado del todo, no con su última señal
+        self.worker.wait()
+        self.worker = None
+        self.btn_update.setEnabled(True)
+
+    def reject(self) -> None:
+        # Cerrar a mitad deja la descarga a medias; la próxima vez sigue donde se quedó
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+        super().reject()
 
 # Interfaz pública para iniciar el proceso de actualización
 def check_for_updates(parent_window: Optional[Any] = None, force: bool = False) -> None:
@@ -152,11 +197,12 @@ def check_for_updates(parent_window: Optional[Any] = None, force: bool = False)
         if force:
             ConfigManager().set("last_update_check", "")
 
-        # Mantiene la referencia viva adjuntándola a la ventana padre
-        checker: UpdateChecker = UpdateChecker(parent_window)
-        parent_window._update_checker = checker
-        
-        checker.update_available.connect(lambda ver, url: show_update_dialog(ver, url, parent_window))
+        # Un solo comprobador por ventana, que se reutiliza en cada consulta
+        checker: Optional[UpdateChecker] = getattr(parent_window, "_update_checker", None)
+        if checker is None:
+            checker = UpdateChecker(parent_window)
+            parent_window._update_checker = checker
+            checker.update_available.connect(lambda ver, url: show_update_dialog(ver, url, parent_window))
         
         checker.check()
 
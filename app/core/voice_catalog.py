@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config_manager import ConfigManager
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se considera vieja la lista de voces guardada
+DEFAULT_TTL_HOURS: int = 24 * 7
+
+# Voces que mostramos si nunca se pudo descargar la lista (por ejemplo, sin internet)
+FALLBACK_VOICES: List[Dict[str, str]] = [
+    {"ShortName": "es-ES-AlvaroNeural", "Gender": "Male"},
+    {"ShortName": "es-ES-ElviraNeural", "Gender": "Female"},
+    {"ShortName": "es-MX-DaliaNeural", "Gender": "Female"},
+    {"ShortName": "es-MX-JorgeNeural", "Gender": "Male"},
+]
+
+# Guarda en disco la lista de voces del servicio para que la ventana pueda
+# mostrarla al instante, sin esperar a la red. La lista se refresca en segundo plano
+# cuando pasa el TTL.
+class VoiceCatalog:
+    def __init__(self, path: Optional[Path] = None, ttl_hours: Optional[float] = None) -> None:
+        config: ConfigManager = ConfigManager()
+        self.path: Path = Path(path) if path else config.config_dir / "voices.json"
+        if ttl_hours is None:
+            ttl_hours = float(config.get("voices_ttl_hours", DEFAULT_TTL_HOURS))
+        self.ttl_seconds: float = ttl_hours * 3600
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and isinstance(data.get("voices"), list):
+                return data
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def cached_voices(self) -> List[Dict[str, Any]]:
+        # Devuelve lo guardado aunque esté viejo; si no hay nada, las voces de respaldo
+        return self._read().get("voices") or list(FALLBACK_VOICES)
+
+    def is_stale(self) -> bool:
+        fetched: float = float(self._read().get("fetched", 0))
+        return time.time() - fetched > self.ttl_seconds
+
+    def save(self, voices: List[Dict[str, Any]]) -> None:
+        # Escritura atómica: nunca dejamos un archivo a medias
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp: Path = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched": time.time(), "voices": voices}, f)
+        os.replace(tmp, self.path)
+
+    def refresh(self) -> Optional[List[Dict[str, Any]]]:
+        # Descarga la lista de voces y la guarda; devuelve None si no hay conexión
+        from app.core.tts_engine import TTSEngine
+        try:
+            voices = TTSEngine().get_voices()
+        except Exception as e:
+            logger.warning("No se pudo actualizar la lista de voces: %s", e)
+            return None
+        if not voices:
+            return None
+        self.save(voices)
+        return voices
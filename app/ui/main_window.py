@@ -1,12 +1,17 @@
 from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                                QPushButton, QLabel, QFileDialog, QProgressBar, 
-                               QComboBox, QMessageBox, QFrame)
+                               QComboBox, QMessageBox, QFrame, QCheckBox, QLineEdit)
 from PySide6.QtCore import Qt, QSize, QUrl, QEvent
 from PySide6.QtGui import QIcon, QMouseEvent, QEnterEvent, QDesktopServices
-from app.core.task_manager import ConversionWorker
-from app.core.tts_engine import TTSEngine
+from PySide6.QtMultimedia import QMediaPlayer
+from app.core.task_manager import JobScheduler, VoiceRefreshWorker, PreviewWorker, EstimateWorker
+from app.core.preview import parse_page_range
+from app.ui.preview_player import PreviewPlayer
+from app.core.voice_catalog import VoiceCatalog
 from app.utils.paths import get_resource_path
 from app.core.config_manager import ConfigManager
+from app.core.chapters import plan_chapters, chapters_dir, write_playlist
+from app.core import audio_post
 from app.core.updater import check_for_updates
 import os
 
@@ -40,6 +45,27 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.config = ConfigManager()
+
+        # Planificador de conversiones: permite encolar varios PDF
+        self.scheduler = JobScheduler(parent=self)
+        self.scheduler.job_progress.connect(self.update_job_progress)
+        self.scheduler.job_status.connect(self.update_job_status)
+        self.scheduler.job_finished.connect(self.on_finished)
+        self.scheduler.job_cancelled.connect(self.on_cancelled)
+        self.scheduler.queue_changed.connect(self.update_queue)
+        self.job_names = {}
+        # Libros divididos en capítulos: id del libro -> carpeta, capítulos y trabajos pendientes
+        self.books = {}
+        self.job_books = {}
+
+        # Vista previa de la voz: se reproduce mientras se genera
+        self.preview_player = PreviewPlayer(self)
+        self.preview_player.player.playbackStateChanged.connect(self.on_preview_state)
+        self.preview_worker = None
+
+        # Estimación de lo que costará convertir el PDF elegido
+        self.estimate_worker = None
+        self.estimate_pending = False
         
         self.setWindowTitle("Narralib")
         self.setMinimumSize(600, 450)
@@ -98,6 +124,11 @@ class MainWindow(QMainWindow):
         file_layout.addWidget(self.file_label)
         file_layout.addWidget(select_btn)
         main_layout.addWidget(self.file_frame)
+
+        # Lo que se espera de la conversión (texto, duración, tiempo y tamaño), antes de empezar
+        self.estimate_label = QLabel("")
+        self.estimate_label.setAlignment(Qt.AlignCenter)
+        main_layout.addWidget(self.estimate_label)
         
         # Opciones
         options_layout = QHBoxLayout()
@@ -115,12 +146,42 @@ class MainWindow(QMainWindow):
         self.speed_combo = QComboBox()
         self.speed_combo.addItems(["-20%", "-10%", "+0%", "+10%", "+20%"])
         self.speed_combo.setCurrentText("+0%")
+        self.speed_combo.currentTextChanged.connect(self.estimate_pdf)
+        self.voice_combo.currentIndexChanged.connect(self.estimate_pdf)
         speed_layout.addWidget(speed_label)
         speed_layout.addWidget(self.speed_combo)
         
         options_layout.addLayout(voice_layout, stretch=2)
         options_layout.addLayout(speed_layout, stretch=1)
         main_layout.addLayout(options_layout)
+
+        # Escuchar la voz elegida con el principio del PDF (o unas páginas) sin convertirlo
+        preview_layout = QHBoxLayout()
+        self.preview_btn = QPushButton("▶ Escuchar voz")
+        self.preview_btn.setCursor(Qt.PointingHandCursor)
+        self.preview_btn.clicked.connect(self.toggle_preview)
+        self.preview_pages = QLineEdit()
+        self.preview_pages.setPlaceholderText("Páginas (ej. 12-14)")
+        self.preview_pages.setMaximumWidth(160)
+        self.preview_label = QLabel("")
+        preview_layout.addWidget(self.preview_btn)
+        preview_layout.addWidget(self.preview_pages)
+        preview_layout.addWidget(self.preview_label, stretch=1)
+        main_layout.addLayout(preview_layout)
+
+        # Un MP3 por capítulo (según el índice del PDF) en lugar de uno solo
+        self.chapters_check = QCheckBox("Un archivo por capítulo")
+        self.chapters_check.setChecked(bool(self.config.get("split_chapters", False)))
+        main_layout.addWidget(self.chapters_check)
+
+        # Recortar los silencios largos entre trozos e igualar el volumen (necesita numpy y ffmpeg)
+        self.postprocess_check = QCheckBox("Ajustar silencios y volumen")
+        self.postprocess_check.setChecked(bool(self.config.get("audio_postprocess", False)))
+        if not audio_post.available():
+            self.postprocess_check.setChecked(False)
+            self.postprocess_check.setEnabled(False)
+            self.postprocess_check.setToolTip("Hace falta instalar numpy y ffmpeg")
+        main_layout.addWidget(self.postprocess_check)
         
         # Progreso y Acción
         progress_layout = QVBoxLayout()
@@ -136,11 +197,18 @@ class MainWindow(QMainWindow):
         self.start_btn.setStyleSheet("background-color: #89b4fa; color: #1e1e2e; font-size: 16px;")
         self.start_btn.clicked.connect(self.start_conversion)
         self.start_btn.setEnabled(False) # Desactivado hasta que haya archivo
+
+        # Botón para cancelar, solo visible mientras se convierte
+        self.cancel_btn = QPushButton("Cancelar")
+        self.cancel_btn.setMinimumHeight(45)
+        self.cancel_btn.clicked.connect(self.cancel_conversion)
+        self.cancel_btn.setVisible(False)
         
         progress_layout.addWidget(self.status_label)
         progress_layout.addWidget(self.progress_bar)
         progress_layout.addSpacing(10)
         progress_layout.addWidget(self.start_btn)
+        progress_layout.addWidget(self.cancel_btn)
         
         main_layout.addStretch()
         main_layout.addLayout(progress_layout)
@@ -356,22 +424,132 @@ class MainWindow(QMainWindow):
         self.apply_theme()
 
     def load_voices(self):
-        tts = TTSEngine()
-        voices = tts.get_voices()
+        # Llenamos la lista al instante con las voces guardadas y, si están viejas,
+        # las actualizamos en segundo plano sin bloquear la ventana
+        catalog = VoiceCatalog()
+        self.fill_voices(catalog.cached_voices())
+
+        if catalog.is_stale():
+            self.voice_worker = VoiceRefreshWorker()
+            self.voice_worker.voices_loaded.connect(self.fill_voices)
+            self.voice_worker.start()
+
+    def fill_voices(self, voices):
+        # Conserva la voz elegida si sigue estando en la lista nueva
+        actual = self.voice_combo.currentData() or self.config.get("voice")
+        self.voice_combo.clear()
         for v in voices:
             friendly_name = f"{v['ShortName'].split('-')[-1]} ({v['Gender']})"
             self.voice_combo.addItem(friendly_name, v['ShortName'])
 
+        indice = self.voice_combo.findData(actual)
+        if indice >= 0:
+            self.voice_combo.setCurrentIndex(indice)
+
+    def toggle_preview(self):
+        # El mismo botón empieza y detiene la vista previa
+        if self.preview_worker is not None or self.preview_player.player.isPlaying():
+            self.stop_preview()
+            return
+
+        paginas = None
+        if self.selected_pdf and self.preview_pages.text().strip():
+            paginas = parse_page_range(self.preview_pages.text())
+            if paginas is None:
+                QMessageBox.warning(self, "Páginas no válidas", "Escribe una página o un rango, por ejemplo 12-14.")
+                return
+
+        # Sin PDF abierto se lee una frase de ejemplo
+        dispositivo = self.preview_player.start()
+        self.preview_worker = PreviewWorker(self.selected_pdf, self.voice_combo.currentData(),
+                                            self.speed_combo.currentText(), dispositivo.feed, pages=paginas)
+        self.preview_worker.first_audio.connect(self.on_preview_audio)
+        self.preview_worker.finished_preview.connect(self.on_preview_finished)
+        self.preview_worker.finished.connect(self.on_preview_done)
+        self.preview_worker.start()
+        self.preview_btn.setText("■ Detener")
+        self.preview_label.setText("Preparando...")
+
+    def stop_preview(self):
+        if self.preview_worker is not None:
+            # El botón se recupera cuando el hilo termina (on_preview_done)
+            self.preview_worker.stop()
+            self.preview_btn.setEnabled(False)
+        self.preview_player.stop()
+
+    def on_preview_audio(self, segundos):
+        # Empieza a sonar con los primeros bytes; el resto sigue llegando mientras tanto
+        self.preview_player.play()
+        self.preview_label.setText(f"Primer audio en {segundos:.2f} s")
+
+    def on_preview_finished(self, success, message):
+        if success:
+            # Ya está todo el audio: el reproductor termina lo que le queda
+            self.preview_player.finish()
+            return
+        self.preview_player.stop()
+        self.preview_btn.setText("▶ Escuchar voz")
+        self.preview_label.setText(message)
+
+    def on_preview_done(self):
+        # El hilo se suelta cuando ha terminado del todo, no con su última señal
+        self.preview_worker.wait()
+        self.preview_worker = None
+        self.preview_btn.setEnabled(True)
+        if not self.preview_player.player.isPlaying():
+            self.preview_btn.setText("▶ Escuchar voz")
+
+    def on_preview_state(self, estado):
+        if estado == QMediaPlayer.StoppedState and self.preview_worker is None:
+            self.preview_btn.setText("▶ Escuchar voz")
+
     def select_pdf(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Seleccionar PDF", "", "Archivos PDF (*.pdf)")
         if file_path:
             self.selected_pdf = file_path
             self.file_label.setText(os.path.basename(file_path))
             self.start_btn.setEnabled(True)
+            self.estimate_pdf()
+
+    def estimate_pdf(self):
+        if not self.selected_pdf or not self.voice_combo.currentData():
+            return
+        if self.estimate_worker is not None:
+            # Ya hay una en marcha: al terminar se repite con lo elegido ahora
+            self.estimate_pending = True
+            return
+        self.estimate_label.setText("Calculando estimación...")
+        self.estimate_worker = EstimateWorker(self.selected_pdf, self.voice_combo.currentData(),
+                                              self.speed_combo.currentText())
+        self.estimate_worker.estimated.connect(self.on_estimated)
+        self.estimate_worker.finished.connect(self.on_estimate_done)
+        self.estimate_worker.start()
+
+    def on_estimated(self, estimacion):
+        if not self.estimate_pending:
+            self.estimate_label.setText(estimacion.describe() if estimacion is not None else "")
+
+    def on_estimate_done(self):
+        self.estimate_worker.wait()
+        self.estimate_worker = None
+        if self.estimate_pending:
+            self.estimate_pending = False
+            self.estimate_pdf()
 
     def start_conversion(self):
         if not self.selected_pdf:
             return
+
+        self.config.set("split_chapters", self.chapters_check.isChecked())
+        if self.postprocess_check.isEnabled():
+            self.config.set("audio_postprocess", self.postprocess_check.isChecked())
+        if self.chapters_check.isChecked():
+            capitulos = plan_chapters(self.selected_pdf)
+            if capitulos:
+                self.start_chapters(capitulos)
+                return
+            QMessageBox.information(self, "Sin capítulos",
+                                    "El PDF no tiene índice; se generará un único archivo.")
             
         save_path, _ = QFileDialog.getSaveFileName(self, "Guardar Audio", "", "Audio MP3 (*.mp3)")
         if not save_path:
@@ -380,33 +558,102 @@ class MainWindow(QMainWindow):
         if not save_path.lower().endswith('.mp3'):
             save_path += '.mp3'
             
-        self.start_btn.setEnabled(False)
-        self.theme_btn.setEnabled(False)
-        self.update_btn.setEnabled(False)
-        self.file_label.setEnabled(False)
-        self.progress_bar.setValue(0)
+        self.lock_controls()
         
         voice = self.voice_combo.currentData()
         speed = self.speed_combo.currentText()
-        
-        self.worker = ConversionWorker(self.selected_pdf, voice, speed, save_path)
-        self.worker.update_progress.connect(self.update_progress)
-        self.worker.update_status.connect(self.update_status)
-        self.worker.finished_task.connect(self.on_finished)
-        
-        self.worker.start()
 
-    def update_progress(self, value):
+        # El planificador decide cuándo arranca; si ya hay conversiones en marcha, queda en cola
+        job_id = self.scheduler.submit(self.selected_pdf, voice, speed, save_path)
+        self.job_names[job_id] = os.path.basename(save_path)
+
+    def start_chapters(self, capitulos):
+        carpeta = QFileDialog.getExistingDirectory(self, "Carpeta para los capítulos")
+        if not carpeta:
+            return
+        carpeta = chapters_dir(self.selected_pdf, carpeta)
+        os.makedirs(carpeta, exist_ok=True)
+        self.lock_controls()
+
+        voice = self.voice_combo.currentData()
+        speed = self.speed_combo.currentText()
+
+        # Cada capítulo es un trabajo independiente: el planificador los reparte en paralelo
+        libro = f"book-{len(self.books)}"
+        self.books[libro] = {"dir": carpeta, "chapters": capitulos, "pending": set(), "failed": [], "progress": {}}
+        for capitulo in capitulos:
+            salida = os.path.join(carpeta, capitulo.filename)
+            job_id = self.scheduler.submit(self.selected_pdf, voice, speed, salida, pages=capitulo.pages)
+            self.job_names[job_id] = capitulo.filename
+            self.job_books[job_id] = libro
+            self.books[libro]["pending"].add(job_id)
+            self.books[libro]["progress"][job_id] = 0
+
+    def lock_controls(self):
+        self.theme_btn.setEnabled(False)
+        self.update_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.cancel_btn.setEnabled(True)
+        self.cancel_btn.setVisible(True)
+
+    def update_job_progress(self, job_id, value):
+        libro = self.job_books.get(job_id)
+        if libro is not None:
+            # Con capítulos en paralelo mostramos el avance del libro entero
+            progreso = self.books[libro]["progress"]
+            progreso[job_id] = value
+            value = sum(progreso.values()) // len(progreso)
         self.progress_bar.setValue(value)
 
-    def update_status(self, text):
+    def update_job_status(self, job_id, text):
+        # Con varias conversiones a la vez mostramos el nombre del archivo
+        if len(self.job_names) > 1:
+            text = f"{self.job_names.get(job_id, '')}: {text}"
         self.status_label.setText(text)
 
-    def on_finished(self, success, message):
-        self.start_btn.setEnabled(True)
+    def update_queue(self):
+        pendientes = self.scheduler.pending_count()
+        texto = "Convertir a Audio"
+        if pendientes:
+            texto += f" ({pendientes} en cola)"
+        self.start_btn.setText(texto)
+
+    def cancel_conversion(self):
+        # Cancela lo que está en marcha y lo que espera en la cola
+        self.cancel_btn.setEnabled(False)
+        self.status_label.setText("Cancelando...")
+        self.scheduler.cancel_all()
+
+    def reset_controls(self):
+        # Solo se desbloquea todo cuando ya no queda nada por convertir
+        if self.scheduler.is_busy():
+            return
+        self.job_names.clear()
+        self.cancel_btn.setVisible(False)
         self.theme_btn.setEnabled(True)
         self.update_btn.setEnabled(True)
-        self.file_label.setEnabled(True)
+
+    def on_cancelled(self, job_id):
+        libro = self.job_books.pop(job_id, None)
+        if libro is not None:
+            datos = self.books[libro]
+            datos["pending"].discard(job_id)
+            if datos["pending"]:
+                return
+            # La lista recoge los capítulos que sí llegaron a terminarse
+            del self.books[libro]
+            write_playlist(datos["dir"], os.path.basename(datos["dir"]), datos["chapters"])
+        self.reset_controls()
+        self.status_label.setText("Conversión cancelada")
+        self.progress_bar.setValue(0)
+
+    def on_finished(self, job_id, success, message):
+        libro = self.job_books.pop(job_id, None)
+        if libro is not None:
+            self.on_chapter_finished(libro, job_id, success, message)
+            return
+
+        self.reset_controls()
         
         if success:
             QMessageBox.information(self, "Éxito", message)
@@ -417,5 +664,26 @@ class MainWindow(QMainWindow):
             self.status_label.setText("Error")
             self.progress_bar.setValue(0)
 
+    def on_chapter_finished(self, libro, job_id, success, message):
+        datos = self.books[libro]
+        datos["pending"].discard(job_id)
+        datos["progress"][job_id] = 100
+        if not success:
+            datos["failed"].append(f"{self.job_names.get(job_id, '')}: {message}")
+        if datos["pending"]:
+            return
+
+        # Último capítulo del libro: lista de reproducción y un solo aviso para todo el libro
+        del self.books[libro]
+        self.reset_controls()
+        lista = write_playlist(datos["dir"], os.path.basename(datos["dir"]), datos["chapters"])
+        if datos["failed"]:
+            QMessageBox.critical(self, "Error", "Algunos capítulos fallaron:\n" + "\n".join(datos["failed"]))
+            self.status_label.setText("Error")
+        else:
+            QMessageBox.information(self, "Éxito", f"Capítulos guardados en: {datos['dir']}\nLista: {os.path.basename(lista)}")
+            self.status_label.setText("Listo")
+            self.progress_bar.setValue(100)
+
     def manual_update_check(self):
         check_for_updates(self, force=True)
@@ -0,0 +1,92 @@
+import threading
+
+from PySide6.QtCore import QIODevice, QObject, QUrl
+from PySide6.QtMultimedia import QAudioOutput, QMediaPlayer
+
+# Lo que espera como mucho cada lectura del reproductor a que lleguen más bytes
+READ_WAIT_SECONDS: float = 0.5
+# Al pasar de esto, lo ya reproducido se suelta de la memoria
+_COMPACT_BYTES: int = 1024 * 1024
+
+# Fuente de audio que se va llenando mientras se reproduce: feed() añade los bytes que
+# llegan del servicio (desde cualquier hilo) y el reproductor los lee según los necesita.
+# Si lee más rápido de lo que llegan, la lectura espera en lugar de dar el audio por
+# terminado; el final solo llega con finish().
+class StreamingAudioDevice(QIODevice):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._buffer = bytearray()
+        self._pos = 0
+        self._finished = False
+        self._cond = threading.Condition()
+        self.open(QIODevice.ReadOnly)
+
+    def feed(self, data):
+        with self._cond:
+            self._buffer += data
+            self._cond.notify_all()
+        self.readyRead.emit()
+
+    def finish(self):
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+        self.readyRead.emit()
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        with self._cond:
+            return len(self._buffer) - self._pos + super().bytesAvailable()
+
+    def atEnd(self):
+        with self._cond:
+            return self._finished and self._pos >= len(self._buffer)
+
+    def readData(self, maxlen):
+        # El reproductor lee desde su propio hilo, así que esperar aquí no congela la ventana
+        with self._cond:
+            self._cond.wait_for(lambda: self._finished or self._pos < len(self._buffer), READ_WAIT_SECONDS)
+            data = bytes(self._buffer[self._pos:self._pos + maxlen])
+            self._pos += len(data)
+            if self._pos >= _COMPACT_BYTES:
+                del self._buffer[:self._pos]
+                self._pos = 0
+            return data
+
+    def writeData(self, data):
+        return -1
+
+# Reproduce la vista previa de una voz mientras se genera
+class PreviewPlayer(QObject):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.audio_output = QAudioOutput(self)
+        self.player = QMediaPlayer(self)
+        self.player.setAudioOutput(self.audio_output)
+        self.device = None
+
+    def start(self):
+        # Prepara una fuente nueva; la reproducción empieza con play() al llegar el primer audio
+        self.stop()
+        # Sin padre Qt: el hilo de la vista previa puede seguir llamando a feed() un
+        # momento después de parar, y el objeto tiene que seguir vivo mientras tanto
+        self.device = StreamingAudioDevice()
+        return self.device
+
+    def play(self):
+        if self.device is not None:
+            self.player.setSourceDevice(self.device)
+            self.player.play()
+
+    def finish(self):
+        if self.device is not None:
+            self.device.finish()
+
+    def stop(self):
+        self.player.stop()
+        self.player.setSource(QUrl())
+        if self.device is not None:
+            self.device.finish()
+            self.device = None
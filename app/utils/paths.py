@@ -1,7 +1,6 @@
 import sys
 import os
 from pathlib import Path
-from typing import Union
 
 # Resuelve las rutas del sistema de archivos para desarrollo y producción
 # Asegura que los recursos se encuentren independientemente de si es un script o un ejecutable compilado
@@ -42,15 +41,9 @@ def get_resource_path(relative_path: str) -> str:
     return str(path)
 
 def get_config_path() -> str:
-    # Obtiene el directorio de configuración del usuario
-    
-    # En Windows, utiliza %APPDATA%
-    app_data: Union[str, None] = os.getenv('APPDATA')
-    if not app_data:
-        # Fallback genérico al directorio home
-        app_data = os.path.expanduser("~")
-        
-    config_dir: Path = Path(app_data) / 'Narralib' / 'config'
+    # Obtiene el directorio de configuración del usuario (~/.narralib): ahí van
+    # config.json y las carpetas de trabajos, caché y métricas
+    config_dir: Path = Path.home() / '.narralib'
     
     # Asegura que el directorio exista
     try:
@@ -0,0 +1,179 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Compara el posproceso de audio_post (numpy, en streaming y en una pasada) con lo mismo
+# hecho trozo a trozo con pydub (detect_leading_silence + apply_gain + concatenar).
+# El audio de entrada es sintético: trozos con ráfagas de "voz" a volúmenes distintos y
+# silencios de longitud variable delante y detrás, unidos con StreamingMp3Writer como en
+# una conversión de verdad. Cada camino corre en un proceso aparte para medir su memoria.
+# Hacen falta numpy, pydub y ffmpeg en el PATH.
+#
+#   python -m benchmarks.audio_post --chunks 60
+#   python -m benchmarks.audio_post --chunks 300 --skip-pydub
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core import audio_post
+from app.core.audio_builder import StreamingMp3Writer, mp3_duration
+from benchmarks.run import peak_rss_mb
+
+SAMPLE_RATE: int = 24000
+BITRATE: str = "48k"
+# Silencio más largo que esto en la salida cuenta como hueco entre trozos
+GAP_DETECT_MS: int = 150
+
+def _encode(pcm: "audio_post.np.ndarray") -> bytes:
+    return subprocess.run(["ffmpeg", "-v", "error", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "-",
+                           "-codec:a", "libmp3lame", "-b:a", BITRATE, "-f", "mp3", "-"],
+                          input=pcm.tobytes(), stdout=subprocess.PIPE, check=True).stdout
+
+def _synthetic_chunk(rng, level_db: float) -> "audio_post.np.ndarray":
+    np = audio_post.np
+    partes: List["np.ndarray"] = [np.zeros(int(rng.uniform(0.15, 1.2) * SAMPLE_RATE), dtype=np.float32)]
+    for _ in range(int(rng.integers(8, 25))):
+        # Una "palabra": ruido con envolvente y un tono, y una pausa corta que no se toca
+        n: int = int(rng.uniform(0.15, 0.5) * SAMPLE_RATE)
+        t = np.arange(n, dtype=np.float32) / SAMPLE_RATE
+        envolvente = np.sin(np.pi * np.arange(n) / n).astype(np.float32)
+        palabra = (0.6 * np.sin(2 * np.pi * rng.uniform(110, 220) * t) + 0.4 * rng.standard_normal(n)) * envolvente
+        partes.append(palabra.astype(np.float32))
+        partes.append(np.zeros(int(rng.uniform(0.04, 0.1) * SAMPLE_RATE), dtype=np.float32))
+    partes.append(np.zeros(int(rng.uniform(0.2, 1.5) * SAMPLE_RATE), dtype=np.float32))
+    x = np.concatenate(partes)
+    voz = x[np.abs(x) > 0]
+    x *= 10 ** (level_db / 20) / np.sqrt(np.mean(np.square(voz)))
+    return np.clip(np.round(x * 32768), -32768, 32767).astype(np.int16)
+
+def build_input(path: str, chunks: int, seed: int) -> Tuple[List[bytes], List[Tuple[int, int]]]:
+    # Devuelve el MP3 de cada trozo y dónde quedó cada uno dentro del archivo unido
+    rng = audio_post.np.random.default_rng(seed)
+    trozos: List[bytes] = [_encode(_synthetic_chunk(rng, rng.uniform(-32, -12))) for _ in range(chunks)]
+    finales: List[int] = []
+    writer = StreamingMp3Writer(path, on_commit=lambda n, nbytes: finales.append(nbytes))
+    for i, audio in enumerate(trozos):
+        writer.add(i, audio)
+    writer.finish()
+    return trozos, list(zip([0] + finales[:-1], finales))
+
+def measure(path: str, silence_db: float) -> Dict[str, float]:
+    # Huecos entre bloques de voz y dispersión del volumen de cada bloque
+    np = audio_post.np
+    ventana: int = SAMPLE_RATE * audio_post.WINDOW_MS // 1000
+    niveles = np.concatenate([audio_post.window_levels(b.astype(np.float32) / 32768, ventana)
+                              for b in audio_post._decode("ffmpeg", path, SAMPLE_RATE, 1)])
+    voz = niveles >= silence_db
+    huecos: List[int] = []
+    bloques: List[float] = []
+    inicio: Optional[int] = None
+    silencio: int = 0
+
+    def cerrar(fin: int) -> None:
+        bloque = niveles[inicio:fin]
+        bloque = bloque[bloque >= silence_db]
+        bloques.append(float(10 * np.log10(np.mean(np.power(10.0, bloque / 10)))))
+
+    for i, es_voz in enumerate(voz):
+        if es_voz:
+            if silencio * audio_post.WINDOW_MS >= GAP_DETECT_MS and inicio is not None:
+                huecos.append(silencio)
+                cerrar(i - silencio)
+                inicio = i
+            elif inicio is None:
+                inicio = i
+            silencio = 0
+        else:
+            silencio += 1
+    if inicio is not None:
+        cerrar(len(voz) - silencio)
+    return {
+        "audio_seconds": round(mp3_duration(path), 2),
+        "gaps": len(huecos),
+        "gap_max_ms": max(huecos, default=0) * audio_post.WINDOW_MS,
+        "gap_mean_ms": round(float(np.mean(huecos)) * audio_post.WINDOW_MS, 1) if huecos else 0.0,
+        "level_spread_db": round(float(np.std(bloques)), 2) if bloques else 0.0,
+    }
+
+def run_numpy(path: str, ranges: List[Tuple[int, int]], gap_ms: int, silence_db: float,
+              target_db: float) -> Dict[str, Any]:
+    inicio: float = time.perf_counter()
+    costuras: List[int] = audio_post.chunk_seams(path, ranges)
+    datos: Dict[str, Any] = audio_post.postprocess_mp3(path, costuras, gap_ms, silence_db, target_db)
+    return {"seconds": round(time.perf_counter() - inicio, 3), "peak_rss_mb": peak_rss_mb(),
+            "segments": datos["segments"], "trimmed_seconds": datos["trimmed_seconds"]}
+
+def run_pydub(chunks: List[bytes], output: str, gap_ms: int, silence_db: float, target_db: float) -> Dict[str, Any]:
+    # Lo mismo con pydub: cada trozo se decodifica entero y la salida se junta en memoria
+    from pydub import AudioSegment
+    from pydub.silence import detect_leading_silence
+
+    inicio: float = time.perf_counter()
+    salida = AudioSegment.empty()
+    silencio_previo: int = 0
+    for i, audio in enumerate(chunks):
+        trozo = AudioSegment.from_file(io.BytesIO(audio), format="mp3", codec="mp3")
+        delante: int = detect_leading_silence(trozo, silence_db, audio_post.WINDOW_MS)
+        detras: int = detect_leading_silence(trozo.reverse(), silence_db, audio_post.WINDOW_MS)
+        voz = trozo[delante:len(trozo) - detras]
+        ganancia: float = max(-audio_post.MAX_GAIN_DB, min(audio_post.MAX_GAIN_DB, target_db - voz.dBFS))
+        ganancia = min(ganancia, audio_post.PEAK_CEILING_DB - voz.max_dBFS)
+        salida += AudioSegment.silent(min(silencio_previo + delante, gap_ms), SAMPLE_RATE) + voz.apply_gain(ganancia)
+        silencio_previo = detras
+    salida += AudioSegment.silent(min(silencio_previo, gap_ms), SAMPLE_RATE)
+    salida.export(output, format="mp3", bitrate=BITRATE)
+    return {"seconds": round(time.perf_counter() - inicio, 3), "peak_rss_mb": peak_rss_mb(), "segments": len(chunks)}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Posproceso de audio con numpy frente a pydub")
+    parser.add_argument("--chunks", type=int, default=60, help="Trozos de audio sintético")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gap-ms", type=int, default=audio_post.DEFAULT_SEAM_GAP_MS)
+    parser.add_argument("--silence-db", type=float, default=audio_post.DEFAULT_SILENCE_DB)
+    parser.add_argument("--target-db", type=float, default=audio_post.DEFAULT_TARGET_DB)
+    parser.add_argument("--skip-pydub", action="store_true", help="Medir solo el camino de numpy")
+    args = parser.parse_args(argv)
+
+    if not audio_post.available():
+        print("Hacen falta numpy y ffmpeg para este benchmark.", file=sys.stderr)
+        return 2
+
+    ajustes = (args.gap_ms, args.silence_db, args.target_db)
+    with tempfile.TemporaryDirectory(prefix="narralib-post-") as tmp:
+        original: str = os.path.join(tmp, "input.mp3")
+        trozos, rangos = build_input(original, args.chunks, args.seed)
+        resultado: Dict[str, Any] = {
+            "params": {"chunks": args.chunks, "gap_ms": args.gap_ms, "silence_db": args.silence_db,
+                       "target_db": args.target_db},
+            "input": measure(original, args.silence_db),
+        }
+        # Cada camino en un proceso nuevo, para que el pico de memoria sea solo suyo
+        contexto = multiprocessing.get_context("spawn")
+        con_numpy: str = os.path.join(tmp, "numpy.mp3")
+        shutil.copyfile(original, con_numpy)
+        with ProcessPoolExecutor(1, mp_context=contexto) as pool:
+            resultado["numpy"] = pool.submit(run_numpy, con_numpy, rangos, *ajustes).result()
+        resultado["numpy"].update(measure(con_numpy, args.silence_db))
+        if not args.skip_pydub:
+            con_pydub: str = os.path.join(tmp, "pydub.mp3")
+            with ProcessPoolExecutor(1, mp_context=contexto) as pool:
+                resultado["pydub"] = pool.submit(run_pydub, trozos, con_pydub, *ajustes).result()
+            resultado["pydub"].update(measure(con_pydub, args.silence_db))
+            resultado["speedup"] = round(resultado["pydub"]["seconds"] / max(resultado["numpy"]["seconds"], 1e-9), 2)
+
+    json.dump(resultado, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    # Ningún hueco entre trozos debería pasar del objetivo (con margen por el MP3)
+    return 0 if resultado["numpy"]["gap_max_ms"] <= args.gap_ms + 4 * audio_post.WINDOW_MS else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
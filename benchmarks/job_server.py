@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Prueba del modo servidor en una sola máquina: un coordinador, varios trabajadores en
+# procesos aparte y el servidor TTS falso. Se puede matar a un trabajador a mitad para
+# comprobar que sus trozos caducan y los termina otro, y al final se verifica el MP3
+# trozo a trozo: el falso marca cada frame con su texto, así se ve si falta, sobra o
+# está fuera de sitio alguno.
+#
+#   python -m benchmarks.job_server --workers 4 --pages 200
+#   python -m benchmarks.job_server --workers 3 --kill 1 --lease-seconds 2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.job_server import JobCoordinator, JobWorker
+from app.core.tts_engine import HttpTTSBackend, iter_text_chunks
+from app.core.audio_builder import mp3_duration, iter_mp3_frames
+from app.core.pdf_reader import iter_pages
+from app.core.text_cleaner import clean_text_stream
+from app.core.config_manager import ConfigManager
+from app.core.audio_cache import AudioCache
+from app.core import metrics
+from benchmarks.synthetic_pdf import generate_pdf
+from benchmarks import mock_tts_server
+
+def _run_worker(server_url: str, tts_url: str, concurrency: int, name: str, cache_dir: str) -> None:
+    # Caché vacía y propia: si no, el PDF sintético (siempre igual) saldría entero de la caché
+    JobWorker(server_url, backend=HttpTTSBackend(tts_url), concurrency=concurrency, name=name,
+              cache=AudioCache(Path(cache_dir))).run()
+
+def _runs(marcas: List[Tuple[bytes, int]]) -> List[Tuple[bytes, int]]:
+    # Junta tramos seguidos con la misma marca (dos trozos con el mismo texto se ven como uno)
+    tramos: List[Tuple[bytes, int]] = []
+    for marca, frames in marcas:
+        if tramos and tramos[-1][0] == marca:
+            tramos[-1] = (marca, tramos[-1][1] + frames)
+        else:
+            tramos.append((marca, frames))
+    return tramos
+
+def check_chunks(pdf_path: str, mp3_path: str, chunk_chars: int) -> Dict[str, Any]:
+    # Corta el PDF como el coordinador y compara, en orden, la marca y los frames de cada trozo
+    paginas = clean_text_stream(iter_pages(pdf_path), strip_headers=bool(ConfigManager().get("strip_headers", True)))
+    esperados = _runs([(mock_tts_server.text_tag(texto), mock_tts_server.frames_for_text(texto))
+                       for texto in iter_text_chunks(paginas, chunk_chars)])
+    recibidos = _runs([(mock_tts_server.frame_tag(frame), 1) for _, frame in iter_mp3_frames(mp3_path)])
+    malos: List[int] = [i for i, (a, b) in enumerate(zip(esperados, recibidos)) if a != b]
+    malos += list(range(min(len(esperados), len(recibidos)), max(len(esperados), len(recibidos))))
+    return {"chunks_checked": len(esperados), "chunks_received": len(recibidos),
+            "chunks_mismatched": len(malos), "first_bad_chunk": malos[0] if malos else None}
+
+def run_cluster(pages: int, workers: int, kill: int, concurrency: int, latency: float,
+                lease_seconds: float, chunk_chars: Optional[int], port: int, tts_port: int) -> Dict[str, Any]:
+    servidor_tts = mock_tts_server.start_in_background(tts_port, latency)
+    procesos: List[multiprocessing.Process] = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="narralib-cluster-") as tmp:
+            pdf_path: str = generate_pdf(os.path.join(tmp, "cluster.pdf"), pages)
+            salida: str = os.path.join(tmp, "cluster.mp3")
+
+            coordinador = JobCoordinator(lease_seconds=lease_seconds, token="", chunk_chars=chunk_chars)
+            job_id: str = coordinador.submit(pdf_path, salida, "es-ES-AlvaroNeural", "+0%")
+            # El coordinador corre en un hilo de este proceso para poder mirar su estado al final
+            hilo = threading.Thread(target=asyncio.run,
+                                    args=(coordinador.serve("127.0.0.1", port, until_done=True),), daemon=True)
+            hilo.start()
+
+            for i in range(workers):
+                proceso = multiprocessing.Process(target=_run_worker, daemon=True,
+                                                  args=(f"http://127.0.0.1:{port}", f"http://127.0.0.1:{tts_port}",
+                                                        concurrency, f"worker-{i + 1}",
+                                                        os.path.join(tmp, f"cache-{i + 1}")))
+                proceso.start()
+                procesos.append(proceso)
+
+            # A mitad se matan trabajadores que tienen trozos prestados, sin dejarles avisar
+            muertos: int = 0
+            while muertos < kill and hilo.is_alive():
+                if coordinador.jobs[job_id].chunks_done > 0:
+                    for datos in list(coordinador.workers.values()):
+                        proceso = procesos[int(datos["name"].rsplit("-", 1)[1]) - 1]
+                        if datos["leases"] and proceso.is_alive() and muertos < kill:
+                            proceso.kill()
+                            muertos += 1
+                time.sleep(0.05)
+
+            hilo.join()
+            trabajo: Dict[str, Any] = coordinador.jobs[job_id].to_dict()
+            # Desde que se puso en cola hasta que el MP3 quedó cerrado
+            segundos: float = (coordinador.jobs[job_id].finished or time.time()) - coordinador.jobs[job_id].submitted
+            contadores: Dict[str, float] = metrics.current().to_dict()["counters"]
+            resultado: Dict[str, Any] = {
+                "params": {"pages": pages, "workers": workers, "killed": muertos, "concurrency": concurrency,
+                           "latency": latency, "lease_seconds": lease_seconds},
+                "state": trabajo["state"],
+                "message": trabajo["message"],
+                "chunks": trabajo["chunks"],
+                "seconds": round(segundos, 3),
+                "chars_per_s": round(trabajo["chars_done"] / segundos, 1),
+                "chunks_leased": contadores.get("chunks_leased", 0),
+                "chunks_reassigned": contadores.get("chunks_reassigned", 0),
+                "chunks_duplicate": contadores.get("chunks_duplicate", 0),
+                "workers_lost": contadores.get("workers_lost", 0),
+            }
+            if trabajo["state"] == "done":
+                resultado["audio_seconds"] = round(mp3_duration(salida), 2)
+                resultado.update(check_chunks(pdf_path, salida, coordinador.chunk_chars))
+            return resultado
+    finally:
+        for proceso in procesos:
+            proceso.kill()
+            proceso.join()
+        servidor_tts.terminate()
+        servidor_tts.join()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba del modo servidor con varios trabajadores locales")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--kill", type=int, default=1, help="Trabajadores que se matan a mitad")
+    parser.add_argument("--concurrency", type=int, default=2, help="Trozos a la vez por trabajador")
+    parser.add_argument("--latency", type=float, default=0.1, help="Segundos hasta el primer byte del TTS falso")
+    parser.add_argument("--lease-seconds", type=float, default=2.0)
+    parser.add_argument("--chunk-chars", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8797)
+    parser.add_argument("--tts-port", type=int, default=8798)
+    args = parser.parse_args(argv)
+
+    resultado = run_cluster(args.pages, args.workers, min(args.kill, args.workers - 1), args.concurrency,
+                            args.latency, args.lease_seconds, args.chunk_chars, args.port, args.tts_port)
+    json.dump(resultado, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    ok: bool = resultado["state"] == "done" and resultado["chunks_mismatched"] == 0
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from benchmarks.mock_tts_server import _wait_for_port
+
+# Servidor falso que hace de API de GitHub para probar el actualizador: contesta
+# /repos/<repo>/releases/latest con una release que tiene un ZIP (y, según el modo,
+# su sha256 en "digest" o en un SHA256SUMS aparte) y sirve el ZIP con peticiones de rango.
+#
+#   python -m benchmarks.mock_release_server release.zip --version 9.9.9 --throughput 2000000
+
+def build_app(asset_path: str, version: str, throughput: Optional[float] = None, ranges: bool = True,
+              drop_after: Optional[int] = None, drops: int = 0, checksum: str = "digest") -> web.Application:
+    # throughput: bytes/s por conexión (None = sin límite). ranges=False ignora Range y manda todo.
+    # drop_after/drops: las primeras `drops` respuestas se cortan tras enviar drop_after bytes.
+    # checksum: "digest" (campo del asset), "sums" (archivo SHA256SUMS), "wrong" o "none".
+    with open(asset_path, "rb") as f:
+        suma: str = hashlib.sha256(f.read()).hexdigest()
+    nombre: str = os.path.basename(asset_path)
+    tamano: int = os.path.getsize(asset_path)
+    estado = {"drops": drops}
+
+    async def latest(request: web.Request) -> web.Response:
+        base: str = f"http://{request.host}"
+        asset = {"name": nombre, "size": tamano, "browser_download_url": f"{base}/download/{nombre}"}
+        assets = [asset]
+        if checksum == "digest":
+            asset["digest"] = f"sha256:{suma}"
+        elif checksum == "wrong":
+            asset["digest"] = f"sha256:{'0' * 64}"
+        elif checksum == "sums":
+            assets.append({"name": "SHA256SUMS", "size": 0, "browser_download_url": f"{base}/download/SHA256SUMS"})
+        return web.json_response({"tag_name": f"v{version}", "html_url": f"{base}/releases/v{version}",
+                                  "assets": assets})
+
+    async def sums(request: web.Request) -> web.Response:
+        return web.Response(text=f"{suma}  {nombre}\n")
+
+    async def download(request: web.Request) -> web.StreamResponse:
+        inicio, fin = 0, tamano
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get("Range", ""))
+        if ranges and m:
+            inicio, fin = int(m.group(1)), min(tamano, int(m.group(2)) + 1 if m.group(2) else tamano)
+            response = web.StreamResponse(status=206, headers={
+                "Content-Range": f"bytes {inicio}-{fin - 1}/{tamano}", "Accept-Ranges": "bytes"})
+        else:
+            response = web.StreamResponse(status=200)
+        response.content_length = fin - inicio
+
+        cortar: Optional[int] = None
+        if drop_after is not None and estado["drops"] > 0:
+            estado["drops"] -= 1
+            cortar = drop_after
+        bloque: int = 16 * 1024
+        enviado: int = 0
+        empezado: float = time.monotonic()
+        try:
+            await response.prepare(request)
+            with open(asset_path, "rb") as f:
+                f.seek(inicio)
+                while enviado < fin - inicio:
+                    datos: bytes = f.read(min(bloque, fin - inicio - enviado))
+                    if cortar is not None and enviado + len(datos) > cortar:
+                        # Se corta la conexión a mitad, como una red que se cae
+                        await response.write(datos[:max(0, cortar - enviado)])
+                        request.transport.close()
+                        return response
+                    await response.write(datos)
+                    enviado += len(datos)
+                    if throughput:
+                        adelanto: float = enviado / throughput - (time.monotonic() - empezado)
+                        if adelanto > 0:
+                            await asyncio.sleep(adelanto)
+            await response.write_eof()
+        except ConnectionResetError:
+            # El cliente cerró antes (canceló o no quería la respuesta entera)
+            pass
+        return response
+
+    app = web.Application()
+    app.router.add_get("/repos/{owner}/{repo}/releases/latest", latest)
+    app.router.add_get("/download/SHA256SUMS", sums)
+    app.router.add_get(f"/download/{nombre}", download)
+    return app
+
+def serve(asset_path: str, version: str, host: str = "127.0.0.1", port: int = 8799, **kwargs) -> None:
+    web.run_app(build_app(asset_path, version, **kwargs), host=host, port=port, print=None)
+
+def start_in_background(asset_path: str, version: str, port: int, **kwargs) -> multiprocessing.Process:
+    proceso = multiprocessing.Process(target=serve, args=(asset_path, version, "127.0.0.1", port),
+                                      kwargs=kwargs, daemon=True)
+    proceso.start()
+    _wait_for_port(port)
+    return proceso
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API de releases falsa para probar el actualizador")
+    parser.add_argument("asset", help="ZIP que se sirve como asset de la release")
+    parser.add_argument("--version", default="9.9.9")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--throughput", type=float, default=None, help="Bytes/s por conexión")
+    parser.add_argument("--no-ranges", action="store_true")
+    parser.add_argument("--checksum", choices=("digest", "sums", "wrong", "none"), default="digest")
+    args = parser.parse_args()
+    serve(args.asset, args.version, port=args.port, throughput=args.throughput, ranges=not args.no_ranges,
+          checksum=args.checksum)
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import random
+import time
+from typing import Optional
+
+from aiohttp import web
+
+# Servidor TTS falso para pruebas y benchmarks. Habla el mismo protocolo que
+# tts_engine.HttpTTSBackend: POST /synthesize con {"text", "voice", "rate"} y
+# devuelve MP3 (frames MPEG-2 layer III de 24 kHz mono a 48 kbps, como Edge)
+# con una duración proporcional al texto. Cada frame lleva en sus datos (que
+# un reproductor ignora) el principio del sha256 del texto, así se puede comprobar
+# trozo a trozo qué texto acabó en cada parte de un MP3.
+
+# Un frame de silencio: 144 bytes = 576 muestras a 24 kHz = 24 ms de audio
+FRAME: bytes = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+FRAME_SECONDS: float = 576 / 24000
+# Dónde va la marca del texto: pasada la información lateral y los huecos Xing/VBRI
+TAG_OFFSET: int = 40
+TAG_SIZE: int = 8
+# Velocidad de habla aproximada para calcular cuánto audio corresponde a un texto
+CHARS_PER_AUDIO_SECOND: float = 15.0
+
+def text_tag(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:TAG_SIZE]
+
+def frames_for_text(text: str) -> int:
+    segundos: float = max(FRAME_SECONDS, len(text) / CHARS_PER_AUDIO_SECOND)
+    return max(1, int(segundos / FRAME_SECONDS))
+
+def audio_for_text(text: str) -> bytes:
+    frame: bytes = FRAME[:TAG_OFFSET] + text_tag(text) + FRAME[TAG_OFFSET + TAG_SIZE:]
+    return frame * frames_for_text(text)
+
+# Marca de cada frame de un MP3 hecho con este servidor
+def frame_tag(frame: bytes) -> bytes:
+    return frame[TAG_OFFSET:TAG_OFFSET + TAG_SIZE]
+
+def build_app(latency: float = 0.0, throughput: Optional[float] = None,
+              capacity: Optional[int] = None, error_rate: float = 0.0) -> web.Application:
+    # latency: segundos hasta el primer byte. throughput: bytes/s de envío (None = sin límite).
+    # capacity: peticiones a la vez antes de contestar 429. error_rate: fracción de 500 al azar.
+    en_curso: int = 0
+
+    async def synthesize(request: web.Request) -> web.StreamResponse:
+        nonlocal en_curso
+        if capacity is not None and en_curso >= capacity:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        if error_rate and random.random() < error_rate:
+            return web.Response(status=500)
+        en_curso += 1
+        try:
+            return await _synthesize(request)
+        finally:
+            en_curso -= 1
+
+    async def _synthesize(request: web.Request) -> web.StreamResponse:
+        datos = await request.json()
+        audio: bytes = audio_for_text(datos.get("text", ""))
+        await asyncio.sleep(latency)
+
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        bloque: int = 4096
+        inicio: float = time.monotonic()
+        try:
+            await response.prepare(request)
+            for pos in range(0, len(audio), bloque):
+                await response.write(audio[pos:pos + bloque])
+                if throughput:
+                    # Esperamos lo necesario para no pasar de la velocidad pedida
+                    adelanto: float = (pos + bloque) / throughput - (time.monotonic() - inicio)
+                    if adelanto > 0:
+                        await asyncio.sleep(adelanto)
+            await response.write_eof()
+        except ConnectionResetError:
+            # El cliente se fue a mitad (canceló o lo mataron)
+            pass
+        return response
+
+    app = web.Application()
+    app.router.add_post("/synthesize", synthesize)
+    return app
+
+def serve(host: str = "127.0.0.1", port: int = 8765, latency: float = 0.0,
+          throughput: Optional[float] = None, capacity: Optional[int] = None, error_rate: float = 0.0) -> None:
+    web.run_app(build_app(latency, throughput, capacity, error_rate), host=host, port=port, print=None)
+
+# Arranca el servidor en otro proceso para no competir por el GIL con lo que se mide
+def start_in_background(port: int, latency: float = 0.0, throughput: Optional[float] = None,
+                        capacity: Optional[int] = None, error_rate: float = 0.0) -> multiprocessing.Process:
+    proceso = multiprocessing.Process(target=serve, args=("127.0.0.1", port, latency, throughput, capacity, error_rate),
+                                      daemon=True)
+    proceso.start()
+    _wait_for_port(port)
+    return proceso
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    import socket
+    limite: float = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"El servidor TTS falso no arrancó en el puerto {port}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor TTS falso para pruebas")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos hasta el primer byte")
+    parser.add_argument("--throughput", type=float, default=None, help="Bytes por segundo por petición")
+    parser.add_argument("--capacity", type=int, default=None, help="Peticiones a la vez antes de contestar 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que fallan con 500")
+    args = parser.parse_args()
+    serve(port=args.port, latency=args.latency, throughput=args.throughput,
+          capacity=args.capacity, error_rate=args.error_rate)
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Benchmark de punta a punta: genera PDFs sintéticos y los pasa por cada etapa
+# (iter_pages, clean_text_stream, TTSEngine contra un servidor TTS falso y
+# StreamingMp3Writer), midiendo la velocidad de cada una y el pico de memoria.
+#
+#   python -m benchmarks.run --pages 200 --layout two_column --latency 0.05
+#   python -m benchmarks.run --save-baseline     # guarda los resultados como referencia
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.pdf_reader import iter_pages, text_cache
+from app.core.text_cleaner import clean_text_stream
+from app.core.tts_engine import TTSEngine, HttpTTSBackend, split_text, DEFAULT_CHUNK_CHARS
+from app.core.audio_builder import StreamingMp3Writer, mp3_duration
+from benchmarks.synthetic_pdf import generate_pdf, LAYOUTS
+from benchmarks import mock_tts_server
+
+BASELINE_PATH: Path = Path(__file__).resolve().parent / "baseline.json"
+# Diferencia a partir de la cual marcamos una etapa como más lenta que la referencia
+REGRESSION_THRESHOLD: float = 0.10
+
+def peak_rss_mb() -> Optional[float]:
+    # Pico de memoria del proceso; en Windows no hay módulo resource
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+def run_benchmark(pages: int, layout: str, latency: float, throughput: Optional[float],
+                  concurrency: int, extract_workers: int, chunk_chars: int, port: int) -> Dict[str, Any]:
+    resultados: Dict[str, Any] = {
+        "params": {
+            "pages": pages, "layout": layout, "latency": latency, "throughput": throughput,
+            "concurrency": concurrency, "extract_workers": extract_workers, "chunk_chars": chunk_chars,
+        },
+        "stages": {},
+    }
+    etapas: Dict[str, Dict[str, float]] = resultados["stages"]
+
+    servidor = mock_tts_server.start_in_background(port, latency, throughput)
+    try:
+        with tempfile.TemporaryDirectory(prefix="narralib-bench-") as tmp:
+            pdf_path: str = generate_pdf(os.path.join(tmp, "bench.pdf"), pages, layout)
+
+            # Etapa 1: extracción. El PDF generado es siempre el mismo, así que se saca
+            # antes de la caché de texto para medir fitz; luego se mide leerlo desde ella.
+            cache = text_cache()
+            if cache is not None:
+                cache.invalidate(pdf_path)
+            inicio = time.perf_counter()
+            paginas: List[str] = list(iter_pages(pdf_path, extract_workers))
+            raw_chars: int = sum(len(p) for p in paginas)
+            t = time.perf_counter() - inicio
+            etapas["extract"] = {"seconds": t, "pages_per_s": pages / t, "peak_rss_mb": peak_rss_mb()}
+
+            if cache is not None:
+                inicio = time.perf_counter()
+                list(iter_pages(pdf_path, extract_workers))
+                t = time.perf_counter() - inicio
+                etapas["extract_cached"] = {"seconds": t, "pages_per_s": pages / t}
+
+            # Etapa 2: limpieza
+            inicio = time.perf_counter()
+            texto: str = " ".join(clean_text_stream(paginas))
+            t = time.perf_counter() - inicio
+            etapas["clean"] = {"seconds": t, "chars_per_s": raw_chars / max(t, 1e-9),
+                               "chars_in": raw_chars, "chars_out": len(texto), "peak_rss_mb": peak_rss_mb()}
+
+            # Etapa 3: síntesis contra el servidor falso
+            # (el audio se va escribiendo en orden en el archivo final, como en la conversión real)
+            chunks: List[str] = split_text(texto, chunk_chars)
+            salida: str = os.path.join(tmp, "bench.mp3")
+            writer = StreamingMp3Writer(salida)
+
+            tts = TTSEngine(HttpTTSBackend(f"http://127.0.0.1:{port}"))
+            inicio = time.perf_counter()
+            if not tts.synthesize_stream(enumerate(chunks), writer.add, max_concurrency=concurrency):
+                raise RuntimeError("Falló la síntesis contra el servidor falso")
+            t_tts = time.perf_counter() - inicio
+
+            # Etapa 4: cierre del archivo (cabecera Xing, fsync y renombrado)
+            inicio = time.perf_counter()
+            writer.finish()
+            t = time.perf_counter() - inicio
+            segundos_audio: float = mp3_duration(salida)
+            etapas["tts"] = {
+                "seconds": t_tts, "chunks": len(chunks), "chars_per_s": len(texto) / t_tts,
+                "audio_s_per_s": segundos_audio / t_tts, "peak_rss_mb": peak_rss_mb(),
+            }
+            etapas["mux"] = {"seconds": t, "audio_s_per_s": segundos_audio / max(t, 1e-9), "peak_rss_mb": peak_rss_mb()}
+
+            resultados["audio_seconds"] = segundos_audio
+            resultados["chars"] = len(texto)
+            resultados["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        servidor.terminate()
+        servidor.join()
+
+    return resultados
+
+def compare(resultados: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    # Compara cada métrica de velocidad (las que acaban en _per_s) con la referencia
+    lineas: List[str] = []
+    if baseline.get("params") != resultados.get("params"):
+        lineas.append("Aviso: la referencia se tomó con otros parámetros")
+    for etapa, metricas in resultados["stages"].items():
+        base = baseline.get("stages", {}).get(etapa, {})
+        for nombre, valor in metricas.items():
+            if not nombre.endswith("_per_s") or not base.get(nombre):
+                continue
+            cambio: float = valor / base[nombre] - 1
+            marca: str = "  << más lento" if cambio < -REGRESSION_THRESHOLD else ""
+            lineas.append(f"{etapa:8s} {nombre:14s} {valor:12.1f}  ({cambio:+.1%} vs referencia){marca}")
+    return lineas
+
+def print_report(resultados: Dict[str, Any]) -> None:
+    for etapa, metricas in resultados["stages"].items():
+        partes = [f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in metricas.items()]
+        print(f"{etapa:8s} " + "  ".join(partes))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta de Narralib")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--layout", choices=LAYOUTS, default="plain")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos hasta el primer byte del TTS falso")
+    parser.add_argument("--throughput", type=float, default=None, help="Bytes/s por petición del TTS falso")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--extract-workers", type=int, default=1)
+    parser.add_argument("--chunk-chars", type=int, default=DEFAULT_CHUNK_CHARS)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--json", action="store_true", help="Imprimir los resultados en JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar los resultados como referencia")
+    args = parser.parse_args(argv)
+
+    resultados = run_benchmark(args.pages, args.layout, args.latency, args.throughput,
+                               args.concurrency, args.extract_workers, args.chunk_chars, args.port)
+
+    if args.json:
+        json.dump(resultados, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_report(resultados)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f"Referencia guardada en {BASELINE_PATH}", file=sys.stderr)
+    elif BASELINE_PATH.exists():
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for linea in compare(resultados, baseline):
+            print(linea, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
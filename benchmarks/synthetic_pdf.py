@@ -0,0 +1,48 @@
+import random
+from typing import List
+
+try:
+    import pymupdf as fitz
+except ImportError:
+    import fitz
+
+# Genera PDFs sintéticos para los benchmarks, con distintas maquetaciones:
+#   plain          una columna de texto corrido
+#   two_column     dos columnas por página
+#   header_footer  una columna con encabezado, pie y número de página en cada hoja
+LAYOUTS = ("plain", "two_column", "header_footer")
+
+_WORDS: List[str] = (
+    "el la de que y en un una los las por con para como más pero sus le ya o "
+    "libro capítulo lectura texto voz audio página historia tiempo mundo vida "
+    "estudio ejemplo resultado análisis método teoría forma parte caso manera"
+).split()
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    oraciones = []
+    for _ in range(sentences):
+        palabras = [rng.choice(_WORDS) for _ in range(rng.randint(8, 22))]
+        oraciones.append(" ".join(palabras).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+    return " ".join(oraciones)
+
+def generate_pdf(path: str, pages: int, layout: str = "plain", seed: int = 0) -> str:
+    if layout not in LAYOUTS:
+        raise ValueError(f"Maquetación desconocida: {layout}")
+
+    rng = random.Random(seed)
+    documento = fitz.open()
+    for numero in range(1, pages + 1):
+        pagina = documento.new_page(width=595, height=842)  # A4
+        if layout == "two_column":
+            pagina.insert_textbox(fitz.Rect(50, 60, 290, 790), _paragraph(rng, 14), fontsize=9)
+            pagina.insert_textbox(fitz.Rect(305, 60, 545, 790), _paragraph(rng, 14), fontsize=9)
+        else:
+            pagina.insert_textbox(fitz.Rect(60, 70, 535, 770), _paragraph(rng, 26), fontsize=10)
+
+        if layout == "header_footer":
+            pagina.insert_text((60, 40), "Revista de Ejemplo · Volumen 12", fontsize=8)
+            pagina.insert_text((290, 810), str(numero), fontsize=8)
+
+    documento.save(path)
+    documento.close()
+    return path
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Prueba del actualizador contra una API de releases falsa (mock_release_server): mide la
+# descarga con una y con varias peticiones de rango, la corta a mitad para ver que sigue
+# donde se quedó, comprueba que un sha256 que no coincide no deja nada instalado y que la
+# versión preparada se pone en su sitio en una carpeta de instalación de prueba.
+#
+#   python -m benchmarks.update_download --size-mb 16 --throughput 4000000 --parts 4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.update_download import (download_latest, UpdateDownloader, ChecksumMismatch,
+                                      apply_pending_update, pending_update)
+from app.core import metrics
+from benchmarks import mock_release_server
+
+VERSION: str = "9.9.9"
+
+def build_release(path: str, size_mb: int) -> str:
+    # Un ZIP como el de las releases: una carpeta con el ejecutable y sus archivos
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("Narralib/Narralib.exe", os.urandom(size_mb * 1024 * 1024))
+        z.writestr("Narralib/lib/version.txt", VERSION)
+    return path
+
+def _download(asset: str, directory: str, port: int, parts: int,
+              on_progress: Optional[Callable[[int, int], None]] = None,
+              downloader: Optional[Callable[[UpdateDownloader], None]] = None, **server) -> Dict[str, Any]:
+    servidor = mock_release_server.start_in_background(asset, VERSION, port, **server)
+    antes: Dict[str, float] = dict(metrics.current().to_dict()["counters"])
+    inicio: float = time.monotonic()
+    resultado: Dict[str, Any] = {}
+    try:
+        info, preparada = asyncio.run(download_latest("1.0.0", f"http://127.0.0.1:{port}", parts,
+                                                      on_progress, Path(directory), downloader))
+        resultado.update({"ok": preparada is not None, "staged": str(preparada) if preparada else None})
+    except ChecksumMismatch as e:
+        resultado.update({"ok": False, "checksum_mismatch": True, "error": str(e)})
+    finally:
+        servidor.terminate()
+        servidor.join()
+    segundos: float = time.monotonic() - inicio
+    despues: Dict[str, float] = metrics.current().to_dict()["counters"]
+    resultado["seconds"] = round(segundos, 3)
+    resultado["mb_per_s"] = round(os.path.getsize(asset) / (1024 * 1024) / segundos, 2)
+    for contador in ("update_retries", "update_resumed_bytes", "update_ranges_unsupported",
+                     "update_checksum_mismatches"):
+        resultado[contador] = despues.get(contador, 0) - antes.get(contador, 0)
+    return resultado
+
+def run_checks(size_mb: int, throughput: float, parts: int, port: int) -> Dict[str, Any]:
+    resultados: Dict[str, Any] = {"params": {"size_mb": size_mb, "throughput": throughput, "parts": parts}}
+    comprobaciones: Dict[str, bool] = {}
+    with tempfile.TemporaryDirectory(prefix="narralib-update-") as tmp:
+        asset: str = build_release(os.path.join(tmp, "Narralib-win64.zip"), size_mb)
+
+        def carpeta(nombre: str) -> str:
+            return os.path.join(tmp, nombre)
+
+        # Una conexión frente a varias, con la velocidad de cada conexión limitada
+        resultados["single"] = _download(asset, carpeta("single"), port, 1, throughput=throughput)
+        resultados["parallel"] = _download(asset, carpeta("parallel"), port, parts, throughput=throughput)
+        resultados["speedup"] = round(resultados["single"]["seconds"] / resultados["parallel"]["seconds"], 2)
+        comprobaciones["parallel"] = resultados["parallel"]["ok"] and resultados["speedup"] > 1.5
+
+        # Conexiones que se caen a mitad: cada parte sigue desde lo recibido
+        resultados["drops"] = _download(asset, carpeta("drops"), port, parts, drop_after=512 * 1024, drops=parts * 2)
+        comprobaciones["drops"] = resultados["drops"]["ok"] and resultados["drops"]["update_retries"] > 0
+
+        # Se cancela a mitad (como al cerrar la aplicación) y se vuelve a empezar
+        descargas: List[UpdateDownloader] = []
+
+        def cortar(hecho: int, total: int) -> None:
+            if hecho > total // 2:
+                descargas[-1].cancel()
+
+        resultados["cancelled"] = _download(asset, carpeta("resume"), port, parts, cortar, descargas.append,
+                                            throughput=throughput)
+        resultados["resumed"] = _download(asset, carpeta("resume"), port, parts, throughput=throughput)
+        comprobaciones["resume"] = (not resultados["cancelled"]["ok"] and resultados["resumed"]["ok"]
+                                    and resultados["resumed"]["update_resumed_bytes"] > 0)
+
+        # Servidor sin Range y sumas en un SHA256SUMS aparte
+        resultados["no_ranges"] = _download(asset, carpeta("no_ranges"), port, parts, ranges=False, checksum="sums")
+        comprobaciones["no_ranges"] = (resultados["no_ranges"]["ok"]
+                                       and resultados["no_ranges"]["update_ranges_unsupported"] == 1)
+
+        # Un sha256 que no coincide no deja nada preparado
+        resultados["wrong_hash"] = _download(asset, carpeta("wrong"), port, parts, checksum="wrong")
+        comprobaciones["wrong_hash"] = (resultados["wrong_hash"].get("checksum_mismatch", False)
+                                        and pending_update(Path(carpeta("wrong"))) is None)
+
+        # Instalación en el siguiente arranque sobre una carpeta con la versión vieja
+        instalacion: Path = Path(carpeta("install"))
+        (instalacion / "lib").mkdir(parents=True)
+        (instalacion / "Narralib.exe").write_bytes(b"viejo")
+        (instalacion / "lib" / "version.txt").write_text("1.0.0")
+        aplicada: Optional[str] = apply_pending_update(instalacion, Path(carpeta("parallel")))
+        nueva: bool = (instalacion / "lib" / "version.txt").read_text() == VERSION
+        viejos: int = len(list(instalacion.rglob("*.old")))
+        apply_pending_update(instalacion, Path(carpeta("parallel")))
+        resultados["apply"] = {"version": aplicada, "new_files": nueva, "old_files": viejos,
+                               "old_files_after_restart": len(list(instalacion.rglob("*.old")))}
+        comprobaciones["apply"] = (aplicada == VERSION and nueva and viejos == 2
+                                   and resultados["apply"]["old_files_after_restart"] == 0
+                                   and pending_update(Path(carpeta("parallel"))) is None)
+    resultados["checks"] = comprobaciones
+    return resultados
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba del actualizador contra una API de releases falsa")
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--throughput", type=float, default=4_000_000, help="Bytes/s por conexión")
+    parser.add_argument("--parts", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args(argv)
+
+    resultado = run_checks(args.size_mb, args.throughput, args.parts, args.port)
+    json.dump(resultado, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if all(resultado["checks"].values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
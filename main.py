@@ -1,9 +1,25 @@
 import sys
-from PySide6.QtWidgets import QApplication
-from app.ui.main_window import MainWindow
+import multiprocessing
+
+# Subcomandos que se atienden desde la consola, sin abrir la ventana
+CLI_COMMANDS = ("convert", "preview", "estimate", "serve", "worker", "submit", "update")
 
 # Este es el punto de entrada, el archivo que inica todo.
 def main():
+    # Si nos piden un subcomando, usamos la línea de comandos y no cargamos Qt
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS + ("-h", "--help"):
+        from app.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    # Una actualización ya descargada se instala antes de cargar nada más y se arranca la versión nueva
+    from app.core.update_download import apply_pending_update, relaunch
+    if apply_pending_update():
+        relaunch()
+        sys.exit(0)
+
+    from PySide6.QtWidgets import QApplication
+    from app.ui.main_window import MainWindow
+
     # Creamos la aplicación Qt
     app = QApplication(sys.argv)
     
@@ -16,4 +32,6 @@ def main():
 
 # Ejecución principal
 if __name__ == "__main__":
+    # Necesario para que el pool de procesos de lectura del PDF funcione en el ejecutable compilado
+    multiprocessing.freeze_support()
     main()